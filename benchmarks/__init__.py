@@ -0,0 +1 @@
+"""Benchmarks of the formatter, run with python -m benchmarks.<name>."""
@@ -0,0 +1,47 @@
+"""Time the bracket stages of the pipeline.
+
+bracket_to_weights is timed against bracket_to_weights_indexed, and
+remove_mismatched_brackets on growing numbers of unbalanced brackets.
+
+Run from the repository root with `python -m benchmarks.bench_brackets`.
+"""
+
+import timeit
+
+from scripts import prompt_formatting_pipeline as pipeline
+
+
+def weights():
+    for groups in (10, 50, 200):
+        prompt = ", ".join(f"((tag{i}), [[other{i}]], (a, (b)))" for i in range(groups))
+        number = max(1, 2000 // groups)
+        for fn in (pipeline.bracket_to_weights, pipeline.bracket_to_weights_indexed):
+            seconds = timeit.timeit(lambda fn=fn: fn(prompt), number=number)
+            print(
+                f"{fn.__name__:>26} {len(prompt):>6} chars: "
+                f"{seconds / number * 1e3:8.2f} ms/prompt"
+            )
+
+
+def mismatched():
+    for count in (10_000, 20_000, 40_000, 80_000):
+        # Stray openings, stray closings and mismatched pairs, as in scraped prompts
+        prompt = "tag, (a], b), [(c, d" * (count // 5)
+        number = 5
+        seconds = timeit.timeit(
+            lambda prompt=prompt: pipeline.remove_mismatched_brackets(prompt),
+            number=number,
+        ) / number
+        print(
+            f"remove_mismatched_brackets {count:>6} brackets: "
+            f"{seconds * 1e3:8.2f} ms, {seconds / count * 1e9:6.1f} ns/bracket"
+        )
+
+
+def main():
+    weights()
+    mismatched()
+
+
+if __name__ == "__main__":
+    main()
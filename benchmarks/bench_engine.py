@@ -0,0 +1,31 @@
+"""Time the formatting engine against the reference pipeline.
+
+Run from the repository root with `python -m benchmarks.bench_engine`.
+"""
+
+import timeit
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_pipeline as pipeline
+
+
+prompt = (
+    "photorealistic   photo of a handsome male (wizard  :1.2）， "  # noqa: RUF001
+    "<lora:LuisapHotlineStyle:0.5> <lora:ElegantHanfuRuqunStyle:0.2>    short_beard, "
+    "white wizard  shirt, (with golden    trim:0.8), (((bald)), "
+    "a, [[b, [c, [A:B], [A|B], [A :1.2 AND B :1.2]], e]]"
+)
+
+
+def main():
+    number = 2000
+    for name, fn in (
+        ("reference", pipeline.format_prompt),
+        ("engine", engine.format_prompt),
+    ):
+        seconds = timeit.timeit(lambda fn=fn: fn(prompt), number=number)
+        print(f"{name:>10}: {seconds / number * 1e6:8.1f} us/prompt")
+
+
+if __name__ == "__main__":
+    main()
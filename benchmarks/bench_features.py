@@ -0,0 +1,47 @@
+"""Time PromptFormatter with and without skipping stages by feature.
+
+Run from the repository root with `python -m benchmarks.bench_features`.
+"""
+
+import random
+import timeit
+
+from benchmarks import generator
+from scripts.prompt_formatting_definitions import FormatOptions, UnderSpaceEnum
+from scripts.prompt_formatting_formatter import PromptFormatter
+
+
+def every_stage(formatter: PromptFormatter):
+    def format_prompt(prompt: str):
+        for stage in formatter.stages:
+            prompt = stage(prompt)
+        return prompt
+
+    return format_prompt
+
+
+def main():
+    rng = random.Random(0)
+    corpora = {
+        "plain": [generator.plain(rng, 30) for _ in range(50)],
+        "realistic": [generator.realistic(rng) for _ in range(50)],
+        "fullwidth": [generator.fullwidth(generator.plain(rng, 30)) for _ in range(50)],
+    }
+    number = 20
+    for mode in (UnderSpaceEnum.IGNORE, UnderSpaceEnum.SPACE):
+        formatter = PromptFormatter(FormatOptions(prefer_spacing=mode))
+        for kind, prompts in corpora.items():
+            times = []
+            for fn in (every_stage(formatter), formatter.format):
+                seconds = timeit.timeit(
+                    lambda fn=fn: [fn(p) for p in prompts], number=number
+                )
+                times.append(seconds / number / len(prompts) * 1e6)
+            print(
+                f"{mode.value:>10} {kind:>10}: every stage {times[0]:8.1f} us, "
+                f"skipping {times[1]:8.1f} us, {times[0] / times[1]:5.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Import time of the formatter without webui, against a budget.
+
+Run from the repository root with `python -m benchmarks.bench_import`. Every
+module is imported in a fresh interpreter under `python -X importtime`,
+several times, and the median time spent in the extension's own modules is
+compared to the budget. The time of third party modules such as regex is
+reported apart, as it is not ours to cut. Exits with status 1 if a module
+goes over the budget or imports webui.
+
+Our modules are compiled to bytecode first. Compiling them is paid once
+when their .pyc files are written, not on every import, but without those
+files, e.g. with PYTHONDONTWRITEBYTECODE set, it is paid on every import.
+"""
+
+import argparse
+import compileall
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+
+# Modules the CLI, batch workers and the API start from
+MODULES = [
+    "scripts.prompt_formatting_cli",
+    "scripts.prompt_formatting_batch",
+    "scripts.prompt_formatting_segments",
+]
+# Milliseconds of our own modules' import time, patterns compiled lazily
+BUDGET_MS = 10.0
+WEBUI = ("gradio", "modules", "fastapi", "torch")
+
+
+def import_times(module: str):
+    """Self and cumulative microseconds of every module imported by module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    ret = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if name.strip() == "site":  # everything so far came with the interpreter
+            ret.clear()
+            continue
+        ret[name.strip()] = (int(self_us), int(cumulative_us))
+    return ret
+
+
+def measure(module: str, repeat: int):
+    """Median milliseconds of our modules, of the whole import, and webui imports."""
+    own, total = [], []
+    imported = set()
+    for _ in range(repeat):
+        times = import_times(module)
+        own.append(
+            sum(s for name, (s, _) in times.items() if name.startswith("scripts"))
+        )
+        total.append(times[module][1])
+        imported |= times.keys()
+    webui = sorted(name for name in imported if name.split(".")[0] in WEBUI)
+    return statistics.median(own) / 1000, statistics.median(total) / 1000, webui
+
+
+def slowest(module: str, count: int):
+    """Return the count modules with the most self time, by top level package."""
+    packages = defaultdict(int)
+    for name, (self_us, _) in import_times(module).items():
+        packages[name if name.startswith("scripts") else name.split(".")[0]] += self_us
+    return sorted(packages.items(), key=lambda item: -item[1])[:count]
+
+
+def main(argv: list | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_import")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=BUDGET_MS, help="ms")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    scripts = Path(__file__).resolve().parent.parent / "scripts"
+    compileall.compile_dir(scripts, maxlevels=0, quiet=1)
+
+    failed = False
+    for module in MODULES:
+        own, total, webui = measure(module, args.repeat)
+        over = own > args.budget or webui
+        failed |= bool(over)
+        print(
+            f"{module:>36}: own {own:6.1f} ms, total {total:6.1f} ms"
+            + (f", imports {', '.join(webui)}" if webui else "")
+            + (" OVER BUDGET" if own > args.budget else "")
+        )
+        if args.verbose:
+            for name, self_us in slowest(module, 8):
+                print(f"{'':>38}{name:<36} {self_us / 1000:6.1f} ms")
+
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
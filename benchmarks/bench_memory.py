@@ -0,0 +1,60 @@
+"""Memory of a prompt corpus as parsed nodes against lists of tag strings.
+
+Run from the repository root with `python -m benchmarks.bench_memory`, or
+`--count 100000` for a quicker run. Memory is traced with tracemalloc while
+each representation is built from the same prompts.
+"""
+
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+
+from benchmarks import generator
+from scripts import prompt_formatting_nodes as nodes
+from scripts import prompt_formatting_pipeline as pipeline
+
+
+def traced(build, prompts: list):
+    """Return the bytes held by what build returns for prompts, and seconds."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = build(prompts)
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size, seconds
+
+
+def tag_lists(prompts: list):
+    return [pipeline.tokenize(prompt, strip=True) for prompt in prompts]
+
+
+def parsed(prompts: list):
+    nodes.clear()
+    return [nodes.parse(prompt) for prompt in prompts]
+
+
+def main(argv: list | None = None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_memory")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    rng = random.Random(args.seed)
+    prompts = [generator.realistic(rng, rng.randint(5, 40)) for _ in range(args.count)]
+    raw = sum(sys.getsizeof(prompt) for prompt in prompts)
+    print(f"{args.count} prompts, {raw / 2**20:.1f} MiB as strings")
+
+    for name, build in (("lists of tags", tag_lists), ("nodes", parsed)):
+        size, seconds = traced(build, prompts)
+        print(
+            f"{name:>14}: {size / 2**20:8.1f} MiB, {size / args.count:6.0f} B/prompt, "
+            f"built in {seconds:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Seeded generator of realistic and adversarial prompts.
+
+Every function takes a random.Random, so a corpus is reproducible from its
+seed alone.
+"""
+
+import random
+
+
+# Cumulative odds of a tag being plain, weighted and nested in parentheses,
+# it is in square brackets otherwise
+TAG_ODDS = (0.6, 0.75, 0.9)
+
+tags = [
+    "1girl", "solo", "long_hair", "looking at viewer", "smile", "blush",
+    "short hair", "open_mouth", "blue eyes", "brown_hair", "black hair",
+    "simple background", "white_background", "thighhighs", "dress", "hat",
+    "masterpiece", "best quality", "highly detailed", "8k", "photorealistic",
+    "cinematic lighting", "depth_of_field", "bokeh", "outdoors", "sky",
+    "cloud", "day", "night", "city", "forest", "ocean", "flower", "cherry blossoms",
+    "upper_body", "full body", "from side", "portrait", "wizard", "armor",
+    "sword", "holding", "standing", "sitting", "red_eyes", "twintails",
+    "ponytail", "school uniform", "jacket", "glasses",
+]
+
+negative_tags = [
+    "lowres", "bad anatomy", "bad hands", "text", "error", "missing fingers",
+    "extra digit", "fewer digits", "cropped", "worst quality", "low quality",
+    "jpeg artifacts", "signature", "watermark", "username", "blurry",
+]
+
+
+def chance(rng: random.Random, odds: float):
+    return rng.random() < odds
+
+
+def spacing(rng: random.Random):
+    return rng.choice(["", " ", " ", " ", "  ", "\t", "   "])
+
+
+def comma(rng: random.Random):
+    return spacing(rng) + rng.choice([",", ",", ",", ",,"]) + spacing(rng)
+
+
+def weighted(rng: random.Random, tag: str):
+    plain, weight, nest = TAG_ODDS
+    choice = rng.random()
+    if choice < plain:
+        return tag
+    if choice < weight:
+        before, after = spacing(rng), spacing(rng)
+        return f"({tag}{before}:{after}{rng.choice([0.8, 1.1, 1.2, 1.35])})"
+    if choice < nest:
+        depth = rng.randint(1, 3)
+        return "(" * depth + tag + ")" * depth
+    return "[" * rng.randint(1, 2) + tag + "]" * rng.randint(1, 2)
+
+
+def tag_list(rng: random.Random, count: int, vocabulary: list = tags):
+    parts = [weighted(rng, rng.choice(vocabulary)) for _ in range(count)]
+    ret = parts[0] if parts else ""
+    for part in parts[1:]:
+        ret += comma(rng) + part
+    return ret
+
+
+def plain(rng: random.Random, count: int):
+    """Tag list of plain ASCII tags without any brackets, the most common."""
+    parts = [rng.choice(tags) for _ in range(count)]
+    return "".join(part + comma(rng) for part in parts[:-1]) + parts[-1]
+
+
+def nested(rng: random.Random, depth: int):
+    """Nest tags depth deep, mixing groups that do and do not mirror."""
+    ret = rng.choice(tags)
+    for _ in range(depth):
+        bracket = rng.choice("((([")
+        closing = ")" if bracket == "(" else "]"
+        if chance(rng, 0.3):
+            ret = f"{bracket}{ret}, {rng.choice(tags)}{closing}"
+        else:
+            ret = f"{bracket}{ret}{closing}"
+    return ret
+
+
+def networks(rng: random.Random, count: int):
+    return " ".join(
+        f"<{rng.choice(['lora', 'lora', 'hypernet', 'lyco'])}:"
+        f"style_{rng.randint(0, 99)}:{rng.choice([0.4, 0.6, 0.8, 1])}>"
+        for _ in range(count)
+    )
+
+
+def composition(rng: random.Random, parts: int):
+    return f"{spacing(rng)}AND{spacing(rng)}".join(
+        f"{tag_list(rng, rng.randint(2, 6))} :{rng.choice([0.5, 1, 1.2])}"
+        for _ in range(parts)
+    )
+
+
+def editing(rng: random.Random):
+    a, b = rng.sample(tags, 2)
+    return rng.choice(
+        [
+            f"[{a}:{b}:{rng.choice([0.2, 0.5, 10])}]",
+            f"[{a}:{rng.choice([0.3, 5])}]",
+            f"[{a}|{b}]",
+            f"{{{a}|{b}|{rng.choice(tags)}}}",
+            f"[{a}{spacing(rng)}:{spacing(rng)}{b}{spacing(rng)}:0.5]",
+        ]
+    )
+
+
+def fullwidth(text: str):
+    """Shift printable ASCII to its full-width form, as pasted from IMEs."""
+    return "".join(
+        chr(ord(c) + 0xFEE0) if "!" <= c <= "~" else "　" if c == " " else c
+        for c in text
+    )
+
+
+def realistic(rng: random.Random, count: int = 30):
+    parts = [tag_list(rng, count)]
+    if chance(rng, 0.5):
+        parts.append(networks(rng, rng.randint(1, 4)))
+    if chance(rng, 0.3):
+        parts.append(editing(rng))
+    if chance(rng, 0.2):
+        parts.append("BREAK" + spacing(rng) + tag_list(rng, count // 3))
+    rng.shuffle(parts)
+    return comma(rng).join(parts)
+
+
+def unbalanced(rng: random.Random, count: int):
+    return "".join(rng.choice("()[]{}<>a ") for _ in range(count))
+
+
+def adversarial(rng: random.Random, count: int):
+    """Join pieces that make backtracking patterns slow.
+
+    The pieces are networks left open before underscored tags, long runs of
+    spaces and colons, and escaped brackets.
+    """
+    pieces = []
+    for tag in rng.choices(tags, k=count):
+        pieces.append(
+            rng.choice(
+                [
+                    "<" + tag.replace(" ", "_") + "_",
+                    tag + " " * rng.randint(8, 32),
+                    tag + ":" * rng.randint(4, 16),
+                    "\\(" + tag + "\\)",
+                    tag + "AND",
+                ]
+            )
+        )
+    return ",".join(pieces)
+
+
+kinds = {
+    "realistic": realistic,
+    "negative": lambda rng: tag_list(rng, 20, negative_tags),
+    "long_tags": lambda rng: tag_list(rng, 200),
+    "deep": lambda rng: nested(rng, 50),
+    "networks": lambda rng: tag_list(rng, 10) + ", " + networks(rng, 40),
+    "composition": lambda rng: composition(rng, 4),
+    "editing": lambda rng: ", ".join(editing(rng) for _ in range(20)),
+    "fullwidth": lambda rng: fullwidth(realistic(rng)),
+    "unbalanced": lambda rng: unbalanced(rng, 500),
+    "adversarial": lambda rng: adversarial(rng, 100),
+}
+
+
+def corpus(seed: int = 0, size: int = 20):
+    """Return {kind: [prompt, ...]} with size prompts of every kind."""
+    rng = random.Random(seed)
+    return {kind: [make(rng) for _ in range(size)] for kind, make in kinds.items()}
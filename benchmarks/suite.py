@@ -0,0 +1,307 @@
+"""Time every pipeline stage and the full format_prompt on a seeded corpus.
+
+Each stage is timed on the input it sees in the reference chain, so the
+numbers add up to what format_prompt spends on a prompt. Scaling curves show
+how each stage grows with prompt length, with nesting depth, and with the
+length of adversarial prompts built to make patterns backtrack.
+
+Run from the repository root:
+python -m benchmarks.suite --save baseline.json
+python -m benchmarks.suite --compare baseline.json --threshold 0.25
+
+Comparing exits with status 1 if any timing is slower than its baseline by
+more than the threshold.
+"""
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import timeit
+from pathlib import Path
+
+from benchmarks import generator
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_mapping as mapping
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts.prompt_formatting_formatter import PromptFormatter
+
+
+# Every stage of pipeline.format_prompt in order, then the extra string to
+# string functions of the pipeline
+stages = [
+    ("normalize_characters", pipeline.normalize_characters),
+    ("remove_mismatched_brackets", pipeline.remove_mismatched_brackets),
+    ("remove_whitespace_excessive", pipeline.remove_whitespace_excessive),
+    ("space_to_underscore", pipeline.space_to_underscore),
+    ("align_brackets", pipeline.align_brackets),
+    ("space_and", pipeline.space_and),
+    ("space_bracekts", pipeline.space_bracekts),
+    ("align_colons", pipeline.align_colons),
+    ("align_commas", pipeline.align_commas),
+    ("align_alternating", pipeline.align_alternating),
+    ("bracket_to_weights", pipeline.bracket_to_weights),
+]
+extras = [
+    ("bracket_to_weights_indexed", pipeline.bracket_to_weights_indexed),
+    ("mismatched_brackets", pipeline.mismatched_brackets),
+    ("index_brackets", pipeline.index_brackets),
+    ("tokenize", pipeline.tokenize),
+    ("get_mappings", mapping.get_mappings),
+    ("engine.normalize_spacing", engine.normalize_spacing),
+]
+formatters = [
+    ("format_prompt", pipeline.format_prompt),
+    ("engine.format_prompt", engine.format_prompt),
+    ("formatter.format_within", lambda prompt: formatter.format_within(prompt, 1)),
+]
+formatter = PromptFormatter()
+
+lengths = (25, 50, 100, 200, 400, 800)
+depths = (1, 2, 5, 10, 20, 50)
+# Axis, its sizes and the generator of a prompt of each size
+curves = (
+    ("length", lengths, generator.tag_list),
+    ("depth", depths, generator.nested),
+    ("adversarial", lengths, generator.adversarial),
+)
+
+
+def stage_inputs(prompt: str):
+    """Return the input each stage gets for prompt in the reference chain.
+
+    Stages after one that raises are not run and get no input.
+    """
+    ret = {}
+    for name, fn in stages:
+        ret[name] = prompt
+        try:
+            prompt = fn(prompt)
+        except Exception:
+            break
+
+    for name, _ in extras:
+        ret[name] = ret["normalize_characters"]
+    del ret["bracket_to_weights_indexed"]
+    if "bracket_to_weights" in ret:
+        ret["bracket_to_weights_indexed"] = ret["bracket_to_weights"]
+    if "remove_whitespace_excessive" in ret:
+        ret["engine.normalize_spacing"] = ret["remove_whitespace_excessive"]
+    return ret
+
+
+def runs(fn, prompts: list):
+    """Return fn over prompts if it runs on all of them, else None."""
+    try:
+        for prompt in prompts:
+            fn(prompt)
+    except Exception:
+        return None
+    return lambda: [fn(prompt) for prompt in prompts]
+
+
+def measure(fn, prompts: list, *, budget: float, repeat: int):
+    """Best of repeat mean seconds per prompt, None if fn raises.
+
+    Each repeat runs fn over all prompts as many times as fit in budget.
+    """
+    call = runs(fn, prompts)
+    if call is None or not prompts:
+        return None
+
+    timer = timeit.Timer(call)
+    once = max(timer.timeit(1), 1e-7)
+    number = max(1, int(budget / once))
+    return min(timer.repeat(repeat, number)) / number / len(prompts)
+
+
+def measure_corpus(corpus: dict, *, budget: float, repeat: int):
+    results = {}
+    for kind, prompts in corpus.items():
+        inputs = [stage_inputs(prompt) for prompt in prompts]
+        for name, fn in stages + extras:
+            staged = [i[name] for i in inputs if name in i]
+            if len(staged) == len(prompts):
+                results[f"stage/{name}/{kind}"] = measure(
+                    fn, staged, budget=budget, repeat=repeat
+                )
+            else:
+                results[f"stage/{name}/{kind}"] = None
+
+        for name, fn in formatters:
+            results[f"end_to_end/{name}/{kind}"] = measure(
+                fn, prompts, budget=budget, repeat=repeat
+            )
+    return results
+
+
+def measure_curves(*, seed: int, budget: float, repeat: int):
+    results = {}
+    for axis, sizes, make in curves:
+        rng = random.Random(seed)
+        for size in sizes:
+            prompt = make(rng, size)
+            inputs = stage_inputs(prompt)
+            for name, fn in stages + extras:
+                results[f"scaling/{axis}/{name}/{size}"] = (
+                    measure(fn, [inputs[name]], budget=budget, repeat=repeat)
+                    if name in inputs
+                    else None
+                )
+            for name, fn in formatters:
+                results[f"scaling/{axis}/{name}/{size}"] = measure(
+                    fn, [prompt], budget=budget, repeat=repeat
+                )
+    return results
+
+
+def run(*, seed: int = 0, size: int = 5, budget: float = 0.02, repeat: int = 3):
+    corpus = generator.corpus(seed, size)
+    results = measure_corpus(corpus, budget=budget, repeat=repeat)
+    results.update(measure_curves(seed=seed, budget=budget, repeat=repeat))
+    return {
+        "meta": {
+            "seed": seed,
+            "size": size,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def slope(points: list):
+    """Log-log growth between the first and last point, 1 is linear."""
+    if len(points) <= 1:
+        return None
+    (x0, y0), (x1, y1) = points[0], points[-1]
+    if x0 == x1:
+        return None
+    return math.log(y1 / y0) / math.log(x1 / x0)
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "error"
+    if seconds * 1e3 >= 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def report(results: dict, out=sys.stdout):
+    names = [name for name, _ in stages + extras + formatters]
+
+    kinds = list(generator.kinds)
+    print(f"{'per prompt':<28}" + "".join(f"{k:>13}" for k in kinds), file=out)
+    for name in names:
+        group = "end_to_end" if name in dict(formatters) else "stage"
+        row = [results.get(f"{group}/{name}/{kind}") for kind in kinds]
+        cells = "".join(f"{format_seconds(s):>13}" for s in row)
+        print(f"{name:<28}{cells}", file=out)
+
+    for axis, sizes, _ in curves:
+        print(file=out)
+        print(
+            f"{axis:<28}" + "".join(f"{s:>11}" for s in sizes) + f"{'growth':>8}",
+            file=out,
+        )
+        for name in names:
+            row = [results.get(f"scaling/{axis}/{name}/{s}") for s in sizes]
+            growth = slope([(s, t) for s, t in zip(sizes, row) if t])
+            print(
+                f"{name:<28}"
+                + "".join(f"{format_seconds(t):>11}" for t in row)
+                + (f"{growth:>8.2f}" if growth is not None else f"{'-':>8}"),
+                file=out,
+            )
+
+
+def compare(results: dict, baseline: dict, *, threshold: float, floor: float = 1e-6):
+    """Return (metric, baseline, now, ratio) of every regression.
+
+    A metric regresses when it is more than threshold slower than its
+    baseline, or fails where the baseline did not. Metrics faster than floor
+    in both runs are too noisy to compare and are skipped.
+    """
+    ret = []
+    for metric, before in baseline.items():
+        if before is None or metric not in results:
+            continue
+
+        now = results[metric]
+        if now is None:
+            ret.append((metric, before, now, math.inf))
+            continue
+        if max(before, now) < floor:
+            continue
+
+        ratio = now / before
+        if ratio > 1 + threshold:
+            ret.append((metric, before, now, ratio))
+    return ret
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.suite",
+        description="Time pipeline stages and compare against a baseline.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=5, help="prompts per kind")
+    parser.add_argument(
+        "--budget", type=float, default=0.02, help="seconds per timing repeat"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25,
+        help="allowed slowdown before a timing is a regression, 0.25 is 25%%",
+    )
+    parser.add_argument("-q", "--quiet", action="store_true", help="no report")
+    return parser.parse_args(argv)
+
+
+def main(argv: list | None = None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        with Path(args.compare).open(encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    seed, size = args.seed, args.size
+    if baseline is not None:
+        # Compare like with like
+        seed, size = baseline["meta"]["seed"], baseline["meta"]["size"]
+
+    data = run(seed=seed, size=size, budget=args.budget, repeat=args.repeat)
+    if not args.quiet:
+        report(data["results"])
+
+    if args.save:
+        with Path(args.save).open("w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    if baseline is None:
+        return 0
+
+    regressions = compare(
+        data["results"], baseline["results"], threshold=args.threshold
+    )
+    for metric, before, now, ratio in regressions:
+        print(
+            f"REGRESSION {metric}: {format_seconds(before)} -> "
+            f"{format_seconds(now)} ({ratio:.2f}x)",
+            file=sys.stderr,
+        )
+    if regressions:
+        return 1
+
+    print(f"no regressions over {args.threshold:.0%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Differential fuzzing of the formatter against the reference pipeline."""
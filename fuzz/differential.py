@@ -0,0 +1,546 @@
+"""Differential fuzzing of faster engines against the reference pipeline.
+
+Random prompts from fuzz.grammar go through a reference function of
+prompt_formatting_pipeline and a candidate that must give the same output.
+Every mismatch, and every prompt the candidate raises on, is shrunk to a
+minimal prompt that still fails the same way.
+
+Prompts the reference raises on are flagged, separately when get_weight is
+the one raising, and skipped. A sample of prompts is grown by repeating and
+by nesting them, flagging any function whose runtime grows superlinearly.
+
+Run from the repository root:
+python -m fuzz.differential --count 5000
+python -m fuzz.differential --target bracket_to_weights --seed 3 --json found.jsonl
+
+Exits with status 1 if any mismatch, candidate error or superlinear growth
+is found.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import timeit
+from collections import Counter
+from collections.abc import Callable
+from enum import Enum
+from pathlib import Path
+from typing import NamedTuple
+
+import regex as re
+
+from fuzz import grammar
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import (
+    FormatOptions,
+    MergeEnum,
+    NetworkEnum,
+    UnderSpaceEnum,
+)
+from scripts.prompt_formatting_formatter import get_formatter
+
+
+class Target(NamedTuple):
+    reference: Callable
+    candidate: Callable
+    prepare: Callable = lambda prompt, _: prompt
+    weights_only: bool = False  # only changes how weights are written
+
+
+class Finding(NamedTuple):
+    kind: str
+    target: str
+    prompt: str
+    options: FormatOptions
+    detail: str = ""
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "target": self.target,
+            "prompt": self.prompt,
+            "options": {
+                key: value.value if isinstance(value, Enum) else value
+                for key, value in self.options._asdict().items()
+            },
+            "detail": self.detail,
+        }
+
+
+# Stages of pipeline.format_prompt before bracket_to_weights, in order
+chain = [
+    ("normalize_characters", lambda p, _: pipeline.normalize_characters(p)),
+    ("remove_mismatched_brackets", lambda p, _: pipeline.remove_mismatched_brackets(p)),
+    (
+        "remove_whitespace_excessive",
+        lambda p, _: pipeline.remove_whitespace_excessive(p),
+    ),
+    (
+        "space_to_underscore",
+        lambda p, o: pipeline.space_to_underscore(p, mode=o.prefer_spacing),
+    ),
+    ("align_brackets", lambda p, _: pipeline.align_brackets(p)),
+    ("space_and", lambda p, _: pipeline.space_and(p)),
+    ("space_bracekts", lambda p, _: pipeline.space_bracekts(p)),
+    ("align_colons", lambda p, _: pipeline.align_colons(p)),
+    ("align_commas", lambda p, o: pipeline.align_commas(p, do_it=o.space_commas)),
+    ("align_alternating", lambda p, _: pipeline.align_alternating(p)),
+]
+chain_names = [name for name, _ in chain]
+
+
+def run_chain(
+    prompt: str,
+    options: FormatOptions,
+    start: str | None = None,
+    stop: str | None = None,
+):
+    """Run the stages of chain from start up to, not including, stop."""
+    first = chain_names.index(start) if start else 0
+    last = chain_names.index(stop) if stop else len(chain)
+    for _, fn in chain[first:last]:
+        prompt = fn(prompt, options)
+    return prompt
+
+
+def reference_spacing(prompt: str, options: FormatOptions):
+    options = options._replace(prefer_spacing=UnderSpaceEnum.IGNORE)
+    return run_chain(prompt, options, start="remove_whitespace_excessive")
+
+
+targets = {
+    "format_prompt": Target(
+        lambda p, o: pipeline.format_prompt(p, **o._asdict()),
+        lambda p, o: engine.format_prompt(p, **o._asdict()),
+    ),
+    "formatter": Target(
+        lambda p, o: pipeline.format_prompt(p, **o._asdict()),
+        lambda p, o: get_formatter(o).format(p),
+    ),
+    "normalize_spacing": Target(
+        reference_spacing,
+        lambda p, o: engine.normalize_spacing(p, space_commas=o.space_commas),
+        lambda p, o: run_chain(p, o, stop="remove_whitespace_excessive"),
+    ),
+    "bracket_to_weights": Target(
+        lambda p, _: pipeline.bracket_to_weights(p),
+        lambda p, _: pipeline.bracket_to_weights_indexed(p),
+        run_chain,
+        weights_only=True,
+    ),
+}
+
+# Targets whose reference is the whole pipeline.format_prompt
+end_to_end = {"format_prompt", "formatter"}
+
+# Findings that fail a run, the others are only reported
+failures = {"mismatch", "candidate raises", "superlinear"}
+
+# Chance of space_commas and bracket2weight being on in random options
+ENABLED = 0.8
+# Chance of flatten_weights, split_weights and pack_chunks being on
+EXTRA = 0.3
+
+re_new_weight = re.compile(r":\d+\.\d\d(?=\))")
+re_bare_weight = re.compile(r"(?<=[)\]])(\d+\.\d\d)(?=\))")
+re_group_weight = re.compile(r":\s*(\d+(?:\.\d*)?)\s*$")
+no_brackets = str.maketrans("", "", "()[]")
+re_split_brackets = re.compile(r"([()\[\]])")
+
+# Ways to grow a prompt n times, and the n to time growth between. Nesting
+# starts deep so the brackets, not the prompt, dominate its length.
+growths = {
+    "repeat": (lambda prompt, n: ", ".join([prompt] * n), (4, 32)),
+    "nest": (lambda prompt, n: "(" * n + prompt + ")" * n, (32, 256)),
+}
+
+
+def raised_in(error: BaseException, name: str):
+    """Whether error was raised by a function called name."""
+    tb = error.__traceback__
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    return tb.tb_frame.f_code.co_name == name
+
+
+def call(fn, prompt: str, options: FormatOptions):
+    """Return (result, None), or (None, error) if fn raises."""
+    try:
+        return fn(prompt, options), None
+    except Exception as e:
+        return None, e
+
+
+def check(name: str, target: Target, prompt: str, options: FormatOptions):
+    """Compare the candidate of target to its reference on prompt.
+
+    Return a Finding, or None if both agree.
+    """
+    prepared, error = call(target.prepare, prompt, options)
+    if error is not None:
+        return Finding("prepare raises", name, prompt, options, repr(error))
+
+    expected, error = call(target.reference, prepared, options)
+    if error is not None:
+        kind = "reference raises"
+        if raised_in(error, "get_weight"):
+            kind = "get_weight raises"
+        return Finding(kind, name, prompt, options, repr(error))
+
+    got, error = call(target.candidate, prepared, options)
+    if error is not None:
+        return Finding("candidate raises", name, prompt, options, repr(error))
+    if got != expected:
+        detail = f"expected {expected!r}, got {got!r}"
+        kind = known_divergence(
+            prepared, expected, got, weights_only=target.weights_only
+        )
+        kind = kind or "mismatch"
+        if kind == "mismatch" and name in end_to_end:
+            kind = weights_divergence(prepared, options, got) or kind
+        return Finding(kind, name, prompt, options, detail)
+    return None
+
+
+def known_divergence(
+    prompt: str, expected: str, got: str, *, weights_only: bool = False
+):
+    """Name a documented way the reference is wrong, if it explains a mismatch.
+
+    The reference has no notion of escaped brackets. bracket_to_weights can
+    drop text after a run of brackets that only partly mirrors, or convert
+    only part of the run, leaving brackets that no longer match. It writes
+    some weights after a closing bracket without their colon.
+
+    With weights_only, a candidate giving every character the weight it has
+    in the prompt, see char_weights, is right however it writes it. The
+    reference leaves brackets out of a partly mirrored run as they are, and
+    square brackets alone when a : or | is anywhere in or after them, where
+    bracket_to_weights_indexed only keeps those directly holding one. It
+    also moves text out of some nested runs, changing its weight.
+    """
+    if "\\" in prompt:
+        return "known: escapes"
+
+    kind = dropped(expected, got)
+    if kind is None and weights_only:
+        kind = reweighted(prompt, re_bare_weight.sub(r":\1", expected), got)
+    if (
+        kind is None
+        and pipeline.mismatched_brackets(expected).find(1) != -1
+        and pipeline.mismatched_brackets(got).find(1) == -1
+    ):
+        kind = "known: reference unbalances brackets"
+    return kind
+
+
+def dropped(expected: str, got: str):
+    """Name the text or colons of weights the reference dropped, if any."""
+    colons = re_bare_weight.sub(r":\1", expected)
+    expected_text = text(colons)
+    if len(expected_text) < len(text(got)) and drops_after_closing(expected_text, got):
+        return "known: reference drops text"
+    if colons == got:
+        return "known: reference drops colons"
+    return None
+
+
+def drops_after_closing(expected_text: str, got: str):
+    """Whether expected_text is got's text with only text after ) or ] cut.
+
+    When it rewrites a run of brackets that only partly mirrors, the
+    reference drops the characters right after the closing brackets, up to
+    the next bracket. Any other text missing, added or changed is not that.
+    """
+    pieces = re_split_brackets.split(re_new_weight.sub("", got))
+    # Positions in expected_text reachable after each piece
+    reachable = {0}
+    for i in range(0, len(pieces), 2):
+        piece = pieces[i]
+        cuttable = i and pieces[i - 1] in ")]"
+        cuts = range(len(piece) + 1) if cuttable else (0,)
+        reachable = {
+            pos + len(piece) - cut
+            for pos in reachable
+            for cut in cuts
+            if expected_text.startswith(piece[cut:], pos)
+        }
+    return len(expected_text) in reachable
+
+
+def reweighted(prompt: str, expected: str, got: str):
+    """Name a mismatch where got weights every character as prompt does."""
+    weights = char_weights(prompt)
+    if not same_weights(char_weights(got), weights):
+        return None
+    if same_weights(char_weights(expected), weights):
+        return "known: same weights"
+    return "known: reference changes weights"
+
+
+def same_weights(a: list, b: list):
+    """Whether two char_weights are the same text, weighted within rounding."""
+    if a is None or b is None or len(a) != len(b):
+        return False
+    return all(
+        c == d and math.isclose(x, y, rel_tol=0.05) for (c, x), (d, y) in zip(a, b)
+    )
+
+
+def char_weights(output: str):
+    """Weight webui gives every character of output but whitespace, in order.
+
+    A ( group multiplies by its weight, 1.1 without one, and a [ group
+    divides by 1.1. Return [(character, weight), ...], or None if brackets
+    do not match.
+    """
+    pairs = {}
+    stack = []
+    for i, c in enumerate(output):
+        if c in "([":
+            stack.append(i)
+        elif c in ")]":
+            if not stack:
+                return None
+            pairs[stack.pop()] = i
+    if stack:
+        return None
+
+    groups = [(len(output), 1.0, len(output))]  # (end, weight, weight text start)
+    ret = []
+    for i, c in enumerate(output):
+        end, weight, text_start = groups[-1]
+        if i == end:
+            groups.pop()
+        elif i in pairs:
+            match = c == "(" and re_group_weight.search(output, i + 1, pairs[i])
+            factor = float(match[1]) if match else 1.1 if c == "(" else 1 / 1.1
+            groups.append(
+                (pairs[i], weight * factor, match.start() if match else pairs[i])
+            )
+        elif not c.isspace() and i < text_start:
+            ret.append((c, weight))
+    return ret
+
+
+def weights_divergence(prompt: str, options: FormatOptions, got: str):
+    """Name a mismatch of format_prompt that bracket_to_weights alone explains.
+
+    Those are found, and named, by the bracket_to_weights target.
+    """
+    if not options.bracket2weight:
+        return None
+    try:
+        weighted = pipeline.bracket_to_weights_indexed(run_chain(prompt, options))
+        weighted = run_after_weights(weighted, options)
+    except Exception:
+        return None
+    return "known: bracket_to_weights" if weighted == got else None
+
+
+def run_after_weights(prompt: str, options: FormatOptions):
+    """Run the stages of pipeline.format_prompt after bracket_to_weights."""
+    if options.flatten_weights or options.split_weights:
+        prompt = pipeline.fold_weights(
+            prompt, split=options.split_weights, precision=options.weight_precision
+        )
+    if options.networks != NetworkEnum.KEEP or options.merge_networks != MergeEnum.NONE:
+        prompt = pipeline.partition_networks(
+            prompt,
+            networks=options.networks,
+            merge=options.merge_networks,
+            space_commas=options.space_commas,
+        )
+    if options.pack_chunks:
+        prompt = tokens.pack(prompt, space_commas=options.space_commas)
+    return prompt.strip()
+
+
+def text(output: str):
+    """Output without the weights bracket_to_weights writes and brackets."""
+    return re_new_weight.sub("", output).translate(no_brackets)
+
+
+def shrink(prompt: str, fails: Callable[[str], bool]):
+    """Shrink prompt to a minimal one that still fails.
+
+    Chunks are removed, halving their size until single characters, then
+    every character is simplified to 'a' or ' ' if that still fails.
+    """
+    size = max(len(prompt) // 2, 1)
+    while size >= 1:
+        i = 0
+        while i < len(prompt):
+            smaller = prompt[:i] + prompt[i + size :]
+            if smaller != prompt and fails(smaller):
+                prompt = smaller
+            else:
+                i += size
+        size //= 2
+
+    for i, c in enumerate(prompt):
+        for simpler in "a ":
+            if c == simpler or (c.isalnum() and c.isascii()):
+                break
+            smaller = prompt[:i] + simpler + prompt[i + 1 :]
+            if fails(smaller):
+                prompt = smaller
+                break
+    return prompt
+
+
+def shrink_finding(finding: Finding):
+    target = targets[finding.target]
+
+    def fails(prompt):
+        found = check(finding.target, target, prompt, finding.options)
+        return found is not None and found.kind == finding.kind
+
+    prompt = shrink(finding.prompt, fails)
+    return check(finding.target, target, prompt, finding.options)
+
+
+def seconds(fn, prompt: str, options: FormatOptions):
+    """Best of 3 seconds of fn on prompt, None if it raises."""
+    if call(fn, prompt, options)[1] is not None:
+        return None
+    timer = timeit.Timer(lambda: fn(prompt, options))
+    once = max(timer.timeit(1), 1e-7)
+    number = max(1, int(0.01 / once))
+    return min(timer.repeat(3, number)) / number
+
+
+def check_growth(
+    name: str,
+    target: Target,
+    prompt: str,
+    options: FormatOptions,
+    *,
+    max_slope: float,
+):
+    """Yield a Finding for every function of target growing too fast.
+
+    prompt is grown both sizes of each of growths and prepared, then the
+    reference and the candidate are timed on it. Growth is the log-log slope
+    of runtime over prompt length between the sizes, 1 being linear.
+    """
+    for how, (grow, sizes) in growths.items():
+        small, large = (grow(prompt, n) for n in sizes)
+        small, error_small = call(target.prepare, small, options)
+        large, error_large = call(target.prepare, large, options)
+        if error_small or error_large or len(large) <= len(small):
+            continue
+
+        for role in ("reference", "candidate"):
+            fn = getattr(target, role)
+            a, b = seconds(fn, small, options), seconds(fn, large, options)
+            if a is None or b is None:
+                continue
+            slope = math.log(b / a) / math.log(len(large) / len(small))
+            if slope > max_slope:
+                kind = "superlinear" if role == "candidate" else f"{role} superlinear"
+                detail = f"{how}: runtime ~ n^{slope:.2f}"
+                yield Finding(kind, name, prompt, options, detail)
+
+
+def random_options(rng: random.Random):
+    return FormatOptions(
+        space_commas=rng.random() < ENABLED,
+        bracket2weight=rng.random() < ENABLED,
+        prefer_spacing=rng.choice(list(UnderSpaceEnum)),
+        networks=rng.choice(list(NetworkEnum)),
+        merge_networks=rng.choice(list(MergeEnum)),
+        flatten_weights=rng.random() < EXTRA,
+        split_weights=rng.random() < EXTRA,
+        weight_precision=rng.randint(1, 4),
+        pack_chunks=rng.random() < EXTRA,
+    )
+
+
+def run(
+    names: list,
+    *,
+    seed: int = 0,
+    count: int = 1000,
+    growth_every: int = 0,
+    max_slope: float = 1.5,
+):
+    """Yield findings of every target in names, shrunk and without repeats."""
+    rng = random.Random(seed)
+    seen = set()
+    for i, prompt in enumerate(grammar.prompts(seed, count)):
+        options = random_options(rng)
+        for name in names:
+            target = targets[name]
+            found = []
+            finding = check(name, target, prompt, options)
+            if finding is not None:
+                if finding.kind in ("mismatch", "candidate raises"):
+                    finding = shrink_finding(finding) or finding
+                found.append(finding)
+            elif growth_every and i % growth_every == 0:
+                found += check_growth(
+                    name, target, prompt, options, max_slope=max_slope
+                )
+
+            for finding in found:
+                key = finding[:4] if finding.kind in failures else finding[:2]
+                if key not in seen:
+                    seen.add(key)
+                    yield finding
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="python -m fuzz.differential",
+        description="Compare faster engines to the reference pipeline.",
+    )
+    parser.add_argument("--target", action="append", choices=list(targets),
+                        help="target to check, repeatable (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--count", type=int, default=1000, help="prompts to generate")
+    parser.add_argument("--growth-every", type=int, default=100,
+                        help="check runtime growth of every Nth prompt (0 to disable)")
+    parser.add_argument("--max-slope", type=float, default=1.5,
+                        help="flag runtime growing faster than n^slope")
+    parser.add_argument("--json", metavar="PATH", help="also write findings as JSONL")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only print the summary")
+    return parser.parse_args(argv)
+
+
+def main(argv: list | None = None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    names = args.target or list(targets)
+
+    findings = []
+    for finding in run(
+        names,
+        seed=args.seed,
+        count=args.count,
+        growth_every=args.growth_every,
+        max_slope=args.max_slope,
+    ):
+        findings.append(finding)
+        if not args.quiet:
+            print(f"[{finding.kind}] {finding.target}: {finding.prompt!r}")
+            print(f"    {finding.options}")
+            print(f"    {finding.detail}")
+
+    if args.json:
+        with Path(args.json).open("w", encoding="utf-8") as f:
+            for finding in findings:
+                f.write(json.dumps(finding.to_dict(), ensure_ascii=False) + "\n")
+
+    counts = Counter(finding.kind for finding in findings)
+    summary = ", ".join(f"{n} {kind}" for kind, n in sorted(counts.items()))
+    print(f"{args.count} prompts, {len(names)} targets: {summary or 'no findings'}")
+    return 1 if failures & counts.keys() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""Seeded grammar of random prompts for differential testing.
+
+Unlike benchmarks.generator, which aims for realistic prompts, this covers
+every construct the formatter treats specially and combines them freely,
+including malformed ones:
+
+prompt      := part (separator part)* [AND part ...]
+part        := tag | weighted | brackets | editing | alternation | network
+             | wildcard | escaped | stray | BREAK
+brackets    := any of () [] {} <> around a nested prompt, sometimes unclosed
+
+Every function takes a random.Random and a depth budget, so a prompt is
+reproducible from its seed alone.
+"""
+
+import random
+
+
+words = [
+    "1girl", "long_hair", "blue eyes", "smile", "a", "b", "AND", "BREAK",
+    "ANDY", "BRANDY", "x_y_z", "8k", "1.2", "_", "__init__", "from_side",
+]
+# Look-alikes of ASCII on purpose, to be normalized
+unicode_words = [
+    "café", "ｆｕｌｌ　ｗｉｄｔｈ", "（ａ）",  # noqa: RUF001
+    "［ｂ］", "，", "：", "｜",  # noqa: RUF001
+    "少女", "ﾊﾞｰｸ", "ﬁne", "Å",
+    "é", "🙂", "　",
+]
+whitespace = ["", "", " ", " ", "  ", "\t", "\n", " \n "]
+separators = [",", ",", ", ", " ,", ",,", " , ", "|", " ", ":", "\n"]
+weights = ["1", "1.2", "0.8", ".5", "1.", "10", "0", "-1", "1.2.3", ""]
+
+# Chances of a tag from unicode_words, of brackets left short or sloppy, and
+# of a prompt without AND
+UNICODE = 0.15
+SLOPPY = 0.15
+PLAIN = 0.8
+
+
+def space(rng: random.Random):
+    return rng.choice(whitespace)
+
+
+def tag(rng: random.Random, _: int = 0):
+    vocabulary = unicode_words if rng.random() < UNICODE else words
+    return rng.choice(vocabulary)
+
+
+def weighted(rng: random.Random, depth: int):
+    opening, closing = rng.choice(["()", "()", "[]"])
+    return (
+        f"{opening}{space(rng)}{prompt(rng, depth - 1, parts=2)}{space(rng)}"
+        f":{space(rng)}{rng.choice(weights)}{space(rng)}{closing}"
+    )
+
+
+def brackets(rng: random.Random, depth: int):
+    opening, closing = rng.choice(["()", "()", "()", "[]", "[]", "{}", "<>"])
+    times = rng.choice([1, 1, 2, 3, rng.randint(4, 12)])
+    inner = prompt(rng, depth - 1, parts=rng.randint(1, 3))
+    if rng.random() < SLOPPY:  # one side short, or sloppy spacing inside
+        return opening * times + inner + closing * rng.randint(0, times)
+    return (
+        opening * times + space(rng) + inner + space(rng) + closing * times
+    )
+
+
+def editing(rng: random.Random, depth: int):
+    a = prompt(rng, depth - 1, parts=1)
+    b = prompt(rng, depth - 1, parts=1)
+    when = rng.choice(weights)
+    return rng.choice(
+        [
+            f"[{a}:{b}:{when}]",
+            f"[{a}{space(rng)}:{space(rng)}{b}{space(rng)}:{space(rng)}{when}]",
+            f"[{a}:{when}]",
+            f"[{a}::{when}]",
+        ]
+    )
+
+
+def alternation(rng: random.Random, depth: int):
+    return "[" + "|".join(
+        prompt(rng, depth - 1, parts=1) for _ in range(rng.randint(2, 4))
+    ) + "]"
+
+
+def network(rng: random.Random, _: int):
+    name = rng.choice(["style_1", "add_detail", "a b", "x(y)", "ｎｅｔ"])  # noqa: RUF001
+    return (
+        f"<{rng.choice(['lora', 'lyco', 'hypernet'])}:{name}"
+        f":{rng.choice(weights)}{space(rng)}>"
+    )
+
+
+def wildcard(rng: random.Random, depth: int):
+    return "{" + "|".join(
+        prompt(rng, depth - 1, parts=1) for _ in range(rng.randint(1, 3))
+    ) + "}"
+
+
+def escaped(rng: random.Random, _: int):
+    return "\\" + rng.choice("()[]{}<>\\:,|a")
+
+
+def stray(rng: random.Random, _: int):
+    return rng.choice("()[]{}<>")
+
+
+def breaks(rng: random.Random, _: int):
+    return space(rng) + "BREAK" + space(rng)
+
+
+productions = [
+    (tag, 12),
+    (weighted, 3),
+    (brackets, 4),
+    (editing, 1),
+    (alternation, 1),
+    (network, 1),
+    (wildcard, 1),
+    (escaped, 1),
+    (stray, 1),
+    (breaks, 1),
+]
+leaves = [tag, escaped, stray]
+
+
+def part(rng: random.Random, depth: int):
+    if depth <= 0:
+        return rng.choice(leaves)(rng, 0)
+    functions, counts = zip(*productions)
+    return rng.choices(functions, counts)[0](rng, depth)
+
+
+def prompt(rng: random.Random, depth: int = 3, parts: int = 6):
+    ret = part(rng, depth)
+    for _ in range(parts - 1):
+        ret += space(rng) + rng.choice(separators) + space(rng) + part(rng, depth)
+    return ret
+
+
+def composed(rng: random.Random, depth: int = 3, parts: int = 6):
+    """Return a prompt, sometimes composed with AND and weighted per section."""
+    if rng.random() < PLAIN:
+        return prompt(rng, depth, parts)
+    return f"{space(rng)}AND{space(rng)}".join(
+        f"{prompt(rng, depth, parts // 2 + 1)}{space(rng)}:{rng.choice(weights)}"
+        for _ in range(rng.randint(2, 3))
+    )
+
+
+def prompts(seed: int = 0, count: int = 1000, *, max_parts: int = 10):
+    """Yield count prompts of growing size, reproducible from seed."""
+    rng = random.Random(seed)
+    for i in range(count):
+        parts = 1 + i % max_parts
+        yield composed(rng, depth=rng.randint(1, 4), parts=parts)
@@ -3,20 +3,15 @@
 import gradio as gr
 from modules import script_callbacks, scripts, shared
 
-from scripts import prompt_formatting_pipeline as pipeline
-from scripts.prompt_formatting_definitions import UnderSpaceEnum
+from scripts import prompt_formatting_settings as settings
 
-SPACE_COMMAS = True
-BRACKET2WEIGHT = True
-# SPACE2UNDERSCORE = False
-# IGNOREUNDERSCORES = True
-PREFER_SPACING = UnderSpaceEnum.IGNORE
 
 ui_prompts = set()
+session = settings.Session()
 
 
 def format_prompt(*prompts: tuple[dict]):
-    sync_settings()
+    session.sync(shared.opts)
 
     ret = []
 
@@ -25,25 +20,9 @@ def format_prompt(*prompts: tuple[dict]):
             ret.append("")
             continue
 
-        # Clean up the string
-        prompt = pipeline.normalize_characters(prompt)
-        prompt = pipeline.remove_mismatched_brackets(prompt)
-
-        # Clean up whitespace for cool beans
-        prompt = pipeline.remove_whitespace_excessive(prompt)
-
-        # Replace Spaces and/or underscores, unless disabled
-        prompt = pipeline.space_to_underscore(prompt, mode=PREFER_SPACING)
-        prompt = pipeline.align_brackets(prompt)
-        prompt = pipeline.space_and(prompt)  # for proper compositing alignment on colon
-        prompt = pipeline.space_bracekts(prompt)
-        prompt = pipeline.align_colons(prompt)
-        prompt = pipeline.align_commas(prompt, do_it=SPACE_COMMAS)
-        prompt = pipeline.align_alternating(prompt)
-        prompt = pipeline.bracket_to_weights(prompt, do_it=BRACKET2WEIGHT)
-
-        ret.append(prompt.strip())
+        ret.append(session.format(prompt))
 
+    session.report()
     return ret
 
 
@@ -74,68 +53,19 @@ def on_before_component(component: gr.component, **kwargs: dict):
 def on_ui_settings():
     section = ("pformat", "Prompt Formatter")
 
-    shared.opts.add_option(
-        "pformat_space_commas",
-        shared.OptionInfo(
-            True,
-            "Add a spaces after comma",
-            gr.Checkbox,
-            {"interactive": True},
-            section=section,
-        ),
-    )
-    shared.opts.add_option(
-        "pfromat_bracket2weight",
-        shared.OptionInfo(
-            True,
-            "Convert excessive brackets to weights",
-            gr.Checkbox,
-            {"interactive": True},
-            section=section,
-        ),
-    )
-    # shared.opts.add_option(
-    #     "pfromat_space2underscore",
-    #     shared.OptionInfo(
-    #         False,
-    #         "Convert spaces to underscores (default: underscore to spaces)",
-    #         gr.Checkbox,
-    #         {"interactive": True},
-    #         section=section,
-    #     ),
-    # )
-    # shared.opts.add_option(
-    #     "pfromat_ignoreunderscores",
-    #     shared.OptionInfo(
-    #         True,
-    #         "Do not convert either spaces or underscores (preserves DanBooru tag formatting)",
-    #         gr.Checkbox,
-    #         {"interactive": True},
-    #         section=section,
-    #     ),
-
-
-    shared.opts.add_option(
-        'pformat_preferspacing',
-        shared.OptionInfo(
-            'Space',
-            "Preference in formatter to use spaces or underscore or ignore.",
-            gr.Radio,
-            {"choices": ["Space", "Underscore", "Ignore"]},
-            section=section
+    for setting in settings.SETTINGS:
+        shared.opts.add_option(
+            setting.key,
+            shared.OptionInfo(
+                setting.default,
+                setting.label,
+                getattr(gr, setting.component),
+                setting.args,
+                section=section,
+            ),
         )
-    )
-
-    sync_settings()
-
 
-def sync_settings():
-    global SPACE_COMMAS, BRACKET2WEIGHT, SPACE2UNDERSCORE, IGNOREUNDERSCORES, PREFER_SPACING
-    SPACE_COMMAS = shared.opts.pformat_space_commas
-    BRACKET2WEIGHT = shared.opts.pfromat_bracket2weight
-    # SPACE2UNDERSCORE = shared.opts.pfromat_space2underscore
-    # IGNOREUNDERSCORES = shared.opts.pfromat_ignoreunderscores
-    PREFER_SPACING = UnderSpaceEnum(shared.opts.pformat_preferspacing)
+    session.sync(shared.opts)
 
 
 script_callbacks.on_before_component(on_before_component)
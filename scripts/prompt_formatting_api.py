@@ -0,0 +1,139 @@
+"""Format prompts over webui's HTTP API.
+
+POST /pformat/v1/format        {"prompt": "...", "options": {...}}
+POST /pformat/v1/format-batch  {"prompts": ["...", ...], "options": {...}}
+POST /pformat/v1/tokens        {"prompt": "..."}
+
+Options left out of a request are taken from the extension's settings.
+Routes are plain functions, which FastAPI runs on its threadpool, so a
+request never holds the server's event loop. Every prompt is formatted
+within the time budget of the settings, and every response reports the time
+spent in a Server-Timing header. The tag list and merges file are configured
+when the app starts and again when their settings change.
+"""
+
+import time
+
+from fastapi import APIRouter, FastAPI, Response
+from modules import script_callbacks, shared
+from pydantic import BaseModel
+
+from scripts import prompt_formatting_settings as settings
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import MergeEnum, NetworkEnum, UnderSpaceEnum
+from scripts.prompt_formatting_formatter import get_formatter
+
+
+router = APIRouter(prefix="/pformat/v1", tags=["Prompt Formatter"])
+
+
+class Options(BaseModel):
+    space_commas: bool | None = None
+    bracket2weight: bool | None = None
+    prefer_spacing: UnderSpaceEnum | None = None
+    networks: NetworkEnum | None = None
+    merge_networks: MergeEnum | None = None
+    flatten_weights: bool | None = None
+    split_weights: bool | None = None
+    weight_precision: int | None = None
+    pack_chunks: bool | None = None
+
+
+class FormatRequest(BaseModel):
+    prompt: str
+    options: Options = Options()
+
+
+class FormatResponse(BaseModel):
+    prompt: str
+
+
+class BatchRequest(BaseModel):
+    prompts: list[str]
+    options: Options = Options()
+
+
+class BatchResponse(BaseModel):
+    prompts: list[str]
+
+
+class TokensRequest(BaseModel):
+    prompt: str
+
+
+class TokensResponse(BaseModel):
+    tokens: int
+    passes: int
+    sections: list[list[tokens.Chunk]]
+
+
+def configure_files():
+    """Use the tag list and merges file of the settings."""
+    settings.configure_files(shared.opts)
+
+
+def resolve_options(options: Options):
+    """Return the settings options, overridden by those given in a request."""
+    return settings.format_options(shared.opts)._replace(
+        **{k: v for k, v in vars(options).items() if v is not None}
+    )
+
+
+def time_budget():
+    """Seconds a prompt may take to format, 0 for no limit."""
+    return settings.value(shared.opts, "pformat_time_budget_ms") / 1000
+
+
+def run_format(prompts: list, options: Options, response: Response):
+    """Format prompts within the time budget, reporting timings on response."""
+    start = time.perf_counter()
+    formatter = get_formatter(resolve_options(options))
+    budget = time_budget()
+    begin = time.perf_counter()
+    if budget:
+        ret = [formatter.format_within(prompt, budget).prompt for prompt in prompts]
+    else:
+        ret = formatter.format_many(prompts)
+    end = time.perf_counter()
+    seconds, total = end - begin, end - start
+
+    response.headers["Server-Timing"] = (
+        f"format;dur={seconds * 1000:.3f}, total;dur={total * 1000:.3f}"
+    )
+    response.headers["X-Pformat-Prompts"] = str(len(prompts))
+    return ret
+
+
+@router.post("/format", response_model=FormatResponse)
+def format_prompt(request: FormatRequest, response: Response):
+    ret = run_format([request.prompt], request.options, response)
+    return FormatResponse(prompt=ret[0])
+
+
+@router.post("/format-batch", response_model=BatchResponse)
+def format_batch(request: BatchRequest, response: Response):
+    ret = run_format(request.prompts, request.options, response)
+    return BatchResponse(prompts=ret)
+
+
+@router.post("/tokens", response_model=TokensResponse)
+def analyze_tokens(request: TokensRequest, response: Response):
+    """Tokens, encoder passes and 75 token chunks of every section of AND."""
+    start = time.perf_counter()
+    analysis = tokens.analyze(request.prompt)
+    response.headers["Server-Timing"] = (
+        f"tokens;dur={(time.perf_counter() - start) * 1000:.3f}"
+    )
+    return TokensResponse(
+        tokens=analysis.tokens, passes=analysis.passes, sections=analysis.sections
+    )
+
+
+def on_app_started(_, app: FastAPI):
+    configure_files()
+    for key in ("pformat_tags_file", "pformat_clip_merges"):
+        shared.opts.onchange(key, configure_files, call=False)
+    app.include_router(router)
+
+
+script_callbacks.on_app_started(on_app_started)
@@ -0,0 +1,104 @@
+"""Format many prompts at once, optionally across processes.
+
+Nothing here depends on webui, only on the formatting engine. Every process
+builds the formatter of the options once and reuses it for every chunk.
+"""
+
+from collections import deque
+from collections.abc import Iterable, Iterator
+from itertools import islice
+
+from scripts import prompt_formatting_patterns as patterns
+from scripts import prompt_formatting_tags as tags
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_formatter import Outcome, get_formatter
+
+
+def format_chunk(prompts: list, options: FormatOptions):
+    return get_formatter(options).format_many(prompts)
+
+
+def format_chunk_within(prompts: list, options: FormatOptions, seconds: float):
+    """Outcome of every prompt, all formatted within seconds, 0 for no limit.
+
+    See PromptFormatter.format_within. Prompts left when time runs out are
+    kept as they are.
+    """
+    formatter = get_formatter(options)
+    if not seconds:
+        return [Outcome(prompt, None) for prompt in formatter.format_many(prompts)]
+    with patterns.deadline(seconds):
+        return [formatter.format_within(prompt, seconds) for prompt in prompts]
+
+
+def configure(tags_path: str, merges_path: str):
+    """Use the tag list and merges file of the parent in a worker."""
+    tags.configure(tags_path)
+    tokens.configure(merges_path)
+
+
+def chunked(prompts: Iterable, chunk_size: int):
+    prompts = iter(prompts)
+    while chunk := list(islice(prompts, chunk_size)):
+        yield chunk
+
+
+def map_chunks(
+    function, items: Iterable, *args, workers: int = 0, chunk_size: int = 256
+) -> Iterator:
+    """Yield every result of function(chunk, *args) over chunks of items, in order.
+
+    function returns a list per chunk. With workers, chunks of chunk_size
+    items are processed on a process pool of that many processes. At most
+    two chunks per worker are in flight, so items are consumed lazily and
+    memory stays bounded. Workers use the tag list and merges file
+    configured here, mapping the same index file.
+    """
+    if workers <= 1:
+        for chunk in chunked(items, chunk_size):
+            yield from function(chunk, *args)
+        return
+
+    # Imported here, multiprocessing is most of the import time otherwise
+    from concurrent.futures import ProcessPoolExecutor  # noqa: PLC0415
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=configure,
+        initargs=(tags.path, tokens.path),
+    ) as executor:
+        pending = deque()
+        for chunk in chunked(items, chunk_size):
+            pending.append(executor.submit(function, chunk, *args))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def format_prompts_iter(
+    prompts: Iterable,
+    options: FormatOptions = FormatOptions(),
+    *,
+    workers: int = 0,
+    chunk_size: int = 256,
+) -> Iterator[str]:
+    """Yield each prompt formatted, in input order, see map_chunks."""
+    return map_chunks(
+        format_chunk, prompts, options, workers=workers, chunk_size=chunk_size
+    )
+
+
+def format_prompts(
+    prompts: Iterable,
+    options: FormatOptions = FormatOptions(),
+    *,
+    workers: int = 0,
+    chunk_size: int = 256,
+):
+    """Format every prompt, see format_prompts_iter."""
+    return list(
+        format_prompts_iter(prompts, options, workers=workers, chunk_size=chunk_size)
+    )
@@ -0,0 +1,130 @@
+"""Bounded LRU cache of formatted prompts."""
+
+import sys
+from collections import OrderedDict
+
+from scripts.prompt_formatting_definitions import FormatOptions, UnderSpaceEnum
+from scripts.prompt_formatting_formatter import PromptFormatter, get_formatter
+
+
+# Rough cost of an entry beyond its strings: key tuple, dict slot and links
+ENTRY_OVERHEAD = 200
+
+
+class PromptCache:
+    """Map (prompt, settings) to the formatted prompt within a byte budget.
+
+    Least recently used entries are evicted once the estimated size of all
+    entries goes over max_bytes. A budget of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: tuple):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: tuple, value: str):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+
+        cost = entry_size(key, value)
+        if cost > self.max_bytes:
+            return
+
+        self.entries[key] = value
+        self.size += cost
+        self.evict(self.max_bytes)
+
+    def evict(self, max_bytes: int):
+        while self.size > max_bytes:
+            key, value = self.entries.popitem(last=False)
+            self.size -= entry_size(key, value)
+            self.evictions += 1
+
+    def resize(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.evict(max_bytes)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def format(
+        self,
+        prompt: str,
+        *,
+        space_commas: bool = True,
+        bracket2weight: bool = True,
+        prefer_spacing: UnderSpaceEnum = UnderSpaceEnum.SPACE,
+    ):
+        """Format a prompt with the shared formatter of these settings."""
+        options = FormatOptions(space_commas, bracket2weight, prefer_spacing)
+        return self.format_with(prompt, get_formatter(options))
+
+    def format_with(self, prompt: str, formatter: PromptFormatter, budget: float = 0):
+        """Format a prompt with formatter, memoized.
+
+        On a miss the formatted prompt is formatted once more and stored under
+        its own key too, so formatting the result again is a hit. That second
+        result is stored as computed, never assumed to be unchanged, and only
+        computed if an entry of its size fits the budget.
+
+        With a budget in seconds, each format runs within it, see
+        PromptFormatter.format_within. A result cut short is not stored.
+        """
+        settings = formatter.options
+        ret = self.get((prompt, settings))
+        if ret is not None:
+            return ret
+
+        def run(prompt: str):
+            if not budget:
+                return formatter.format(prompt), None
+            return formatter.format_within(prompt, budget)
+
+        ret, failed = run(prompt)
+        if failed:
+            return ret
+        self.put((prompt, settings), ret)
+
+        if (
+            ret != prompt
+            and (ret, settings) not in self.entries
+            and entry_size((ret, settings), ret) <= self.max_bytes
+        ):
+            again, failed = run(ret)
+            if not failed:
+                self.put((ret, settings), again)
+
+        return ret
+
+
+def entry_size(key: tuple, value: str):
+    return sys.getsizeof(key[0]) + sys.getsizeof(value) + ENTRY_OVERHEAD
@@ -0,0 +1,285 @@
+"""Format prompt files from the command line, without webui.
+
+Prompts are read as a stream from files or stdin and written out as they are
+formatted, so memory stays bounded whatever the input size.
+
+e.g.
+python -m scripts.prompt_formatting_cli prompts.txt -o formatted.txt
+python -m scripts.prompt_formatting_cli --format jsonl --field text < in.jsonl
+python -m scripts.prompt_formatting_cli data.csv --column prompt --workers 4
+"""
+
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack
+from itertools import tee
+from pathlib import Path
+
+from scripts import prompt_formatting_tags as tags
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_batch import format_prompts_iter
+from scripts.prompt_formatting_definitions import (
+    FormatOptions,
+    MergeEnum,
+    NetworkEnum,
+    UnderSpaceEnum,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class Throughput:
+    def __init__(self):
+        self.prompts = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+
+    def count(self, prompts: Iterable) -> Iterator[str]:
+        for prompt in prompts:
+            self.prompts += 1
+            self.bytes += len(prompt.encode("utf-8"))
+            yield prompt
+
+    def summary(self):
+        seconds = max(time.perf_counter() - self.start, 1e-9)
+        return (
+            f"formatted {self.prompts} prompts ({self.bytes / 1e6:.2f} MB) "
+            f"in {seconds:.2f} s: {self.prompts / seconds:.0f} prompts/s, "
+            f"{self.bytes / 1e6 / seconds:.2f} MB/s"
+        )
+
+
+def read_lines(files: list):
+    for file in files:
+        yield from file
+
+
+def text_records(lines: Iterable):
+    for line in lines:
+        yield line, line.rstrip("\r\n")
+
+
+def write_text(out, records: Iterable, formatted: Iterable):
+    for _, prompt in zip(records, formatted):
+        out.write(prompt + "\n")
+
+
+def jsonl_records(files: list, field: str):
+    """Yield every object of JSON lines files and the text of its field.
+
+    Lines that are not an object, or whose field is not a string, are yielded
+    as their text and written back unchanged, with a warning naming the file
+    and line, so output lines match input lines one to one. Blank lines are
+    kept as well.
+    """
+    for file in files:
+        for number, line in enumerate(file, 1):
+            text = line.rstrip("\r\n")
+            if not text.strip():
+                yield text, ""
+                continue
+            try:
+                record = json.loads(text)
+            except json.JSONDecodeError as e:
+                problem = str(e)
+            else:
+                if not isinstance(record, dict):
+                    problem = "not a JSON object"
+                elif not isinstance(record.get(field, ""), str):
+                    problem = f"{field!r} is not a string"
+                else:
+                    yield record, record.get(field, "")
+                    continue
+            logger.warning("Keeping %s:%d unchanged: %s", file.name, number, problem)
+            yield text, ""
+
+
+def write_jsonl(out, records: Iterable, formatted: Iterable, field: str):
+    for (record, _), prompt in zip(records, formatted):
+        if isinstance(record, str):  # a line kept as it is
+            out.write(record + "\n")
+            continue
+        if field in record:
+            record[field] = prompt
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def csv_records(rows: Iterator, column: int):
+    for row in rows:
+        yield row, row[column] if column < len(row) else ""
+
+
+def write_csv(out, records: Iterable, formatted: Iterable, column: int):
+    writer = csv.writer(out, lineterminator="\n")
+    for (row, _), prompt in zip(records, formatted):
+        if column < len(row):
+            row[column] = prompt
+        writer.writerow(row)
+
+
+def csv_column(header: list, column: str):
+    if column in header:
+        return header.index(column)
+    if column.isdigit():
+        return int(column)
+
+    msg = f"Column {column!r} is not in the CSV header: {header}"
+    raise SystemExit(msg)
+
+
+def guess_format(paths: list):
+    suffixes = {Path(path).suffix.lower() for path in paths}
+    if suffixes == {".jsonl"}:
+        return "jsonl"
+    if suffixes == {".csv"}:
+        return "csv"
+    return "text"
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.prompt_formatting_cli",
+        description="Format prompts read from files or stdin.",
+    )
+    parser.add_argument("files", nargs="*", help="input files, stdin if none or -")
+    parser.add_argument("-o", "--output", help="output file, stdout if omitted")
+    parser.add_argument("--format", choices=["text", "jsonl", "csv"])
+    parser.add_argument("--field", default="prompt", help="JSONL field to format")
+    parser.add_argument(
+        "--column", default="prompt", help="CSV column to format, name or index"
+    )
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    add_options(parser)
+    parser.add_argument("-q", "--quiet", action="store_true", help="no summary")
+    return parser.parse_args(argv)
+
+
+def add_options(parser: argparse.ArgumentParser):
+    """Arguments of every format option, see options."""
+    parser.add_argument(
+        "--spacing",
+        choices=[e.value for e in UnderSpaceEnum],
+        default=UnderSpaceEnum.SPACE.value,
+    )
+    parser.add_argument(
+        "--networks",
+        choices=[e.value for e in NetworkEnum],
+        default=NetworkEnum.KEEP.value,
+        help="move networks such as <lora:...> to the end or front",
+    )
+    parser.add_argument(
+        "--merge-networks",
+        choices=[e.value for e in MergeEnum],
+        default=MergeEnum.NONE.value,
+        help="merge networks of the same name, summing or taking the max weight",
+    )
+    parser.add_argument(
+        "--flatten-weights",
+        action="store_true",
+        help="merge nested weights, e.g. ((a:0.91):0.91) -> (a:0.83)",
+    )
+    parser.add_argument(
+        "--split-weights",
+        action="store_true",
+        help="split weighted groups per tag, e.g. (a, b:1.2) -> (a:1.20), (b:1.20)",
+    )
+    parser.add_argument("--weight-precision", type=int, default=2)
+    parser.add_argument(
+        "--pack-chunks",
+        action="store_true",
+        help="drop repeated tags and reorder tags to take fewer 75 token chunks",
+    )
+    parser.add_argument(
+        "--clip-merges", default="", help="CLIP merges file to count tokens with"
+    )
+    parser.add_argument(
+        "--tags", default="", help="tag list of --spacing Tags, CSV or one per line"
+    )
+    parser.add_argument("--no-space-commas", action="store_true")
+    parser.add_argument("--no-bracket2weight", action="store_true")
+
+
+def options(args: argparse.Namespace):
+    """Format options of parsed arguments, using their tag list and merges."""
+    tags.configure(args.tags)
+    tokens.configure(args.clip_merges)
+    return FormatOptions(
+        space_commas=not args.no_space_commas,
+        bracket2weight=not args.no_bracket2weight,
+        prefer_spacing=UnderSpaceEnum(args.spacing),
+        networks=NetworkEnum(args.networks),
+        merge_networks=MergeEnum(args.merge_networks),
+        flatten_weights=args.flatten_weights,
+        split_weights=args.split_weights,
+        weight_precision=args.weight_precision,
+        pack_chunks=args.pack_chunks,
+    )
+
+
+def main(argv: list | None = None):
+    args = parse_args(argv)
+    format_options = options(args)
+    paths = [path for path in args.files if path != "-"]
+    kind = args.format or guess_format(paths)
+
+    throughput = Throughput()
+
+    with ExitStack() as stack:
+        files = [
+            sys.stdin
+            if path == "-"
+            else stack.enter_context(Path(path).open(encoding="utf-8", newline=""))
+            for path in args.files or ["-"]
+        ]
+        out = (
+            stack.enter_context(
+                Path(args.output).open("w", encoding="utf-8", newline="")
+            )
+            if args.output
+            else sys.stdout
+        )
+
+        lines = read_lines(files)
+        if kind == "csv":
+            rows = csv.reader(lines)
+            header = next(rows, None)
+            if header is None:
+                return
+            column = csv_column(header, args.column)
+            csv.writer(out, lineterminator="\n").writerow(header)
+            records = csv_records(rows, column)
+        elif kind == "jsonl":
+            records = jsonl_records(files, args.field)
+        else:
+            records = text_records(lines)
+
+        # Records and their prompts are consumed side by side, tee only holds
+        # the prompts still being formatted
+        records, prompts = tee(records)
+        formatted = format_prompts_iter(
+            throughput.count(prompt for _, prompt in prompts),
+            format_options,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+        )
+
+        if kind == "csv":
+            write_csv(out, records, formatted, column)
+        elif kind == "jsonl":
+            write_jsonl(out, records, formatted, args.field)
+        else:
+            write_text(out, records, formatted)
+
+    if not args.quiet:
+        print(throughput.summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,35 @@
 """Definitions to be pulled by other scripts."""
 
 from enum import Enum
+from typing import NamedTuple
 
 
 class UnderSpaceEnum(Enum):
     SPACE = 'Space'
     UNDERSCORE = 'Underscore'
     IGNORE = 'Ignore'
+    TAGS = 'Tags'
+
+
+class NetworkEnum(Enum):
+    KEEP = 'Keep'
+    END = 'End'
+    FRONT = 'Front'
+
+
+class MergeEnum(Enum):
+    NONE = 'None'
+    SUM = 'Sum'
+    MAX = 'Max'
+
+
+class FormatOptions(NamedTuple):
+    space_commas: bool = True
+    bracket2weight: bool = True
+    prefer_spacing: UnderSpaceEnum = UnderSpaceEnum.SPACE
+    networks: NetworkEnum = NetworkEnum.KEEP
+    merge_networks: MergeEnum = MergeEnum.NONE
+    flatten_weights: bool = False
+    split_weights: bool = False
+    weight_precision: int = 2
+    pack_chunks: bool = False
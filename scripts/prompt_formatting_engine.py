@@ -0,0 +1,558 @@
+"""Single-pass prompt formatting engine.
+
+The prompt is lexed once into typed tokens. Bracket validation, whitespace
+collapsing and space/underscore conversion happen while lexing, the spacing
+rules are resolved between neighbouring tokens, and the output is emitted
+once at the end.
+
+The functions in prompt_formatting_pipeline are the reference implementation.
+format_prompt here must produce the same output as pipeline.format_prompt,
+except where bracket_to_weights raises or drops characters, see
+bracket_to_weights_indexed.
+"""
+
+from enum import IntEnum, auto
+from functools import lru_cache
+
+import regex as re
+
+from scripts import prompt_formatting_features as features
+from scripts import prompt_formatting_patterns as patterns
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts import prompt_formatting_stats as stats
+from scripts import prompt_formatting_tags as tags
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import MergeEnum, NetworkEnum, UnderSpaceEnum
+
+
+class TokenKind(IntEnum):
+    TEXT = auto()
+    SPACE = auto()
+    COMMA = auto()
+    PIPE = auto()
+    COLON = auto()
+    AND = auto()
+    BREAK = auto()
+    WEIGHT = auto()
+    OPEN = auto()
+    CLOSE = auto()
+    NETWORK_OPEN = auto()
+    NETWORK_CLOSE = auto()
+    WILDCARD_OPEN = auto()
+    WILDCARD_CLOSE = auto()
+
+
+SPECIALS = {
+    ",": TokenKind.COMMA,
+    "|": TokenKind.PIPE,
+    ":": TokenKind.COLON,
+    "(": TokenKind.OPEN,
+    "[": TokenKind.OPEN,
+    ")": TokenKind.CLOSE,
+    "]": TokenKind.CLOSE,
+    "<": TokenKind.NETWORK_OPEN,
+    ">": TokenKind.NETWORK_CLOSE,
+    "{": TokenKind.WILDCARD_OPEN,
+    "}": TokenKind.WILDCARD_CLOSE,
+}
+
+OPENING = frozenset(
+    (TokenKind.OPEN, TokenKind.NETWORK_OPEN, TokenKind.WILDCARD_OPEN)
+)
+CLOSING = frozenset(
+    (TokenKind.CLOSE, TokenKind.NETWORK_CLOSE, TokenKind.WILDCARD_CLOSE)
+)
+
+# Kinds with spacing rules of their own, every other pair keeps its whitespace
+SPACED = frozenset(
+    (
+        *OPENING,
+        *CLOSING,
+        TokenKind.AND,
+        TokenKind.COLON,
+        TokenKind.COMMA,
+        TokenKind.PIPE,
+        None,
+    )
+)
+
+re_lex = patterns.compile(r"(\s+)|([,|:()\[\]{}<>])|((?:\\\S|[^\s,|:()\[\]{}<>])+)")
+re_underscore = patterns.compile(r"(?<!BREAK)(?<=\w)_+(?=\w)(?!BREAK)")
+re_word_char = patterns.compile(r"\w")
+re_weight = patterns.compile(r"\d+\.?\d*|\d*\.?\d+")
+# A run of whitespace, AND and specials, everything normalize_spacing rewrites.
+# Escapes are matched first so they are skipped, except that AND is split out
+# of '\AND' like from any other word.
+re_spacing = patterns.compile(r"\\(?!AND)\S|((?:[\s,|:()\[\]{}<>]|AND)+)")
+
+
+def scan(prompt: str):
+    r"""Split a prompt into words, collapsed whitespace and single specials.
+
+    A character escaped with a backslash, e.g. '\(', is part of a word.
+    """
+    tokens = []
+    for space, special, text in re_lex.findall(prompt):
+        if text:
+            tokens.append((TokenKind.TEXT, text))
+        elif special:
+            tokens.append((SPECIALS[special], special))
+        elif space == " ":
+            tokens.append((TokenKind.SPACE, space))
+        else:
+            tokens.append((TokenKind.SPACE, pipeline.re_whitespace.sub(" ", space)))
+    return tokens
+
+
+def in_network(tokens: list):
+    """Flag words followed by a '>' before any '<' or ','.
+
+    Mirrors the (?![^<]*>) lookahead of space_to_underscore, which only ever
+    sees one comma separated token.
+    """
+    ret = [False] * len(tokens)
+    protected = False
+    for i in range(len(tokens) - 1, -1, -1):
+        kind = tokens[i][0]
+        if kind is TokenKind.NETWORK_CLOSE:
+            protected = True
+        elif kind is TokenKind.NETWORK_OPEN or kind is TokenKind.COMMA:
+            protected = False
+        ret[i] = protected
+    return ret
+
+
+def to_underscores(tokens: list):
+    """Join words separated by a single space with an underscore."""
+    protected = in_network(tokens)
+    ret = []
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        if (
+            kind is TokenKind.SPACE
+            and text == " "
+            and ret
+            and ret[-1][0] is TokenKind.TEXT
+            and i + 1 < len(tokens)
+            and tokens[i + 1][0] is TokenKind.TEXT
+            and not protected[i + 1]
+        ):
+            left, right = ret[-1][1], tokens[i + 1][1]
+            if (
+                re_word_char.match(left[-1])
+                and re_word_char.match(right[0])
+                and not left.endswith("BREAK")
+                and not right.startswith("BREAK")
+            ):
+                ret[-1] = (TokenKind.TEXT, f"{left}_{right}")
+                i += 2
+                continue
+        ret.append(tokens[i])
+        i += 1
+    return ret
+
+
+def classify(tokens: list, *, to_spaces: bool = False):
+    """Split AND out of words and type BREAK and weights.
+
+    With to_spaces, underscores between word characters become spaces first.
+    """
+    protected = in_network(tokens) if to_spaces else None
+    ret = []
+    for i, token in enumerate(tokens):
+        kind, text = token
+        if kind is not TokenKind.TEXT:
+            ret.append(token)
+            continue
+
+        if to_spaces and "_" in text and not protected[i]:
+            words = re_underscore.split(text)
+        else:
+            words = (text,)
+
+        for j, word in enumerate(words):
+            if j:
+                ret.append((TokenKind.SPACE, " "))
+            classify_word(word, ret)
+    return ret
+
+
+def classify_word(word: str, tokens: list):
+    """Append the tokens of a word of text to tokens, see classify."""
+    if "AND" in word:
+        for k, part in enumerate(word.split("AND")):
+            if k:
+                tokens.append((TokenKind.AND, "AND"))
+            if part == "BREAK":
+                tokens.append((TokenKind.BREAK, part))
+            elif part:
+                tokens.append((TokenKind.TEXT, part))
+    elif word == "BREAK":
+        tokens.append((TokenKind.BREAK, word))
+    elif tokens and tokens[-1][0] is TokenKind.COLON and re_weight.fullmatch(word):
+        tokens.append((TokenKind.WEIGHT, word))
+    else:
+        tokens.append((TokenKind.TEXT, word))
+
+
+def lex(prompt: str, mode: UnderSpaceEnum = UnderSpaceEnum.SPACE):
+    """Lex a prompt into (TokenKind, text) tokens.
+
+    The prompt is normalized, mismatched brackets are dropped, whitespace is
+    collapsed and spaces or underscores are converted according to mode.
+    """
+    prompt = pipeline.normalize_characters(prompt)
+    tokens = scan(pipeline.remove_mismatched_brackets(prompt))
+
+    if mode == UnderSpaceEnum.UNDERSCORE:
+        tokens = to_underscores(tokens)
+
+    return classify(tokens, to_spaces=mode == UnderSpaceEnum.SPACE and "_" in prompt)
+
+
+def gap(left: TokenKind, right: TokenKind, space: str, *, space_commas: bool):
+    """Resolve the whitespace between two tokens.
+
+    Rules are applied in the order of the reference pipeline, so a later rule
+    overrides an earlier one: brackets, AND, opposing brackets, colons, commas
+    then pipes. left is None at the start of the prompt, right at the end.
+    """
+    if left in OPENING or right in CLOSING:
+        space = ""
+    if left is TokenKind.AND or right is TokenKind.AND:
+        space = " " * ((left is TokenKind.AND) + (right is TokenKind.AND))
+    if not space and left in CLOSING and right in OPENING:
+        space = " "
+    if left is TokenKind.COLON or right is TokenKind.COLON:
+        space = ""
+    if space_commas:
+        if right is TokenKind.COMMA:
+            space = space.rstrip(" ")
+        if left is TokenKind.COMMA:
+            space = " " + space.lstrip(" ")
+    if left is TokenKind.PIPE or right is TokenKind.PIPE:
+        space = ""
+    return space
+
+
+def emit(tokens: list, *, space_commas: bool = True):
+    """Join tokens back into a prompt, spacing them along the way.
+
+    With space_commas, runs of commas collapse into one and commas at either
+    end of the prompt are dropped, as align_commas does.
+    """
+    ret = []
+    left = None
+    space = ""
+    chunk_empty = True  # nothing but spaces since the last comma
+    last_comma = None
+
+    for kind, text in tokens:
+        if kind is TokenKind.SPACE:
+            space += text
+            continue
+
+        if kind is TokenKind.COMMA and space_commas:
+            if chunk_empty and "\n" not in space and "\r" not in space:
+                continue
+            chunk_empty = True
+            last_comma = (len(ret) + 1, left)  # keep the space before it
+        else:
+            chunk_empty = False
+
+        if kind in SPACED or left in SPACED:
+            ret.append(gap(left, kind, space, space_commas=space_commas))
+        else:
+            ret.append(space)
+        ret.append(text)
+        left = kind
+        space = ""
+
+    if (
+        space_commas
+        and chunk_empty
+        and last_comma is not None
+        and "\n" not in space
+        and "\r" not in space
+    ):
+        # Trailing comma, only spaces follow
+        end, left = last_comma
+        del ret[end:]
+
+    ret.append(gap(left, None, space, space_commas=space_commas))
+    return "".join(ret)
+
+
+def space_tokens(
+    tokens: list,
+    *,
+    space_commas: bool = True,
+    at_start: bool = True,
+    at_end: bool = True,
+):
+    """Emit the tokens of a prompt, or of a piece of one.
+
+    A piece that does not start or end the prompt is spaced as if a word came
+    before or after it. With space_commas, spaces are stripped from the ends
+    of the prompt as align_commas does.
+    """
+    if not at_start:
+        tokens = [(TokenKind.TEXT, ""), *tokens]
+    if not at_end:
+        tokens = [*tokens, (TokenKind.TEXT, "")]
+    ret = emit(tokens, space_commas=space_commas)
+
+    if space_commas and at_start:
+        ret = ret.lstrip(" ")
+    if space_commas and at_end:
+        ret = ret.rstrip(" ")
+    return ret
+
+
+# Positional, so the cache key stays a plain tuple
+@lru_cache(maxsize=4096)
+def resolve_spacing(run: str, at_start: bool, at_end: bool, space_commas: bool):  # noqa: FBT001
+    """Space one run of whitespace, AND and specials found by re_spacing.
+
+    Only the run and whether it touches either end of the prompt matter,
+    anything else next to it is a word.
+    """
+    return space_tokens(
+        classify(scan(run)), space_commas=space_commas, at_start=at_start, at_end=at_end
+    )
+
+
+def normalize_spacing(
+    prompt: str,
+    *,
+    space_commas: bool = True,
+    at_start: bool = True,
+    at_end: bool = True,
+):
+    """Apply every whitespace rule of the pipeline in one pass.
+
+    Same as remove_whitespace_excessive, align_brackets, space_and,
+    space_bracekts, align_colons, align_commas and align_alternating in that
+    order, except that escaped brackets are words. Words are copied as they
+    are and every run between them is spaced once, and remembered.
+
+    at_start and at_end are False for a piece of a longer prompt that does
+    not start or end it, see space_tokens.
+    """
+    end = len(prompt)
+
+    def helper(match: re.Match):
+        run = match.group(1)
+        if run is None:  # escape
+            return match.group()
+        return resolve_spacing(
+            run,
+            at_start and match.start() == 0,
+            at_end and match.end() == end,
+            space_commas,
+        )
+
+    return re_spacing.sub(helper, prompt)
+
+
+def format_prompt(  # noqa: PLR0913
+    prompt: str,
+    *,
+    space_commas: bool = True,
+    bracket2weight: bool = True,
+    prefer_spacing: UnderSpaceEnum = UnderSpaceEnum.SPACE,
+    networks: NetworkEnum = NetworkEnum.KEEP,
+    merge_networks: MergeEnum = MergeEnum.NONE,
+    flatten_weights: bool = False,
+    split_weights: bool = False,
+    weight_precision: int = 2,
+    pack_chunks: bool = False,
+):
+    """Format a prompt, equivalent to pipeline.format_prompt."""
+    if stats.recorder is not None:
+        return format_prompt_recorded(
+            prompt,
+            stats.recorder,
+            space_commas=space_commas,
+            bracket2weight=bracket2weight,
+            prefer_spacing=prefer_spacing,
+            networks=networks,
+            merge_networks=merge_networks,
+            flatten_weights=flatten_weights,
+            split_weights=split_weights,
+            weight_precision=weight_precision,
+            pack_chunks=pack_chunks,
+        )
+
+    found = features.features(prompt)
+    if found & features.NON_ASCII:
+        prompt = pipeline.normalize_characters(prompt)
+        found = features.features(prompt)
+
+    if converts_spacing(prompt, prefer_spacing):
+        ret = emit(lex(prompt, prefer_spacing), space_commas=space_commas)
+    else:
+        if found & features.BRACKETS:
+            prompt = pipeline.remove_mismatched_brackets(prompt)
+        ret = normalize_spacing(prompt, space_commas=space_commas)
+        if prefer_spacing == UnderSpaceEnum.TAGS:
+            ret = tags.to_tags(ret)
+    if bracket2weight and found & features.WEIGHTS:
+        ret = pipeline.bracket_to_weights_indexed(ret)
+    if (flatten_weights or split_weights) and found & features.WEIGHTS:
+        ret = pipeline.fold_weights(
+            ret, split=split_weights, precision=weight_precision
+        )
+    if moves_networks(networks, merge_networks) and found & features.NETWORKS:
+        ret = pipeline.partition_networks(
+            ret, networks=networks, merge=merge_networks, space_commas=space_commas
+        )
+    if pack_chunks:
+        ret = tokens.pack(ret, space_commas=space_commas)
+    return ret.strip()
+
+
+def moves_networks(networks: NetworkEnum, merge: MergeEnum):
+    """Whether partition_networks changes anything with these options."""
+    return networks != NetworkEnum.KEEP or merge != MergeEnum.NONE
+
+
+def converts_spacing(prompt: str, mode: UnderSpaceEnum):
+    """Whether mode changes any space or underscore of a normalized prompt.
+
+    If not, normalize_spacing gives the same result as lexing and emitting.
+    """
+    return mode == UnderSpaceEnum.UNDERSCORE or (
+        mode == UnderSpaceEnum.SPACE and "_" in prompt
+    )
+
+
+def format_prompt_recorded(  # noqa: PLR0913
+    prompt: str,
+    recorder: stats.Recorder,
+    *,
+    space_commas: bool = True,
+    bracket2weight: bool = True,
+    prefer_spacing: UnderSpaceEnum = UnderSpaceEnum.SPACE,
+    networks: NetworkEnum = NetworkEnum.KEEP,
+    merge_networks: MergeEnum = MergeEnum.NONE,
+    flatten_weights: bool = False,
+    split_weights: bool = False,
+    weight_precision: int = 2,
+    pack_chunks: bool = False,
+):
+    """Format like format_prompt, recording every stage to recorder.
+
+    Every stage skipped for the features of the prompt is counted as
+    skipped.<stage>.
+    """
+    recorder.count("prompts")
+    found = features.features(prompt)
+    normalized = record_optional(
+        recorder,
+        "normalize_characters",
+        pipeline.normalize_characters,
+        prompt,
+        needed=bool(found & features.NON_ASCII),
+    )
+    if found & features.NON_ASCII:
+        found = features.features(normalized)
+
+    ret = record_optional(
+        recorder,
+        "remove_mismatched_brackets",
+        pipeline.remove_mismatched_brackets,
+        normalized,
+        needed=bool(found & features.BRACKETS),
+    )
+    ret = record_spacing(
+        recorder,
+        ret,
+        converts=converts_spacing(normalized, prefer_spacing),
+        prefer_spacing=prefer_spacing,
+        space_commas=space_commas,
+    )
+
+    if bracket2weight and not found & features.WEIGHTS:
+        recorder.count("skipped.bracket_to_weights")
+    elif bracket2weight:
+        ret = record_weights(recorder, ret)
+    if flatten_weights or split_weights:
+        ret = record_optional(
+            recorder,
+            "fold_weights",
+            pipeline.fold_weights,
+            ret,
+            needed=bool(found & features.WEIGHTS),
+            split=split_weights,
+            precision=weight_precision,
+        )
+    if moves_networks(networks, merge_networks):
+        ret = record_optional(
+            recorder,
+            "partition_networks",
+            pipeline.partition_networks,
+            ret,
+            needed=bool(found & features.NETWORKS),
+            networks=networks,
+            merge=merge_networks,
+            space_commas=space_commas,
+        )
+    if pack_chunks:
+        ret = recorder.stage(
+            "pack_chunks", tokens.pack, ret, space_commas=space_commas
+        )
+
+    return ret.strip()
+
+
+def record_optional(
+    recorder: stats.Recorder, name: str, fn, value, *, needed: bool, **kwargs
+):
+    """Record fn(value, **kwargs) as stage name, or count it skipped if not needed."""
+    if not needed:
+        recorder.count(f"skipped.{name}")
+        return value
+    return recorder.stage(name, fn, value, **kwargs)
+
+
+def record_spacing(
+    recorder: stats.Recorder,
+    prompt: str,
+    *,
+    converts: bool,
+    prefer_spacing: UnderSpaceEnum,
+    space_commas: bool,
+):
+    """Record spacing prompt, lexing it only if converts, see converts_spacing."""
+    if not converts:
+        ret = recorder.stage(
+            "normalize_spacing", normalize_spacing, prompt, space_commas=space_commas
+        )
+        if prefer_spacing == UnderSpaceEnum.TAGS:
+            ret = recorder.stage("to_tags", tags.to_tags, ret)
+        return ret
+
+    lexed = recorder.stage("scan", scan, prompt)
+    if prefer_spacing == UnderSpaceEnum.UNDERSCORE:
+        lexed = recorder.stage("to_underscores", to_underscores, lexed)
+    lexed = recorder.stage(
+        "classify",
+        classify,
+        lexed,
+        to_spaces=prefer_spacing == UnderSpaceEnum.SPACE,
+    )
+    return recorder.stage("emit", emit, lexed, space_commas=space_commas)
+
+
+def record_weights(recorder: stats.Recorder, prompt: str):
+    """Record bracket_to_weights_indexed of prompt, counting the groups rewritten."""
+    replace = recorder.stage(
+        "weight_replacements", pipeline.weight_replacements, prompt
+    )
+    recorder.count(
+        "bracket_to_weights.rewrites",
+        sum(text.endswith(")") for text in replace.values()),
+    )
+    return recorder.stage("splice", pipeline.splice, prompt, replace)
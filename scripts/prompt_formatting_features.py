@@ -0,0 +1,88 @@
+"""Cheap scan of what a prompt contains, to skip stages that cannot apply.
+
+Most prompts are plain ASCII tag lists. NFKC normalization of ASCII and
+bracket matching or weighting without brackets return the prompt unchanged,
+so formatters look at the features of a prompt and leave such stages out.
+
+With debug logging on, the features and skipped stages of every prompt are
+logged.
+"""
+
+import logging
+from enum import IntFlag, auto
+
+
+logger = logging.getLogger(__name__)
+
+
+class Feature(IntFlag):
+    NON_ASCII = auto()
+    PARENS = auto()
+    SQUARE = auto()
+    CURLY = auto()
+    ANGLE = auto()
+
+
+NON_ASCII = int(Feature.NON_ASCII)
+BRACKETS = int(Feature.PARENS | Feature.SQUARE | Feature.CURLY | Feature.ANGLE)
+WEIGHTS = int(Feature.PARENS | Feature.SQUARE)
+NETWORKS = int(Feature.ANGLE)
+
+# Plain ints, IntFlag operators cost as much as the scan itself
+markers = tuple(
+    (marker, int(feature))
+    for marker, feature in (
+        ("(", Feature.PARENS),
+        (")", Feature.PARENS),
+        ("[", Feature.SQUARE),
+        ("]", Feature.SQUARE),
+        ("{", Feature.CURLY),
+        ("}", Feature.CURLY),
+        ("<", Feature.ANGLE),
+        (">", Feature.ANGLE),
+    )
+)
+
+# Features that let a stage change the prompt, stages not listed always run
+triggers = {
+    "normalize_characters": NON_ASCII,
+    "remove_mismatched_brackets": BRACKETS,
+    "bracket_to_weights": WEIGHTS,
+    "weight_replacements": WEIGHTS,
+    "splice": WEIGHTS,
+    "fold_weights": WEIGHTS,
+    "partition_networks": NETWORKS,
+}
+
+
+def features(prompt: str) -> int:
+    """Bitmask of the Feature of prompt.
+
+    Each marker is a substring search in C, which beats walking the prompt
+    once in Python. Full-width characters only turn into brackets once
+    normalized, so scan again after normalize_characters.
+    """
+    ret = 0 if prompt.isascii() else NON_ASCII
+    for marker, feature in markers:
+        if marker in prompt:
+            ret |= feature
+    return ret
+
+
+def applies(name: str, found: int):
+    """Whether the stage name can change a prompt with features found."""
+    trigger = triggers.get(name)
+    return trigger is None or bool(found & trigger)
+
+
+def tracing():
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def trace(prompt: str, found: int, skipped: list):
+    logger.debug(
+        "%r features=%s skipped=[%s]",
+        prompt[:60],
+        Feature(found),
+        ", ".join(skipped),
+    )
@@ -0,0 +1,233 @@
+"""Reusable formatter configured once from FormatOptions.
+
+Every decision that only depends on the options is made when the formatter
+is built, leaving an ordered plan of stages that run one after the other.
+
+e.g.
+formatter = PromptFormatter(FormatOptions(prefer_spacing=UnderSpaceEnum.IGNORE))
+formatter.format("((a)),  b_c")  # '(a:1.21), b_c'
+"""
+
+import logging
+from collections.abc import Iterable
+from functools import cache, partial
+from typing import NamedTuple
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_features as features
+from scripts import prompt_formatting_patterns as patterns
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts import prompt_formatting_stats as stats
+from scripts import prompt_formatting_tags as tags
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import FormatOptions, UnderSpaceEnum
+
+
+logger = logging.getLogger(__name__)
+
+
+class Outcome(NamedTuple):
+    prompt: str
+    failed: str | None  # stage that raised or ran out of time, None if none
+
+
+class PromptFormatter:
+    """Format prompts through a stage plan built from options.
+
+    Stages that do nothing with the options, such as converting underscores
+    with UnderSpaceEnum.IGNORE or weights without bracket2weight, are left out
+    of the plan. Stages that do nothing with a prompt, see
+    prompt_formatting_features, are skipped. The output is the same as
+    engine.format_prompt.
+    """
+
+    def __init__(self, options: FormatOptions = FormatOptions()):
+        self.options = options
+        self.plan = self.build_plan()
+        self.stages = [fn for _, fn in self.plan]
+        self.triggers = [features.triggers.get(name) for name, _ in self.plan]
+
+    def __repr__(self):
+        names = ", ".join(name for name, _ in self.plan)
+        return f"{type(self).__name__}({self.options}, plan=[{names}])"
+
+    def build_plan(self):
+        """Return the (name, stage) pairs to run, in order."""
+        space_commas = self.options.space_commas
+        mode = self.options.prefer_spacing
+
+        plan = [
+            ("normalize_characters", pipeline.normalize_characters),
+            ("remove_mismatched_brackets", pipeline.remove_mismatched_brackets),
+        ]
+        if mode == UnderSpaceEnum.UNDERSCORE:
+            plan += [
+                ("scan", engine.scan),
+                ("to_underscores", engine.to_underscores),
+                ("classify", engine.classify),
+                ("emit", partial(engine.emit, space_commas=space_commas)),
+            ]
+        elif mode == UnderSpaceEnum.SPACE:
+            plan.append(("to_spaces", self.to_spaces))
+        else:
+            plan.append(
+                (
+                    "normalize_spacing",
+                    partial(engine.normalize_spacing, space_commas=space_commas),
+                )
+            )
+            if mode == UnderSpaceEnum.TAGS:
+                plan.append(("to_tags", tags.to_tags))
+
+        if self.options.bracket2weight:
+            plan.append(("bracket_to_weights", pipeline.bracket_to_weights_indexed))
+        if self.options.flatten_weights or self.options.split_weights:
+            plan.append(("fold_weights", self.fold_weights))
+        if engine.moves_networks(self.options.networks, self.options.merge_networks):
+            plan.append(("partition_networks", self.partition_networks))
+        if self.options.pack_chunks:
+            plan.append(
+                (
+                    "pack_chunks",
+                    partial(tokens.pack, space_commas=self.options.space_commas),
+                )
+            )
+        plan.append(("strip", str.strip))
+        return plan
+
+    def to_spaces(self, prompt: str):
+        """Convert underscores to spaces and space, lexing only if needed."""
+        space_commas = self.options.space_commas
+        if "_" not in prompt:
+            return engine.normalize_spacing(prompt, space_commas=space_commas)
+
+        tokens = engine.classify(engine.scan(prompt), to_spaces=True)
+        return engine.emit(tokens, space_commas=space_commas)
+
+    def fold_weights(self, prompt: str):
+        return pipeline.fold_weights(
+            prompt,
+            split=self.options.split_weights,
+            precision=self.options.weight_precision,
+        )
+
+    def partition_networks(self, prompt: str):
+        return pipeline.partition_networks(
+            prompt,
+            networks=self.options.networks,
+            merge=self.options.merge_networks,
+            space_commas=self.options.space_commas,
+        )
+
+    def format_piece(self, piece: str, *, at_start: bool = True, at_end: bool = True):
+        """Space and weight a normalized prompt, or a piece of one.
+
+        Brackets must be balanced within the piece, and it must not start or
+        end inside a word or a run of whitespace and specials, see
+        engine.space_tokens for at_start and at_end. Nothing is stripped
+        besides spaces at the ends of a whole prompt.
+        """
+        space_commas = self.options.space_commas
+        mode = self.options.prefer_spacing
+        if mode in (UnderSpaceEnum.IGNORE, UnderSpaceEnum.TAGS) or (
+            mode == UnderSpaceEnum.SPACE and "_" not in piece
+        ):
+            ret = engine.normalize_spacing(
+                piece, space_commas=space_commas, at_start=at_start, at_end=at_end
+            )
+            if mode == UnderSpaceEnum.TAGS:
+                ret = tags.to_tags(ret)
+        else:
+            tokens = engine.scan(piece)
+            if mode == UnderSpaceEnum.UNDERSCORE:
+                tokens = engine.to_underscores(tokens)
+            tokens = engine.classify(tokens, to_spaces=mode == UnderSpaceEnum.SPACE)
+            ret = engine.space_tokens(
+                tokens, space_commas=space_commas, at_start=at_start, at_end=at_end
+            )
+
+        if self.options.bracket2weight:
+            ret = pipeline.bracket_to_weights_indexed(ret)
+        if self.options.flatten_weights or self.options.split_weights:
+            ret = self.fold_weights(ret)
+        return ret
+
+    def format(self, prompt: str):
+        if stats.recorder is not None:
+            return engine.format_prompt_recorded(
+                prompt, stats.recorder, **self.options._asdict()
+            )
+
+        if features.tracing():
+            return self.format_traced(prompt)
+
+        found = features.features(prompt)
+        for stage, trigger in zip(self.stages, self.triggers):
+            if trigger is None or found & trigger:
+                prompt = stage(prompt)
+                if trigger == features.NON_ASCII:
+                    found = features.features(prompt)
+        return prompt
+
+    def format_traced(self, prompt: str):
+        """Format like format, logging the stages skipped."""
+        original = prompt
+        found = features.features(prompt)
+        skipped = []
+        for (name, stage), trigger in zip(self.plan, self.triggers):
+            if trigger is None or found & trigger:
+                prompt = stage(prompt)
+                if trigger == features.NON_ASCII:
+                    found = features.features(prompt)
+            else:
+                skipped.append(name)
+
+        features.trace(original, found, skipped)
+        return prompt
+
+    def format_within(self, prompt: str, seconds: float):
+        """Format like format, in about seconds at most, and never raising.
+
+        Every pattern is given the time left, and time is checked between
+        stages. If a stage raises or runs out of time, the prompt as the last
+        stage that returned text left it is kept, and the stage logged.
+        With stats enabled, every stage is recorded. Return an Outcome.
+        """
+        recorder = stats.recorder
+        if recorder is not None:
+            recorder.count("prompts")
+        good = prompt
+        name = None
+        try:
+            with patterns.deadline(seconds):
+                found = features.features(prompt)
+                for (name, stage), trigger in zip(self.plan, self.triggers):
+                    if trigger is not None and not found & trigger:
+                        if recorder is not None:
+                            recorder.count(f"skipped.{name}")
+                        continue
+
+                    patterns.remaining()
+                    if recorder is None:
+                        prompt = stage(prompt)
+                    else:
+                        prompt = recorder.stage(name, stage, prompt)
+                    if isinstance(prompt, str):
+                        good = prompt
+                    if trigger == features.NON_ASCII:
+                        found = features.features(prompt)
+        except Exception as e:
+            logger.warning(
+                "Formatting stopped at %s, keeping the prompt before it: %r", name, e
+            )
+            return Outcome(good.strip(), name)
+        return Outcome(prompt, None)
+
+    def format_many(self, prompts: Iterable):
+        return [self.format(prompt) for prompt in prompts]
+
+
+@cache
+def get_formatter(options: FormatOptions = FormatOptions()):
+    """Shared formatter of options, built on first use."""
+    return PromptFormatter(options)
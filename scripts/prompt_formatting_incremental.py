@@ -0,0 +1,233 @@
+"""Re-format only the parts of a prompt that changed since the last call.
+
+A prompt is cut at top level commas into chunks, and chunks at top level
+BREAK into pieces. No bracket, weight or network spans a top level cut, so
+every piece formats on its own and the formatted prompt is the pieces put
+back together the way align_commas joins chunks.
+
+An edit that adds or removes a bracket, comma, backslash or BREAK can move
+any cut, so the whole prompt is cut again and only pieces whose text is new
+are formatted. Any other edit stays inside one piece, which is the only one
+formatted and spliced back in.
+"""
+
+from bisect import bisect_left, bisect_right
+
+import regex as re
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_patterns as patterns
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_formatter import PromptFormatter
+
+
+re_segment_marks = patterns.compile(r"\\.|[()\[\]{}<>,]|(?<!\S)BREAK", re.DOTALL)
+re_structure = patterns.compile(r"[()\[\]{}<>,\\]")
+
+
+def segments(prompt: str):
+    """Cut a prompt with balanced brackets into chunks of pieces.
+
+    Chunks are split at commas outside of any bracket, which are dropped.
+    Pieces of a chunk are split right before every BREAK outside of any
+    bracket that follows whitespace. Return the (start, end) span of every
+    piece, as a list per chunk.
+    """
+    chunks = []
+    pieces = []
+    depth = 0
+    last = 0
+    for match in re_segment_marks.finditer(prompt):
+        mark = match.group()
+        if mark[0] == "\\":  # escaped
+            continue
+        if mark in "([{<":
+            depth += 1
+        elif mark in ")]}>":
+            depth -= 1
+        elif depth:
+            continue
+        elif mark == ",":
+            pieces.append((last, match.start()))
+            chunks.append(pieces)
+            pieces = []
+            last = match.end()
+        elif match.start() > last:  # BREAK
+            pieces.append((last, match.start()))
+            last = match.start()
+
+    pieces.append((last, len(prompt)))
+    chunks.append(pieces)
+    return chunks
+
+
+def join_chunks(chunks: list):
+    """Join chunks formatted with space_commas, as align_commas does.
+
+    Chunks are stripped of spaces, so the empty ones are dropped. As with
+    align_alternating, no space goes between a comma and a '|'.
+    """
+    ret = []
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if ret:
+            ret.append("," if chunk[0] == "|" else ", ")
+        ret.append(chunk)
+    return "".join(ret)
+
+
+def common_affixes(a: str, b: str):
+    """Length of the common prefix and suffix of a and b, not overlapping."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a.startswith(b[:mid]):
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+
+    lo, hi = 0, min(len(a), len(b)) - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a.endswith(b[len(b) - mid :]):
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, lo
+
+
+class IncrementalFormatter:
+    """Format a prompt that changes a little between calls, e.g. while typing.
+
+    Gives the same result as PromptFormatter. The previous prompt, where it
+    was cut and every formatted piece are kept for the next call.
+    """
+
+    def __init__(self, options: FormatOptions = FormatOptions()):
+        self.formatter = PromptFormatter(options)
+        self.prompt = None
+        self.formatted = None
+        self.normalized = ""
+        self.removed = []  # positions in normalized of mismatched brackets
+        self.starts = []  # start of every piece in the cleaned prompt
+        self.texts = []
+        self.flags = []  # (at_start, at_end) of every piece in its chunk
+        self.outputs = []
+        self.chunk_of = []  # chunk of every piece
+        self.chunks = []  # (first, last) piece of every chunk, last exclusive
+        self.chunk_outputs = []
+        self.reused = 0
+        self.misses = 0
+
+    @property
+    def options(self):
+        return self.formatter.options
+
+    def format(self, prompt: str):
+        if prompt == self.prompt:
+            return self.formatted
+
+        normalized = pipeline.normalize_characters(prompt)
+        if not self.splice(normalized):
+            self.cut(normalized)
+
+        if self.options.space_commas:
+            ret = join_chunks(self.chunk_outputs)
+        else:
+            ret = ",".join(self.chunk_outputs)
+        options = self.options
+        moves = engine.moves_networks(options.networks, options.merge_networks)
+        if moves and "<" in ret:
+            ret = self.formatter.partition_networks(ret)
+        if options.pack_chunks:
+            ret = tokens.pack(ret, space_commas=options.space_commas)
+
+        self.prompt = prompt
+        self.normalized = normalized
+        self.formatted = ret.strip()
+        return self.formatted
+
+    def format_piece(self, text: str, flags: tuple):
+        self.misses += 1
+        return self.formatter.format_piece(text, at_start=flags[0], at_end=flags[1])
+
+    def cut(self, normalized: str):
+        """Cut the prompt again, formatting only pieces not seen last time."""
+        invalid = pipeline.mismatched_brackets(normalized)
+        self.removed = [i for i, flag in enumerate(invalid) if flag]
+        cleaned = pipeline.remove_mismatched_brackets(normalized)
+
+        previous = dict(zip(zip(self.texts, self.flags), self.outputs))
+        self.starts, self.texts, self.flags, self.outputs = [], [], [], []
+        self.chunk_of, self.chunks, self.chunk_outputs = [], [], []
+
+        for pieces in segments(cleaned):
+            first = len(self.texts)
+            for i, (start, end) in enumerate(pieces):
+                text = cleaned[start:end]
+                flags = (i == 0, i == len(pieces) - 1)
+                output = previous.get((text, flags))
+                if output is None:
+                    output = self.format_piece(text, flags)
+                    previous[(text, flags)] = output
+                else:
+                    self.reused += 1
+
+                self.starts.append(start)
+                self.texts.append(text)
+                self.flags.append(flags)
+                self.outputs.append(output)
+                self.chunk_of.append(len(self.chunks))
+
+            self.chunks.append((first, len(self.texts)))
+            self.chunk_outputs.append("".join(self.outputs[first:]))
+
+    def splice(self, normalized: str):
+        """Apply an edit that stays inside one piece, False if it does not."""
+        if self.prompt is None:
+            return False
+
+        old = self.normalized
+        prefix, suffix = common_affixes(old, normalized)
+        old_edit = old[prefix : len(old) - suffix]
+        new_edit = normalized[prefix : len(normalized) - suffix]
+        if (
+            old[prefix - 1 : prefix] == "\\"  # escaping the edit
+            or re_structure.search(old_edit)
+            or re_structure.search(new_edit)
+        ):
+            return False
+
+        # Brackets are untouched, so none of the edit was removed
+        start = prefix - bisect_left(self.removed, prefix)
+        k = bisect_right(self.starts, start) - 1
+        if k < 0:
+            return False
+        offset = start - self.starts[k]
+        end = offset + len(old_edit)
+        old_text = self.texts[k]
+        text = old_text[:offset] + new_edit + old_text[end:]
+        if (
+            end > len(old_text)
+            # A BREAK must not come or go, nor the whitespace before one
+            or "BREAK" in old_text[max(offset - 5, 0) : end + 5]
+            or "BREAK" in text[max(offset - 5, 0) : offset + len(new_edit) + 5]
+            or (end == len(old_text) and not self.flags[k][1])
+        ):
+            return False
+
+        delta = len(new_edit) - len(old_edit)
+        self.texts[k] = text
+        self.outputs[k] = self.format_piece(text, self.flags[k])
+        self.starts[k + 1 :] = [s + delta for s in self.starts[k + 1 :]]
+        split = bisect_left(self.removed, prefix + len(old_edit))
+        self.removed[split:] = [i + delta for i in self.removed[split:]]
+
+        first, last = self.chunks[self.chunk_of[k]]
+        self.chunk_outputs[self.chunk_of[k]] = "".join(self.outputs[first:last])
+        self.reused += len(self.texts) - 1
+        return True
@@ -0,0 +1,97 @@
+"""Array backed bracket maps for one or many prompts.
+
+Depth is an int32 array, the cumsum of a +1/-1/0 int8 gradient, so it is not
+limited to the single digit a character of a string map can hold, and every
+entry lines up with its character at any nesting depth. bracket_to_weights
+reads these maps.
+
+get_mappings_batch maps many prompts in one vectorized call over a ragged
+array, for bulk jobs that need the bracket structure of thousands of prompts.
+
+e.g.
+get_mappings("((a))").depth  # array([1, 2, 2, 1, 0], dtype=int32)
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+
+opening = np.array([ord(c) for c in "(["], dtype=np.uint32)
+closing = np.array([ord(c) for c in ")]"], dtype=np.uint32)
+
+
+class Mappings(NamedTuple):
+    depth: np.ndarray  # int32, depth after each character
+    gradient: np.ndarray  # int8, +1 opening, -1 closing, 0 otherwise
+    brackets: np.ndarray  # bool, True on ( [ ) ]
+
+
+class BatchMappings(NamedTuple):
+    depth: np.ndarray
+    gradient: np.ndarray
+    brackets: np.ndarray
+    offsets: np.ndarray  # prompt i spans offsets[i]:offsets[i + 1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return Mappings(self.depth[a:b], self.gradient[a:b], self.brackets[a:b])
+
+
+def to_codepoints(s: str):
+    return np.frombuffer(s.encode("utf-32-le"), dtype="<u4")
+
+
+def gradient_map(codes: np.ndarray):
+    """Return the signed +1/-1/0 effect of each character on depth."""
+    gradient = np.isin(codes, opening).astype(np.int8)
+    gradient -= np.isin(codes, closing)
+    return gradient
+
+
+def get_mappings(s: str):
+    gradient = gradient_map(to_codepoints(s))
+    depth = np.cumsum(gradient, dtype=np.int32)
+    return Mappings(depth, gradient, gradient != 0)
+
+
+def get_mappings_batch(prompts: list):
+    """Map many prompts in one vectorized call.
+
+    The prompts are concatenated into one ragged array, the running depth is
+    taken over all of them at once and every prompt is then rebased to start
+    at depth 0.
+    """
+    lengths = np.fromiter(map(len, prompts), dtype=np.int64, count=len(prompts))
+    offsets = np.zeros(len(prompts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    gradient = gradient_map(to_codepoints("".join(prompts)))
+    depth = np.cumsum(gradient, dtype=np.int32)
+
+    # Depth carried over from every prompt before, taken off each prompt
+    carried = np.concatenate(([0], depth))[offsets[:-1]]
+    depth -= np.repeat(carried, lengths)
+
+    return BatchMappings(depth, gradient, gradient != 0, offsets)
+
+
+def pad(batch: BatchMappings):
+    """Return padded 2D depth, gradient and bracket arrays of a batch.
+
+    Rows past the end of a shorter prompt are depth 0, gradient 0 and False.
+    """
+    lengths = np.diff(batch.offsets)
+    width = int(lengths.max()) if len(lengths) else 0
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    columns = np.arange(len(batch.depth)) - np.repeat(batch.offsets[:-1], lengths)
+
+    ret = []
+    for values in (batch.depth, batch.gradient, batch.brackets):
+        padded = np.zeros((len(lengths), width), dtype=values.dtype)
+        padded[rows, columns] = values
+        ret.append(padded)
+    return Mappings(*ret)
@@ -0,0 +1,299 @@
+"""Compact tree of a parsed prompt, for holding many prompts in memory.
+
+Nodes use __slots__ and hold their children in tuples. Text is split at
+commas into tags and separators. Nodes are immutable, so every node is
+shared: parsing the same tag, weighted tag or group twice returns the same
+node, and its strings are interned. A corpus of prompts repeating the same
+tags mostly costs one pointer per tag. Shared nodes are held weakly, so a
+node is forgotten once no prompt uses it.
+
+parse(prompt).to_string() == prompt for any prompt. Brackets that do not
+match, see pipeline.mismatched_brackets, and escaped brackets are text.
+
+e.g.
+parse("a, (b:1.2), [c|d]").children
+(Text('a'), Text(', '), Weight((Text('b'),), '1.2'), Text(', '),
+ Alternation(((Text('c'),), (Text('d'),))))
+"""
+
+import sys
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from weakref import WeakValueDictionary
+
+import regex as re
+
+from scripts import prompt_formatting_patterns as patterns
+
+
+re_marks = patterns.compile(r"\\.|[()\[\]{}<>]", re.DOTALL)
+re_separator = patterns.compile(r"(\s*,\s*)")
+re_weight = patterns.compile(r"\s*[+-]?(?:\d+\.?\d*|\.\d+)\s*")
+
+closing_of = {"(": ")", "[": "]", "{": "}", "<": ">"}
+opening_of = {v: k for k, v in closing_of.items()}
+
+
+class Node(ABC):
+    """Base of every node, its fields are the __slots__ of its class."""
+
+    __slots__ = ("__weakref__", "_hash")
+
+    def __init__(self):
+        # Called last by subclasses, once the fields are set. Children give
+        # their stored hash, so this never walks the subtree.
+        self._hash = hash(self.key())
+
+    @abstractmethod
+    def to_string(self):
+        """Text of the node, as it was parsed."""
+
+    def key(self):
+        """Type and fields, equal for equal nodes."""
+        return (type(self), *(getattr(self, name) for name in self.__slots__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        fields = ", ".join(repr(getattr(self, name)) for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+def join(children: tuple):
+    return "".join(child.to_string() for child in children)
+
+
+class Text(Node):
+    """Plain text, a tag or a separator. Use text() to get a shared one."""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+        super().__init__()
+
+    def to_string(self):
+        return self.text
+
+
+# Keyed by text and Node.key, an entry goes with the last prompt using its node
+texts = WeakValueDictionary()
+shared = WeakValueDictionary()
+
+
+def text(s: str):
+    """Shared Text node of s."""
+    node = texts.get(s)
+    if node is None:
+        node = texts[s] = Text(sys.intern(s))
+    return node
+
+
+def share(node: Node):
+    """Shared node equal to node."""
+    key = node.key()
+    ret = shared.get(key)
+    if ret is None:
+        ret = shared[key] = node
+    return ret
+
+
+def clear():
+    """Stop sharing the nodes parsed so far, prompts keep those they use."""
+    texts.clear()
+    shared.clear()
+
+
+class Group(Node):
+    """Brackets of any kind that are not a weight, editing or alternation."""
+
+    # constructor order, which __repr__ follows
+    __slots__ = ("opening", "children")  # noqa: RUF023
+
+    def __init__(self, opening: str, children: tuple):
+        self.opening = opening
+        self.children = children
+        super().__init__()
+
+    def to_string(self):
+        return self.opening + join(self.children) + closing_of[self.opening]
+
+
+class Weight(Node):
+    """(children:weight), weight kept as written, spacing included."""
+
+    __slots__ = ("children", "weight")
+
+    def __init__(self, children: tuple, weight: str):
+        self.children = children
+        self.weight = weight
+        super().__init__()
+
+    def to_string(self):
+        return f"({join(self.children)}:{self.weight})"
+
+
+class Network(Node):
+    """<...> such as <lora:name:0.5>, kept as written."""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+        super().__init__()
+
+    def to_string(self):
+        return f"<{self.text}>"
+
+
+class Editing(Node):
+    """[from:to:when] or [to:when], every part split at ':'."""
+
+    __slots__ = ("parts",)
+
+    def __init__(self, parts: tuple):
+        self.parts = parts
+        super().__init__()
+
+    def to_string(self):
+        return "[" + ":".join(join(part) for part in self.parts) + "]"
+
+
+class Alternation(Node):
+    """[a|b|...], every option split at '|'."""
+
+    __slots__ = ("options",)
+
+    def __init__(self, options: tuple):
+        self.options = options
+        super().__init__()
+
+    def to_string(self):
+        return "[" + "|".join(join(option) for option in self.options) + "]"
+
+
+class Prompt(Node):
+    __slots__ = ("children",)
+
+    def __init__(self, children: tuple):
+        self.children = children
+        super().__init__()
+
+    def to_string(self):
+        return join(self.children)
+
+
+def pair_brackets(prompt: str):
+    """Map the position of every matched opening bracket to its closing one.
+
+    Brackets match as in pipeline.mismatched_brackets.
+    """
+    pairs = {}
+    unclosed = []
+    for match in re_marks.finditer(prompt):
+        c = match.group()
+        if len(c) > 1:  # escaped
+            continue
+
+        i = match.start()
+        if c in opening_of and unclosed and prompt[unclosed[-1]] == opening_of[c]:
+            pairs[unclosed.pop()] = i
+        else:
+            unclosed.append(i)
+    return Pairs(pairs)
+
+
+class Pairs(dict):
+    """Bracket pairs, with the openings in order to find those in a span."""
+
+    def __init__(self, pairs: dict):
+        super().__init__(pairs)
+        self.openings = sorted(pairs)
+
+
+def parse(prompt: str):
+    return Prompt(children(prompt, 0, len(prompt), pair_brackets(prompt)))
+
+
+def children(prompt: str, start: int, end: int, pairs: Pairs):
+    """Nodes of prompt[start:end], which brackets do not cross."""
+    ret = []
+    openings = pairs.openings
+    last = start
+    k = bisect_left(openings, start)
+    while k < len(openings) and openings[k] < end:
+        i = openings[k]
+        plain(prompt[last:i], ret)
+        ret.append(group(prompt, i, pairs[i], pairs))
+        last = pairs[i] + 1
+        k = bisect_left(openings, last, k)
+    plain(prompt[last:end], ret)
+    return tuple(ret)
+
+
+def plain(s: str, ret: list):
+    if "," not in s:
+        if s:
+            ret.append(text(s))
+        return
+
+    for piece in re_separator.split(s):
+        if piece:
+            ret.append(text(piece))
+
+
+def split(prompt: str, start: int, end: int, pairs: Pairs, separator: str):
+    """Spans of prompt[start:end] split at separator outside of brackets."""
+    spans = []
+    i = last = start
+    while i < end:
+        c = prompt[i]
+        if c == "\\":
+            i += 2
+            continue
+        if i in pairs:
+            i = pairs[i] + 1
+            continue
+        if c == separator:
+            spans.append((last, i))
+            last = i + 1
+        i += 1
+    spans.append((last, end))
+    return spans
+
+
+def group(prompt: str, start: int, end: int, pairs: Pairs):
+    """Shared node of the matched brackets at start and end."""
+    return share(make_group(prompt, start, end, pairs))
+
+
+def make_group(prompt: str, start: int, end: int, pairs: Pairs):
+    opening = prompt[start]
+    if opening == "<":
+        return Network(sys.intern(prompt[start + 1 : end]))
+
+    if opening == "[":
+        options = split(prompt, start + 1, end, pairs, "|")
+        if len(options) > 1:
+            return Alternation(
+                tuple(children(prompt, a, b, pairs) for a, b in options)
+            )
+        parts = split(prompt, start + 1, end, pairs, ":")
+        if len(parts) > 1:
+            return Editing(tuple(children(prompt, a, b, pairs) for a, b in parts))
+
+    if opening == "(":
+        parts = split(prompt, start + 1, end, pairs, ":")
+        a, b = parts[-1]
+        if len(parts) > 1 and re_weight.fullmatch(prompt, a, b):
+            return Weight(
+                children(prompt, start + 1, a - 1, pairs), sys.intern(prompt[a:b])
+            )
+
+    return Group(opening, children(prompt, start + 1, end, pairs))
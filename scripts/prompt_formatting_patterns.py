@@ -0,0 +1,147 @@
+r"""Regular expressions compiled on first use rather than on import.
+
+Compiling every pattern of the formatter up front is most of the time it
+takes to import, which the CLI and every worker process pay before
+formatting anything. A LazyPattern stands in for a compiled pattern, is
+compiled by the first method called on it, and from then on hands out the
+compiled pattern's methods as plain attributes.
+
+Within deadline, every match, search, split and substitution of a
+LazyPattern is given the time left as the regex module's timeout, so a
+pattern backtracking on an adversarial prompt raises TimeoutError instead
+of hanging the caller. The methods are only wrapped while a deadline is
+open in some thread, otherwise they are the compiled pattern's own.
+
+e.g.
+re_comma = compile(r"\s*,\s*")  # nothing compiled yet
+re_comma.sub(", ", "a ,b")  # compiled here
+# 'a, b'
+with deadline(0.1):
+    re_comma.sub(", ", prompt)  # TimeoutError after 0.1 s
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+import regex as re
+
+
+# Methods of a compiled pattern that run it, and take a timeout
+CALLS = (
+    "search",
+    "match",
+    "fullmatch",
+    "split",
+    "splititer",
+    "findall",
+    "finditer",
+    "sub",
+    "subn",
+)
+ATTRIBUTES = ("groups", "groupindex")
+
+local = threading.local()
+
+# Deadlines open in every thread, and the compiled patterns to switch to timed
+# methods while there are any
+active = 0
+lock = threading.Lock()
+compiled_patterns = []
+
+
+def remaining():
+    """Seconds left of the current deadline, None without one.
+
+    Raise TimeoutError once it has passed.
+    """
+    at = getattr(local, "deadline", None)
+    if at is None:
+        return None
+
+    left = at - time.perf_counter()
+    if left <= 0:
+        msg = "formatting ran out of time"
+        raise TimeoutError(msg)
+    return left
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Give every pattern used in this thread seconds in total to run."""
+    opened(1)
+    previous = getattr(local, "deadline", None)
+    local.deadline = time.perf_counter() + seconds
+    if previous is not None:
+        local.deadline = min(local.deadline, previous)
+    try:
+        yield
+    finally:
+        local.deadline = previous
+        opened(-1)
+
+
+def opened(n: int):
+    """Count n more open deadlines, switching methods on the first and last."""
+    global active  # noqa: PLW0603
+    with lock:
+        before = active
+        active += n
+        if not before or not active:
+            for pattern in compiled_patterns:
+                pattern.switch()
+
+
+def timed(method):
+    """Wrap method to run with the time left as its timeout within a deadline."""
+
+    def call(*args, **kwargs):
+        left = remaining()
+        if left is None:
+            return method(*args, **kwargs)
+        return method(*args, timeout=left, **kwargs)
+
+    return call
+
+
+class LazyPattern:
+    # Once compiled, __dict__ is one of plain and timed, the methods of the
+    # compiled pattern as they are or wrapped by timed
+    __slots__ = ("__dict__", "flags", "pattern", "plain", "timed")
+
+    def __init__(self, pattern: str, flags: int = 0):
+        self.pattern = pattern
+        self.flags = flags
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.pattern!r}, {self.flags!r})"
+
+    def __getattr__(self, name: str):
+        if name not in CALLS and name not in ATTRIBUTES:
+            raise AttributeError(name)
+        self.compile()
+        return getattr(self, name)
+
+    def compile(self):
+        """Compile the pattern, whose methods replace the lazy lookup above."""
+        compiled = re.compile(self.pattern, self.flags)
+        self.plain = {name: getattr(compiled, name) for name in CALLS + ATTRIBUTES}
+        self.timed = {**self.plain, **{name: timed(self.plain[name]) for name in CALLS}}
+        with lock:
+            self.switch()
+            compiled_patterns.append(self)
+        return compiled
+
+    def switch(self):
+        """Use the timed methods while any deadline is open."""
+        self.__dict__ = self.timed if active else self.plain
+
+    @property
+    def compiled(self):
+        """Whether the pattern has been compiled yet."""
+        return "sub" in vars(self)
+
+
+def compile(pattern: str, flags: int = 0):
+    """Return a pattern compiled the first time it is used."""
+    return LazyPattern(pattern, flags)
@@ -1,34 +1,42 @@
 """Various functions clean up and transform a prompt."""
 
 import unicodedata
+from bisect import bisect_left
 
 import regex as re
 
-from scripts.prompt_formatting_definitions import UnderSpaceEnum
+from scripts import prompt_formatting_nodes as nodes
+from scripts import prompt_formatting_patterns as patterns
+from scripts import prompt_formatting_tags as tags
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import MergeEnum, NetworkEnum, UnderSpaceEnum
 
 brackets_opening = "([{<"
 brackets_closing = ")]}>"
 
-re_whitespace = re.compile(r"[^\S\r\n]+")  # excludes new lines
-re_tokenize = re.compile(r",")
-re_tokenize_strip = re.compile(r"\s*,\s*")
-re_comma_spacing = re.compile(r",+")
-re_brackets_fix_whitespace = re.compile(r"([\(\[{<])\s*|\s*([\)\]}>}])")
-re_opposing_brackets = re.compile(r"([)\]}>])([([{<])")
-re_networks = re.compile(r"<.+?>")
-re_bracket_open = re.compile(r"[(\[](?![^<]*>)")
-re_brackets_open = re.compile(r"\(+|\[+(?![^<]*>])")
-re_brackets_closing = re.compile(r"\)+|\]+(?![^<]*>)")
-re_colon_spacing = re.compile(r"\s*(:)\s*")
-re_colon_spacing_composite = re.compile(r"\s*(:)\s*(?=\d*?\.?\d*?\s*?AND)")
-re_colon_spacing_comp_end = re.compile(r"(?<=AND[^:]*?)(:)(?=[^:]*$)")
-re_paren_weights_exist = re.compile(r"\(.*(?<!:):\d.?\d*\)+")
-re_is_prompt_editing = re.compile(r"\[.*:.*\]")
-re_is_prompt_alternating = re.compile(r"\[.*|.*\]")
-re_is_wildcard = re.compile(r"{.*}")
-re_and = re.compile(r"(.*?)\s*(AND)\s*(.*?)")
-re_pipe = re.compile(r"\s*(\|)\s*")
-re_existing_weight = re.compile(r"(?<=:)(\d+.?\d*|\d*.?\d+)(?=[)\]]$)")
+re_whitespace = patterns.compile(r"[^\S\r\n]+")  # excludes new lines
+re_tokenize = patterns.compile(r",")
+re_tokenize_strip = patterns.compile(r"\s*,\s*")
+re_comma_spacing = patterns.compile(r",+")
+re_brackets_fix_whitespace = patterns.compile(r"([\(\[{<])\s*|\s*([\)\]}>}])")
+re_opposing_brackets = patterns.compile(r"([)\]}>])([([{<])")
+re_networks = patterns.compile(r"\\.|([(\[{])|([)\]}])|(,)|<([^<>]*)>", re.DOTALL)
+re_network_weight = patterns.compile(
+    r"(.*?)\s*:\s*([+-]?(?:\d+\.?\d*|\.\d+))\s*", re.DOTALL
+)
+re_bracket_open = patterns.compile(r"[(\[](?![^<]*>)")
+re_brackets_open = patterns.compile(r"\(+|\[+(?![^<]*>])")
+re_colon_spacing = patterns.compile(r"\s*(:)\s*")
+re_and = patterns.compile(r"\s*AND\s*")
+re_pipe = patterns.compile(r"\s*(\|)\s*")
+re_existing_weight_before = patterns.compile(r"(?<=:\d+.?\d*)[)\]]")
+re_existing_weight_end = patterns.compile(r"(:\d+.?\d*)[)\]]$")
+# Only applied outside of networks, see outside_networks
+re_underscore_to_space = patterns.compile(r"(?<!BREAK)(?<=\w)_+(?=\w)(?!BREAK)")
+re_space_to_underscore = patterns.compile(r"(?<!BREAK)(?<=\w) +(?=\w)(?!BREAK)")
+re_only_networks = patterns.compile(r"(?:<[^<>]*>\s*)+")
+re_bracket_marks = patterns.compile(r"\\.|[()\[\]<>:|]", re.DOTALL)
+re_brackets_escapable = patterns.compile(r"\\.|[()\[\]{}<>]", re.DOTALL)
 
 
 def escape_bracket_index(token, symbols, start_index=0):
@@ -63,7 +71,7 @@ def get_weight(
     map_brackets: list,
     pos: int,
     ctv: int,
-    gradient_search: str,
+    gradient_search: tuple,
     is_square_brackets: bool = False,
 ):
     """Determine a weight given the start of its brackets.
@@ -89,18 +97,28 @@ def get_weight(
             if map_depth[-2] == map_depth[a]:
                 return prompt, 0, 1
             if map_depth[a] in gradient_search:
-                gradient_search = gradient_search.replace(map_depth[a], "")
+                gradient_search = tuple(d for d in gradient_search if d != map_depth[a])
                 ctv -= 1
-        elif map_gradient[a:b] == "v" * ctv and map_depth[a - 1 : b] == gradient_search:
+        elif map_gradient[a:b] == [-1] * ctv and (
+            tuple(map_depth[a - 1 : b]) == gradient_search
+        ):
             return a, calculate_weight(ctv, is_square_brackets=is_square_brackets), ctv
-        elif "v" == map_gradient[a] and map_depth[a - 1 : b - 1] in gradient_search:
-            narrowing = map_gradient[a:b].count("v")
+        elif map_gradient[a] == -1 and is_run(
+            map_depth[a - 1 : b - 1], gradient_search
+        ):
+            narrowing = map_gradient[a:b].count(-1)
             gradient_search = gradient_search[narrowing:]
             ctv -= 1
         pos += 1
 
     msg = f"Somehow weight index searching has gone outside of prompt length with prompt: {prompt}"
-    raise Exception(msg)
+    raise ValueError(msg)
+
+def is_run(values: list, run: tuple):
+    """Return whether values appear one after the other somewhere in run."""
+    n = len(values)
+    return any(tuple(values) == run[i : i + n] for i in range(len(run) - n + 1))
+
 
 def get_bracket_closing(c: str):
     return brackets_closing[brackets_opening.find(c)]
@@ -119,7 +137,7 @@ def tokenize(data: str, *, strip:bool = False) -> list:
 
 
 def remove_whitespace_excessive(prompt: str):
-    return " ".join(re.split(re_whitespace, prompt))
+    return " ".join(re_whitespace.split(prompt))
 
 
 def align_brackets(prompt: str):
@@ -141,10 +159,7 @@ def space_and(prompt: str):
     e.g.
     'a   ANDb' -> 'a AND b'
     """
-    def helper(match: re.Match):
-        return " ".join(match.groups())
-
-    return re_and.sub(helper, prompt)
+    return re_and.sub(" AND ", prompt)
 
 
 def align_colons(prompt: str):
@@ -162,16 +177,7 @@ def align_colons(prompt: str):
     def normalize(match: re.Match):
         return match.group(1)
 
-    # def composite(match: re.Match):
-    #     return " " + match.group(1)
-    #
-    # def composite_end(match: re.Match):
-    #     return " " + match.group(1)
-
     return re_colon_spacing.sub(normalize, prompt)
-    # ret = re_colon_spacing.sub(normalize, prompt)
-    # ret = re_colon_spacing_composite.sub(composite, ret)
-    # return re_colon_spacing_comp_end.sub(composite_end, ret)
 
 
 def align_commas(prompt: str, *, do_it: bool = True):
@@ -196,12 +202,191 @@ def align_commas(prompt: str, *, do_it: bool = True):
     return ", ".join(split)
 
 
-def extract_networks(tokens: list):
-    return list(filter(lambda token: re_networks.match(token), tokens))
+def partition_networks(
+    prompt: str,
+    *,
+    networks: NetworkEnum = NetworkEnum.END,
+    merge: MergeEnum = MergeEnum.NONE,
+    space_commas: bool = True,
+):
+    """Move networks such as <lora:name:1> to the end or front of a prompt.
+
+    The prompt is walked once, splitting it at commas outside of brackets
+    while setting aside, in order, the networks outside of brackets. Pieces
+    left empty are dropped with their comma. Pieces with AND keep their
+    networks, moving them could empty a composable section.
+
+    With merge, networks of the same kind and name are merged into the first
+    one, see merge_networks. NetworkEnum.KEEP only merges them.
+    """
+    pieces = collect_networks(prompt)
+    texts = [prompt[a + 1 : b - 1] for _, _, spans in pieces for a, b in spans]
+    if merge != MergeEnum.NONE:
+        texts = merge_networks(texts, merge)
+
+    texts = iter(texts)
+    moved = []
+    ret = []
+    for start, end, spans in pieces:
+        if not spans:
+            ret.append(prompt[start:end])
+            continue
+
+        found = [(span, next(texts)) for span in spans]
+        piece, lifted = lift_networks(prompt, (start, end), found, networks)
+        moved += lifted
+        if piece.strip():
+            ret.append(piece)
+
+    return place_networks(
+        ",".join(ret), moved, networks=networks, space_commas=space_commas
+    )
+
+
+def collect_networks(prompt: str):
+    """Pieces of prompt between top level commas, with their networks.
+
+    Return (start, end, spans) of every piece, spans being those of the
+    networks outside of brackets. Pieces with AND get no spans.
+    """
+    pieces = []
+    spans = []
+    depth = 0
+    start = 0
+    for match in re_networks.finditer(prompt):
+        opening, closing, comma, network = match.groups()
+        if opening:
+            depth += 1
+        elif closing:
+            depth = max(depth - 1, 0)
+        elif depth:
+            continue
+        elif comma:
+            pieces.append((start, match.start(), spans))
+            spans = []
+            start = match.end()
+        elif network is not None:
+            spans.append(match.span())
+    pieces.append((start, len(prompt), spans))
+
+    return [
+        (start, end, [] if "AND" in prompt[start:end] else spans)
+        for start, end, spans in pieces
+    ]
+
+
+def lift_networks(prompt: str, piece: tuple, found: list, networks: NetworkEnum):
+    """Take the networks found in prompt[start:end] of piece out of it.
+
+    found holds the span and text of every network, the text None for one
+    merged into another. With NetworkEnum.KEEP networks stay where they are,
+    rewritten to their text, and only those merged away are taken out.
+    Return the piece left and the networks taken, as (text, [network, ...]).
+    """
+    start, end = piece
+    ret = []
+    moved = []
+    last = start
+    for (a, b), network in found:
+        if network is not None and networks == NetworkEnum.KEEP:
+            ret += (prompt[last:a], f"<{network}>")
+            last = b
+            continue
+
+        if network is not None:
+            moved.append(f"<{network}>")
+        # Drop the spaces on one side of the network with it
+        before = prompt[last:a]
+        if before.endswith(" "):
+            ret.append(before.rstrip(" "))
+            last = b
+        else:
+            ret.append(before)
+            last = b + len(prompt[b:end]) - len(prompt[b:end].lstrip(" "))
+    ret.append(prompt[last:end])
+    return "".join(ret), moved
+
+
+def place_networks(
+    prompt: str, moved: list, *, networks: NetworkEnum, space_commas: bool
+):
+    """Put the networks moved at the end or front of what is left of prompt."""
+    if not moved:
+        return prompt
 
+    moved = " ".join(moved)
+    separator = ", " if space_commas else ","
+    if not prompt.strip():
+        return moved
+    if networks == NetworkEnum.FRONT:
+        return moved + separator + prompt.lstrip()
+    return prompt.rstrip() + separator + moved
 
-def remove_networks(tokens: list):
-    return list(filter(lambda token: not re_networks.match(token), tokens))
+
+def merge_networks(networks: list, merge: MergeEnum):
+    """Merge networks of the same kind and name into the first of them.
+
+    Weights are summed or the max is taken. A network without a weight counts
+    as 1, one with other arguments is only merged with the same network. The
+    networks merged into another one are None.
+    """
+    ret = list(networks)
+    firsts = {}
+    for i, network in enumerate(networks):
+        match = re_network_weight.fullmatch(network)
+        if match:
+            name, weight = match[1], float(match[2])
+        elif network.count(":") == 1:
+            name, weight = network, 1.0
+        else:
+            name, weight = network, None
+
+        if name not in firsts:
+            firsts[name] = (i, weight)
+            continue
+
+        j, total = firsts[name]
+        ret[i] = None
+        if weight is None:
+            continue
+        merged = total + weight if merge == MergeEnum.SUM else max(total, weight)
+        if merged != total:
+            firsts[name] = (j, merged)
+            ret[j] = f"{name}:{round(merged, 4):g}"
+    return ret
+
+
+def mismatched_brackets(prompt: str):
+    r"""Mark unmatched brackets in a single pass.
+
+    All four kinds of brackets are matched. A bracket escaped with a
+    backslash, e.g. '\(', is text and never matched.
+
+    Return a bytearray the length of the prompt, 1 where invalid.
+    """
+    invalid = bytearray(len(prompt))
+    unclosed = []
+
+    for match in re_brackets_escapable.finditer(prompt):
+        c = match.group()
+        if len(c) > 1:  # escaped
+            continue
+
+        i = match.start()
+        # A closing bracket only matches the immediate unclosed bracket
+        if (
+            c in brackets_closing
+            and unclosed
+            and prompt[unclosed[-1]] == get_bracket_opening(c)
+        ):
+            unclosed.pop()
+        else:
+            unclosed.append(i)
+
+    for i in unclosed:
+        invalid[i] = 1
+
+    return invalid
 
 
 def remove_mismatched_brackets(prompt: str):
@@ -211,42 +396,22 @@ def remove_mismatched_brackets(prompt: str):
     If it finds a nonmatching unclosed bracket, that bracket and this
     bracket are invalid.
     """
-    invalid_brackets = []
-    invalid_at = []
-
-    # Find invalid brackets
-    for i, c in enumerate(prompt):
-        if c in brackets_opening:
-            invalid_brackets.append(c)
-            invalid_at.append(i)
-
-        elif c in brackets_closing:
-            if not invalid_brackets:
-                invalid_brackets.append(c)
-                invalid_at.append(i)
-
-            # Look for the immediate unmatched opening bracket
-            if invalid_brackets[-1] == brackets_opening[brackets_closing.index(c)]:
-                invalid_brackets.pop()
-                invalid_at.pop()
-            else:
-                invalid_brackets.append(c)
-                invalid_at.append(i)
-
-    if not invalid_brackets:
+    invalid = mismatched_brackets(prompt)
+
+    p = invalid.find(1)
+    if p == -1:
         return prompt
 
     # Remove invalid brackets
-    ret = ""
+    ret = []
     last_p = 0
-    while invalid_brackets:
-        bracket = invalid_brackets.pop(0)
-        p = invalid_at.pop(0)
-        ret += prompt[last_p:p]
-        last_p = p+1
-    ret += prompt[last_p:]
+    while p != -1:
+        ret.append(prompt[last_p:p])
+        last_p = p + 1
+        p = invalid.find(1, last_p)
+    ret.append(prompt[last_p:])
 
-    return ret
+    return "".join(ret)
 
 
 def space_bracekts(prompt: str):
@@ -357,8 +522,13 @@ def bracket_to_weights(prompt: str, *, do_it:bool = True):
     if not do_it:
         return prompt
 
-    re_existing_weight = re.compile(r"(:\d+.?\d*)[)\]]$")
-    depths, gradients, brackets = get_mappings(prompt)
+    # Imported here, numpy is only needed by this reference conversion
+    from scripts.prompt_formatting_mapping import get_mappings  # noqa: PLC0415
+
+    def mappings(s: str):
+        return [m.tolist() for m in get_mappings(s)]
+
+    depths, gradients, brackets = mappings(prompt)
 
     pos = 0
     match = re_bracket_open.search(prompt, pos)
@@ -375,13 +545,8 @@ def bracket_to_weights(prompt: str, *, do_it:bool = True):
         if ret[pos] in "([":
             open_bracketing = re_brackets_open.match(ret, pos)
             consecutive = len(open_bracketing.group(0))
-            gradient_search = "".join(
-                map(
-                    str,
-                    reversed(
-                        range(int(depths[pos]) - 1, int(depths[pos]) + consecutive)
-                    ),
-                )
+            gradient_search = tuple(
+                reversed(range(depths[pos] - 1, depths[pos] + consecutive))
             )
             is_square_brackets = "[" in open_bracketing.group(0)
 
@@ -398,7 +563,7 @@ def bracket_to_weights(prompt: str, *, do_it:bool = True):
 
             if weight:
                 # If weight already exists, ignore
-                current_weight = re_existing_weight.search(ret[: insert_at + 1])
+                current_weight = re_existing_weight_end.search(ret[: insert_at + 1])
                 if current_weight:
                     ret = (
                         ret[: open_bracketing.start()]
@@ -417,7 +582,7 @@ def bracket_to_weights(prompt: str, *, do_it:bool = True):
                         + ret[insert_at + consecutive :]
                     )
 
-            depths, gradients, brackets = get_mappings(ret)
+            depths, gradients, brackets = mappings(ret)
             pos += 1
 
         match = re_bracket_open.search(ret, pos)
@@ -429,36 +594,263 @@ def bracket_to_weights(prompt: str, *, do_it:bool = True):
     return None
 
 
-def depth_to_map(s: str):
-    ret = ""
-    depth = 0
-    for c in s:
+def index_brackets(prompt: str):
+    """Index ( and [ bracket pairs in a single pass.
+
+    Brackets pair by depth regardless of their kind, the same way the depth
+    map counts them. Escaped brackets are text. Return a tuple containing:
+    - the position of every ( and [ that is not inside a network, in order
+    - a dict pairing each matched bracket position with its partner, both ways
+    - the set of opening positions directly enclosing a : or |
+    """
+    marks = [
+        (m.start(), m.group())
+        for m in re_bracket_marks.finditer(prompt)
+        if len(m.group()) == 1  # not escaped
+    ]
+    network = in_networks(marks)
+
+    openings = []
+    pairs = {}
+    separated = set()
+    stack = []
+    for i, c in marks:
         if c in "([":
-            depth += 1
-        if c in ")]":
-            depth -= 1
-        ret += str(depth)
+            stack.append(i)
+            if i not in network:
+                openings.append(i)
+        elif c in ")]":
+            if stack:
+                j = stack.pop()
+                pairs[i] = j
+                pairs[j] = i
+        elif c in ":|" and stack:
+            separated.add(stack[-1])
+
+    return openings, pairs, separated
+
+
+def in_networks(marks: list):
+    """Positions of the marks inside a network.
+
+    Same as the (?![^<]*>) lookahead, a mark is inside a network if a '>'
+    comes after it before any '<'.
+    """
+    ret = set()
+    inside = False
+    for i, c in reversed(marks):
+        if c == ">":
+            inside = True
+        elif c == "<":
+            inside = False
+        elif inside:
+            ret.add(i)
     return ret
 
 
-def depth_to_gradeint(s: str):
-    ret = ""
-    for c in s:
-        if c in "([":
-            ret += "^"
-        elif c in ")]":
-            ret += "v"
+def bracket_to_weights_indexed(prompt: str, *, do_it: bool = True):
+    """Convert excessive brackets to weight from a bracket pair index.
+
+    Gives the same result as bracket_to_weights, see there for the rules, but
+    finds every bracket pair in one pass, decides each conversion from that
+    index and applies all of them in one final splice.
+
+    A run of consecutive opening brackets of the same kind merges with as many
+    of its outermost brackets as close on consecutive characters, mirroring
+    it. Square brackets that directly hold a : or | are prompt editing or
+    alternation and are never merged. Brackets left out of a run are looked
+    at again as a run of their own.
+
+    Where bracket_to_weights raises on a run that only partly mirrors, or
+    drops characters following it, this converts the mirrored part.
+    """
+    if not do_it:
+        return prompt
+
+    return splice(prompt, weight_replacements(prompt))
+
+
+def weight_replacements(prompt: str):
+    """Map each position bracket_to_weights_indexed rewrites to its new text.
+
+    Every merged run of brackets has exactly one entry ending in ')', the
+    innermost closing bracket that takes the weight.
+    """
+    openings, pairs, separated = index_brackets(prompt)
+    is_opening = set(openings)
+    replace = {}
+    i = 0
+    while i < len(openings):
+        start = openings[i]
+        bracket = prompt[start]
+        is_square_brackets = bracket == "["
+
+        merged = 0
+        closing = pairs.get(start)
+        pos = start
+        while (
+            closing is not None
+            and pos in is_opening
+            and prompt[pos] == bracket
+            and pairs.get(pos) == closing
+            and not (is_square_brackets and pos in separated)
+        ):
+            merged += 1
+            pos += 1
+            closing -= 1
+
+        if not merged:
+            i += 1
+            continue
+
+        # closing now sits just before the innermost merged closing bracket
+        insert_at = closing + 1
+        replace[start] = "("
+        for p in range(start + 1, pos):
+            replace[p] = ""
+        for p in range(insert_at + 1, pairs[start] + 1):
+            replace[p] = ""
+        if re_existing_weight_before.match(prompt, insert_at):
+            replace[insert_at] = ")"
         else:
-            ret += "-"
-    return ret
+            weight = calculate_weight(merged, is_square_brackets=is_square_brackets)
+            replace[insert_at] = f":{weight:.2f})"
+
+        i += merged
 
+    return replace
 
-def filter_brackets(s: str):
-    return "".join(list(map(lambda c: c if c in "[]()" else " ", s)))
 
+def splice(prompt: str, replace: dict):
+    """Replace the character at every position of replace with its text."""
+    ret = []
+    last = 0
+    for p in sorted(replace):
+        ret.append(prompt[last:p])
+        ret.append(replace[p])
+        last = p + 1
+    ret.append(prompt[last:])
+    return "".join(ret)
 
-def get_mappings(s: str):
-    return depth_to_map(s), depth_to_gradeint(s), filter_brackets(s)
+
+def fold_weights(prompt: str, *, split: bool = False, precision: int = 2):
+    """Multiply weights through nested groups in one walk of the bracket tree.
+
+    A group holding nothing but another group merges with it, taking the
+    product of their weights, e.g. ((a:0.91):0.91) -> (a:0.83) and
+    ((a)) -> (a:1.21). A group holding anything else keeps its own weight,
+    which webui multiplies with the weights inside it. Prompt editing,
+    alternation, wildcards and networks are never merged. Merged weights are
+    rounded to precision digits, and lose their brackets if that gives 1.
+
+    With split, a weighted group of several comma separated tags becomes a
+    group per tag, e.g. (a, (b:1.2):1.1) -> (a:1.10), (b:1.32).
+    """
+    folder = WeightFolder(prompt, split=split, precision=precision)
+    return folder.content(0, len(prompt))
+
+
+class WeightFolder:
+    """Walk of the bracket tree of one prompt for fold_weights."""
+
+    def __init__(self, prompt: str, *, split: bool, precision: int):
+        self.prompt = prompt
+        self.pairs = nodes.pair_brackets(prompt)
+        self.openings = self.pairs.openings
+        self.split = split
+        self.precision = precision
+
+    def factor(self, start: int):
+        """Weight and inner span of the group at start, None if not a weight."""
+        prompt, pairs = self.prompt, self.pairs
+        end = pairs[start]
+        if prompt[start] == "(":
+            parts = nodes.split(prompt, start + 1, end, pairs, ":")
+            a, b = parts[-1]
+            if len(parts) > 1 and nodes.re_weight.fullmatch(prompt, a, b):
+                return float(prompt[a:b]), start + 1, a - 1
+            return 1.1, start + 1, end
+        if (
+            prompt[start] == "["
+            and len(nodes.split(prompt, start + 1, end, pairs, ":")) == 1
+            and len(nodes.split(prompt, start + 1, end, pairs, "|")) == 1
+        ):
+            return 1 / 1.1, start + 1, end
+        return None
+
+    def only_group(self, a: int, b: int):
+        """Find the weighted group that is all of prompt[a:b] but whitespace."""
+        prompt = self.prompt
+        while a < b and prompt[a].isspace():
+            a += 1
+        while a < b and prompt[b - 1].isspace():
+            b -= 1
+        if a in self.pairs and self.pairs[a] == b - 1 and self.factor(a) is not None:
+            return a
+        return None
+
+    def weighted(self, text: str, weight: float):
+        weight = round(weight, self.precision)
+        if weight == 1:
+            return text
+        return f"({text}:{weight:.{self.precision}f})"
+
+    def content(self, a: int, b: int):
+        """Text of prompt[a:b], every group in it folded."""
+        prompt, pairs, openings = self.prompt, self.pairs, self.openings
+        ret = []
+        last = a
+        k = bisect_left(openings, a)
+        while k < len(openings) and openings[k] < b:
+            i = openings[k]
+            ret += (prompt[last:i], self.group(i))
+            last = pairs[i] + 1
+            k = bisect_left(openings, last, k)
+        ret.append(prompt[last:b])
+        return "".join(ret)
+
+    def group(self, start: int, outer: float = 1):
+        """Text of the group at start, its weight multiplied by outer."""
+        prompt = self.prompt
+        end = self.pairs[start]
+        found = self.factor(start)
+        if found is None:
+            return prompt[start] + self.content(start + 1, end) + prompt[end]
+
+        # Merge every group holding only another one in a loop, they can nest
+        # deeper than the recursion limit
+        weight, a, b = found
+        while (inner := self.only_group(a, b)) is not None:
+            outer *= weight
+            start, end = inner, self.pairs[inner]
+            weight, a, b = self.factor(inner)
+        if self.split:
+            spans = nodes.split(prompt, a, b, self.pairs, ",")
+            if len(spans) > 1:
+                return self.split_group(spans, outer * weight)
+        if outer == 1:
+            return prompt[start:a] + self.content(a, b) + prompt[b : end + 1]
+        return self.weighted(self.content(a, b), outer * weight)
+
+    def split_group(self, spans: list, weight: float):
+        """Text of the tags at spans of a group, each weighted on its own."""
+        return ",".join(self.item(a, b, weight) for a, b in spans)
+
+    def item(self, a: int, b: int, weight: float):
+        """Text of a tag split out of a group of the given weight."""
+        prompt = self.prompt
+        stripped = prompt[a:b].strip()
+        if not stripped or re_only_networks.fullmatch(stripped):
+            return prompt[a:b]
+
+        start = a + len(prompt[a:b]) - len(prompt[a:b].lstrip())
+        end = start + len(stripped)
+        inner = self.only_group(start, end)
+        if inner is not None:
+            text = self.group(inner, weight)
+        else:
+            text = self.weighted(self.content(start, end), weight)
+        return prompt[a:start] + text + prompt[end:b]
 
 
 def calculate_weight(d: str, *, is_square_brackets: bool):
@@ -478,16 +870,75 @@ def space_to_underscore(prompt: str, mode: UnderSpaceEnum = UnderSpaceEnum.SPACE
     if mode == UnderSpaceEnum.IGNORE:
       return prompt
 
+    if mode == UnderSpaceEnum.TAGS:
+       return tags.to_tags(prompt)
+
     if mode == UnderSpaceEnum.SPACE:
-       match = r"(?<!BREAK)(?<=\w)_+(?=\w)(?!BREAK)(?![^<]*>)"
+       match = re_underscore_to_space
        replace = " "
 
     elif mode == UnderSpaceEnum.UNDERSCORE:
-       match = r"(?<!BREAK)(?<=\w) +(?=\w)(?!BREAK)(?![^<]*>)"
+       match = re_space_to_underscore
        replace = "_"
 
     tokens: str = tokenize(prompt)
 
-    return ",".join(map(lambda t: re.sub(match, replace, t), tokens))
+    return ",".join(outside_networks(match, replace, t) for t in tokens)
+
+
+def outside_networks(pattern, replace: str, text: str):
+    """Substitute pattern in text except before a '>' that comes before any '<'.
+
+    Same as adding (?![^<]*>) to pattern, in one pass rather than a scan
+    ahead from every match. Text is split right after the last '>' of every
+    stretch without '<', and the cuts are at characters no match spans.
+    """
+    ret = []
+    for part in text.split("<"):
+        end = part.rfind(">") + 1
+        ret.append(part[:end] + pattern.sub(replace, part[end:]))
+    return "<".join(ret)
 
 
+def format_prompt(  # noqa: PLR0913
+    prompt: str,
+    *,
+    space_commas: bool = True,
+    bracket2weight: bool = True,
+    prefer_spacing: UnderSpaceEnum = UnderSpaceEnum.SPACE,
+    networks: NetworkEnum = NetworkEnum.KEEP,
+    merge_networks: MergeEnum = MergeEnum.NONE,
+    flatten_weights: bool = False,
+    split_weights: bool = False,
+    weight_precision: int = 2,
+    pack_chunks: bool = False,
+):
+    """Run a prompt through every stage of the pipeline in order.
+
+    This is the reference the formatting engine is checked against.
+    """
+    prompt = normalize_characters(prompt)
+    prompt = remove_mismatched_brackets(prompt)
+
+    # Clean up whitespace for cool beans
+    prompt = remove_whitespace_excessive(prompt)
+
+    # Replace Spaces and/or underscores, unless disabled
+    prompt = space_to_underscore(prompt, mode=prefer_spacing)
+    prompt = align_brackets(prompt)
+    prompt = space_and(prompt)  # for proper compositing alignment on colon
+    prompt = space_bracekts(prompt)
+    prompt = align_colons(prompt)
+    prompt = align_commas(prompt, do_it=space_commas)
+    prompt = align_alternating(prompt)
+    prompt = bracket_to_weights(prompt, do_it=bracket2weight)
+    if flatten_weights or split_weights:
+        prompt = fold_weights(prompt, split=split_weights, precision=weight_precision)
+    if networks != NetworkEnum.KEEP or merge_networks != MergeEnum.NONE:
+        prompt = partition_networks(
+            prompt, networks=networks, merge=merge_networks, space_commas=space_commas
+        )
+    if pack_chunks:
+        prompt = tokens.pack(prompt, space_commas=space_commas)
+
+    return prompt.strip()
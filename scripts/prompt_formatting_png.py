@@ -0,0 +1,389 @@
+"""Format the prompts webui saved in the parameters of PNG images.
+
+Every PNG is memory mapped and its chunks walked by their headers, so pixel
+data is skipped without being read or decoded. The parameters tEXt, iTXt or
+zTXt chunk holds the infotext, whose prompt and negative prompt are
+formatted. Results go to an index, JSONL or SQLite by its suffix, with one
+record per image, the latest, and with --in-place the chunk is rewritten as
+well. The rest of the file is copied byte for byte and its modification time
+kept.
+
+With --resume, images already in the index are skipped, so an interrupted
+run picks up where it stopped.
+
+e.g.
+python -m scripts.prompt_formatting_png outputs/ --index prompts.jsonl --workers 8
+python -m scripts.prompt_formatting_png outputs/ --index prompts.db --in-place --resume
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack
+from functools import partial
+from pathlib import Path
+from typing import NamedTuple
+
+from scripts import prompt_formatting_cli as cli
+from scripts import prompt_formatting_patterns as patterns
+from scripts.prompt_formatting_batch import map_chunks
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_formatter import get_formatter
+
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+KEY = b"parameters"
+TEXT_CHUNKS = (b"tEXt", b"iTXt", b"zTXt")
+NEGATIVE = "Negative prompt:"
+# Pairs the last line needs to be parameters rather than prompt, as in webui
+MIN_PARAMETERS = 3
+
+# A name: value pair of the last line of an infotext, as webui parses it
+re_param = patterns.compile(r'\s*(\w[\w \-/]+):\s*("(?:\\.|[^\\"])+"|[^,]*)(?:,|$)')
+
+
+class TextChunk(NamedTuple):
+    start: int  # offset of the chunk's length field
+    end: int  # offset past its CRC
+    text: str
+
+
+class Infotext(NamedTuple):
+    prompt: str
+    negative_prompt: str
+    parameters: str  # the 'Steps: 20, Sampler: ...' line, empty if none
+
+    @classmethod
+    def parse(cls, text: str):
+        """Split an infotext as webui's parse_generation_parameters does."""
+        *lines, last = text.strip().split("\n")
+        if len(re_param.findall(last)) < MIN_PARAMETERS:
+            lines.append(last)
+            last = ""
+
+        prompt, negative = [], []
+        for line in map(str.strip, lines):
+            if line.startswith(NEGATIVE):
+                negative.append(line[len(NEGATIVE) :].strip())
+            elif negative:
+                negative.append(line)
+            else:
+                prompt.append(line)
+        return cls("\n".join(prompt), "\n".join(negative), last)
+
+    def to_text(self):
+        ret = [self.prompt]
+        if self.negative_prompt:
+            ret.append(f"{NEGATIVE} {self.negative_prompt}")
+        if self.parameters:
+            ret.append(self.parameters)
+        return "\n".join(ret)
+
+
+def decode(kind: bytes, data: bytes):
+    """Text of a text chunk's data, after its keyword and null."""
+    if kind == b"tEXt":
+        return data.decode("latin-1")
+    if kind == b"zTXt":
+        return zlib.decompress(data[1:]).decode("latin-1")
+
+    compressed = data[0]
+    # Skip the method, then the language tag and translated keyword
+    rest = data[2:].split(b"\0", 2)[2]
+    return (zlib.decompress(rest) if compressed else rest).decode("utf-8")
+
+
+def encode(text: str):
+    """Parameters chunk of text, tEXt if it is latin-1, else iTXt."""
+    try:
+        kind, data = b"tEXt", KEY + b"\0" + text.encode("latin-1")
+    except UnicodeEncodeError:
+        kind, data = b"iTXt", KEY + b"\0\0\0\0\0" + text.encode("utf-8")
+    crc = zlib.crc32(kind + data)
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def find_parameters(buffer) -> TextChunk | None:
+    """Return the parameters chunk of a PNG's bytes, or None if it has none."""
+    if buffer[: len(SIGNATURE)] != SIGNATURE:
+        msg = "Not a PNG"
+        raise ValueError(msg)
+
+    pos = len(SIGNATURE)
+    prefix = KEY + b"\0"
+    while pos + 8 <= len(buffer):
+        length, kind = struct.unpack_from(">I4s", buffer, pos)
+        start = pos + 8
+        end = start + length + 4
+        if kind in TEXT_CHUNKS and buffer[start : start + len(prefix)] == prefix:
+            data = buffer[start + len(prefix) : start + length]
+            return TextChunk(pos, end, decode(kind, data))
+        if kind == b"IEND":
+            break
+        pos = end
+    return None
+
+
+def rewrite(path: Path, buffer, chunk: TextChunk, text: str):
+    """Copy of path with text in place of chunk, next to it. Return its path."""
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with temporary.open("wb") as f:
+            f.write(buffer[: chunk.start])
+            f.write(encode(text))
+            f.write(buffer[chunk.end :])
+    except OSError:
+        temporary.unlink(missing_ok=True)
+        raise
+    return temporary
+
+
+def format_file(path: str, options: FormatOptions, *, in_place: bool = False):
+    """Record of the image at path, or None if it cannot be read."""
+    formatter = get_formatter(options)
+    record = {"path": path, "prompt": None, "negative_prompt": None, "changed": False}
+    file = Path(path)
+    try:
+        stat = file.stat()
+        if not stat.st_size:
+            return None
+
+        temporary = None
+        with file.open("rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as buffer:
+            chunk = find_parameters(buffer)
+            if chunk is None:
+                return record
+
+            infotext = Infotext.parse(chunk.text)
+            formatted = infotext._replace(
+                prompt=formatter.format(infotext.prompt),
+                negative_prompt=formatter.format(infotext.negative_prompt),
+            )
+            record["prompt"] = formatted.prompt
+            record["negative_prompt"] = formatted.negative_prompt
+            record["changed"] = formatted != infotext
+            if in_place and record["changed"]:
+                temporary = rewrite(file, buffer, chunk, formatted.to_text())
+
+        if temporary is not None:
+            temporary.replace(file)
+            os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    except (OSError, ValueError, struct.error, zlib.error) as e:
+        logger.warning("Could not read %s: %s", path, e)
+        return None
+    return record
+
+
+def format_files(paths: list, options: FormatOptions, *, in_place: bool = False):
+    records = (format_file(path, options, in_place=in_place) for path in paths)
+    return [record for record in records if record is not None]
+
+
+def find_images(roots: Iterable) -> Iterator[str]:
+    """Paths of every PNG under roots, lazily, in directory order."""
+    for root in roots:
+        if Path(root).is_file():
+            yield root
+            continue
+
+        stack = [root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(".png"):
+                        yield entry.path
+
+
+class JsonlIndex:
+    """Records as lines of a JSONL file, appended to.
+
+    Like SqliteIndex, the index keeps the latest record of a path. A record
+    of a path already in the file is appended, and the file compacted to the
+    last record of every path when closed.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.paths = None
+        self.replaced = False
+        self.files = ExitStack()
+        self.file = None
+
+    def load(self):
+        """Read the paths in the index, once.
+
+        A last line cut short by an interruption is removed, to be done again.
+        """
+        if self.paths is not None:
+            return
+        self.paths = set()
+        if not self.path.exists():
+            return
+
+        complete = 0
+        with self.path.open("r+b") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self.paths.add(json.loads(line)["path"])
+                complete += len(line)
+            f.truncate(complete)
+
+    def done(self):
+        """Paths already in the index."""
+        self.load()
+        return set(self.paths)
+
+    def add(self, record: dict):
+        self.load()
+        if record["path"] in self.paths:
+            self.replaced = True
+        self.paths.add(record["path"])
+        if self.file is None:
+            self.file = self.files.enter_context(self.path.open("a", encoding="utf-8"))
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def compact(self):
+        """Rewrite the file with the last line of every path, in first order."""
+        lines = {}
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                lines[json.loads(line)["path"]] = line
+
+        temporary = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with temporary.open("w", encoding="utf-8") as f:
+                f.writelines(lines.values())
+        except OSError:
+            temporary.unlink(missing_ok=True)
+            raise
+        temporary.replace(self.path)
+
+    def close(self):
+        self.files.close()
+        if self.replaced:
+            self.compact()
+
+
+class SqliteIndex:
+    """Records as rows of a SQLite table, committed every COMMIT_EVERY."""
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, "
+            "prompt TEXT, negative_prompt TEXT, changed INTEGER)"
+        )
+        self.pending = 0
+
+    def done(self):
+        return {path for (path,) in self.connection.execute("SELECT path FROM images")}
+
+    def add(self, record: dict):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+            (
+                record["path"],
+                record["prompt"],
+                record["negative_prompt"],
+                record["changed"],
+            ),
+        )
+        self.pending += 1
+        if self.pending >= self.COMMIT_EVERY:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def open_index(path: str):
+    if Path(path).suffix.lower() in (".db", ".sqlite", ".sqlite3"):
+        return SqliteIndex(path)
+    return JsonlIndex(path)
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.prompt_formatting_png",
+        description="Format the prompts saved in the parameters of PNG images.",
+    )
+    parser.add_argument("paths", nargs="+", help="images or folders of images")
+    parser.add_argument(
+        "--index", help="JSONL file, or SQLite with a .db suffix, of every image"
+    )
+    parser.add_argument(
+        "--in-place", action="store_true", help="rewrite the parameters of images"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="skip images already in the index"
+    )
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    cli.add_options(parser)
+    parser.add_argument("-q", "--quiet", action="store_true", help="no summary")
+    args = parser.parse_args(argv)
+    if not args.index and not args.in_place:
+        parser.error("nothing to do without --index or --in-place")
+    if args.resume and not args.index:
+        parser.error("--resume needs an --index")
+    return args
+
+
+def main(argv: list | None = None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    options = cli.options(args)
+    index = open_index(args.index) if args.index else None
+    start = time.perf_counter()
+    images = changed = 0
+
+    try:
+        paths = find_images(args.paths)
+        if args.resume:
+            done = {Path(path).resolve() for path in index.done()}
+            paths = (path for path in paths if Path(path).resolve() not in done)
+
+        for record in map_chunks(
+            partial(format_files, in_place=args.in_place),
+            paths,
+            options,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+        ):
+            images += 1
+            changed += record["changed"]
+            if index is not None:
+                index.add(record)
+    finally:
+        if index is not None:
+            index.close()
+
+    if not args.quiet:
+        seconds = max(time.perf_counter() - start, 1e-9)
+        print(
+            f"read {images} images, {changed} with prompts to format, "
+            f"in {seconds:.2f} s: {images / seconds:.0f} images/s",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+r"""Format a prompt one BREAK or line at a time.
+
+A prompt is cut at every top level BREAK and new line, with the spaces and
+commas around them, into segments. Every segment is formatted on its own and
+the separators are put back exactly as they were written, so line breaks and
+BREAK survive formatting. Only separators outside of any bracket cut, so a
+weight or network spanning lines stays whole.
+
+Formatted segments are cached on their own, so an edit formats only the
+segment it is in, whatever the length of the prompt. Segments missing from
+the cache can be formatted on a pool of processes for very long prompts.
+With a time budget, the segments formatted together share it, and segments
+it runs out on are kept as they are and not cached.
+
+e.g.
+SegmentedFormatter().format("((a)),b ,\nBREAK\n c_d")
+# '(a:1.21), b ,\nBREAK\n c d'
+"""
+
+import regex as re
+
+from scripts import prompt_formatting_batch as batch
+from scripts import prompt_formatting_patterns as patterns
+from scripts import prompt_formatting_tags as tags
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_cache import PromptCache
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_formatter import get_formatter
+
+
+# Segments formatted at once before a pool is worth its overhead
+PARALLEL_SEGMENTS = 8
+
+# A separator starts at the start of a run of spaces and commas, so a long
+# run is not scanned again from every position in it
+re_segment_marks = patterns.compile(
+    r"\\.|[()\[\]{}<>]"
+    r"|((?<![\s,])(?:[^\S\r\n]|,)*+(?:[\r\n]|\bBREAK\b)(?:[\s,]++|\bBREAK\b)*)",
+    re.DOTALL,
+)
+
+
+def split(prompt: str):
+    """Segments of a prompt and the separators between them.
+
+    Return (segments, separators), with one more segment than separators.
+    Unmatched closing brackets are ignored and an unmatched opening bracket
+    keeps the rest of the prompt in one segment.
+    """
+    segments = []
+    separators = []
+    depth = 0
+    last = 0
+    for match in re_segment_marks.finditer(prompt):
+        mark = match.group()
+        if match.group(1) is not None:
+            if not depth:
+                segments.append(prompt[last : match.start()])
+                separators.append(mark)
+                last = match.end()
+        elif mark[0] in "([{<":
+            depth += 1
+        elif mark[0] in ")]}>":
+            depth = max(depth - 1, 0)
+
+    segments.append(prompt[last:])
+    return segments, separators
+
+
+def join(segments: list, separators: list):
+    ret = [segments[0]]
+    for separator, segment in zip(separators, segments[1:]):
+        ret += [separator, segment]
+    return "".join(ret)
+
+
+class SegmentedFormatter:
+    """Format every segment of a prompt on its own, see the module docstring.
+
+    With workers, segments missing from the cache are formatted on a pool of
+    that many processes once there are PARALLEL_SEGMENTS of them. The pool is
+    started on first use and kept until close. With a budget in seconds, the
+    missing segments are formatted within it, every process having all of
+    it for its share.
+    """
+
+    def __init__(
+        self,
+        options: FormatOptions = FormatOptions(),
+        *,
+        cache: PromptCache = None,
+        workers: int = 0,
+        budget: float = 0,
+    ):
+        self.formatter = get_formatter(options)
+        self.cache = PromptCache() if cache is None else cache
+        self.workers = workers
+        self.budget = budget
+        self.executor = None
+
+    @property
+    def options(self):
+        return self.formatter.options
+
+    def format(self, prompt: str):
+        segments, separators = split(prompt)
+        return join(self.format_segments(segments), separators).strip()
+
+    def format_many(self, prompts):
+        return [self.format(prompt) for prompt in prompts]
+
+    def format_segments(self, segments: list):
+        """Every segment formatted, from the cache where possible."""
+        options = self.options
+        ret = [self.cache.get((segment, options)) for segment in segments]
+        missing = list(
+            {segment: None for segment, r in zip(segments, ret) if r is None}
+        )
+        if not missing:
+            return ret
+
+        formatted = {}
+        for segment, (output, failed) in zip(missing, self.format_missing(missing)):
+            formatted[segment] = output
+            if not failed:
+                self.cache.put((segment, options), output)
+        return [formatted[s] if r is None else r for s, r in zip(segments, ret)]
+
+    def format_missing(self, segments: list):
+        """Outcome of every segment, see batch.format_chunk_within."""
+        if self.workers <= 1 or len(segments) < PARALLEL_SEGMENTS:
+            return batch.format_chunk_within(segments, self.options, self.budget)
+
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor  # noqa: PLC0415
+
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=batch.configure,
+                initargs=(tags.path, tokens.path),
+            )
+        size = -(-len(segments) // self.workers)
+        chunks = [segments[i : i + size] for i in range(0, len(segments), size)]
+        futures = [
+            self.executor.submit(
+                batch.format_chunk_within, chunk, self.options, self.budget
+            )
+            for chunk in chunks
+        ]
+        return [output for future in futures for output in future.result()]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,276 @@
+"""Settings of the extension, and the formatting they configure.
+
+Settings are read from any object holding them as attributes, such as
+webui's shared.opts, a setting it does not hold taking its default, so
+nothing here imports webui. The web UI script adds every Setting to the
+settings page and formats through a Session, the HTTP API reads the same
+settings with format_options.
+
+e.g.
+session = Session()
+session.sync(shared.opts)  # after every change of the settings
+session.format("((a)),b")
+"""
+
+import os
+from typing import NamedTuple
+
+from scripts import prompt_formatting_stats as stats
+from scripts import prompt_formatting_tags as tags
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_cache import PromptCache
+from scripts.prompt_formatting_definitions import FormatOptions, MergeEnum, NetworkEnum
+from scripts.prompt_formatting_formatter import PromptFormatter
+from scripts.prompt_formatting_segments import SegmentedFormatter
+
+
+MB = 1024 * 1024
+
+
+class Setting(NamedTuple):
+    key: str
+    default: object
+    label: str
+    component: str  # name of the gradio component, e.g. "Checkbox"
+    args: dict
+
+
+INTERACTIVE = {"interactive": True}
+
+# In the order of the settings page
+SETTINGS = [
+    Setting(
+        "pformat_space_commas",
+        True,
+        "Add a spaces after comma",
+        "Checkbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pfromat_bracket2weight",
+        True,
+        "Convert excessive brackets to weights",
+        "Checkbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_segments",
+        False,
+        "Format every line and BREAK on its own, keeping new lines as written",
+        "Checkbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_segment_workers",
+        0,
+        "Processes formatting the lines and BREAKs of a long prompt at once "
+        "(0 to format them one after another)",
+        "Slider",
+        {"minimum": 0, "maximum": os.cpu_count() or 1, "step": 1},
+    ),
+    Setting(
+        "pformat_flatten_weights",
+        False,
+        "Merge nested weights into one, e.g. ((a:0.91):0.91) to (a:0.83)",
+        "Checkbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_split_weights",
+        False,
+        "Split weighted groups into one per tag, "
+        "e.g. (a, b:1.2) to (a:1.20), (b:1.20)",
+        "Checkbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_weight_precision",
+        2,
+        "Digits of merged and split weights",
+        "Slider",
+        {"minimum": 1, "maximum": 4, "step": 1},
+    ),
+    Setting(
+        "pformat_preferspacing",
+        "Space",
+        "Preference in formatter to use spaces or underscore or ignore.",
+        "Radio",
+        {"choices": ["Space", "Underscore", "Ignore", "Tags"]},
+    ),
+    Setting(
+        "pformat_networks",
+        "Keep",
+        "Move networks such as <lora:...> to the end or front of the prompt",
+        "Radio",
+        {"choices": [e.value for e in NetworkEnum]},
+    ),
+    Setting(
+        "pformat_merge_networks",
+        "None",
+        "Merge networks of the same name "
+        "by summing or taking the max of their weights",
+        "Radio",
+        {"choices": [e.value for e in MergeEnum]},
+    ),
+    Setting(
+        "pformat_pack_chunks",
+        False,
+        "Drop repeated tags and reorder tags "
+        "so the prompt takes fewer 75 token chunks",
+        "Checkbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_clip_merges",
+        "",
+        "CLIP merges file to count tokens with (empty to look for open_clip's)",
+        "Textbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_tags_file",
+        "",
+        "Tag list for the Tags preference, "
+        "a CSV such as danbooru.csv or one tag per line",
+        "Textbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_time_budget_ms",
+        500,
+        "Time a prompt may take to format in ms, "
+        "kept as far as it got past that or on an error (0 for no limit)",
+        "Slider",
+        {"minimum": 0, "maximum": 5000, "step": 50},
+    ),
+    Setting(
+        "pformat_cache_mb",
+        4,
+        "Memory for remembering formatted prompts in MB (0 to disable)",
+        "Slider",
+        {"minimum": 0, "maximum": 256, "step": 1},
+    ),
+    Setting(
+        "pformat_stats",
+        False,
+        "Record timings of every formatting stage, logged after each format",
+        "Checkbox",
+        INTERACTIVE,
+    ),
+    Setting(
+        "pformat_stats_file",
+        "",
+        "Also write the recorded timings to this JSON file (empty to only log)",
+        "Textbox",
+        INTERACTIVE,
+    ),
+]
+defaults = {setting.key: setting.default for setting in SETTINGS}
+
+# Setting of every field of FormatOptions
+OPTION_KEYS = {
+    "space_commas": "pformat_space_commas",
+    "bracket2weight": "pfromat_bracket2weight",
+    "prefer_spacing": "pformat_preferspacing",
+    "networks": "pformat_networks",
+    "merge_networks": "pformat_merge_networks",
+    "flatten_weights": "pformat_flatten_weights",
+    "split_weights": "pformat_split_weights",
+    "weight_precision": "pformat_weight_precision",
+    "pack_chunks": "pformat_pack_chunks",
+}
+# Setting of every file that is configured, and the function configuring it
+FILE_KEYS = {
+    "pformat_tags_file": tags.configure,
+    "pformat_clip_merges": tokens.configure,
+}
+
+
+def value(opts, key: str):
+    """Value of the setting key in opts, its default if opts does not hold it."""
+    return getattr(opts, key, defaults[key])
+
+
+def format_options(opts):
+    """FormatOptions of the settings in opts.
+
+    Every value is converted to the type of the field, e.g. the name of a
+    radio choice to its enum.
+    """
+    fields = FormatOptions()._asdict()
+    return FormatOptions(
+        **{
+            field: type(fields[field])(value(opts, key))
+            for field, key in OPTION_KEYS.items()
+        }
+    )
+
+
+def configure_files(opts):
+    """Use the tag list and merges file of opts."""
+    for key, configure in FILE_KEYS.items():
+        configure(value(opts, key))
+
+
+class Session:
+    """Formatter, segmenter and cache of the web UI, following its settings."""
+
+    def __init__(self):
+        self.cache = PromptCache(defaults["pformat_cache_mb"] * MB)
+        self.formatter = PromptFormatter(FormatOptions())
+        self.budget = defaults["pformat_time_budget_ms"] / 1000
+        self.segmenter = SegmentedFormatter(
+            self.formatter.options,
+            cache=self.cache,
+            workers=defaults["pformat_segment_workers"],
+            budget=self.budget,
+        )
+        self.files = None  # of FILE_KEYS, configured by the last sync
+        self.segments = defaults["pformat_segments"]
+        self.stats_file = defaults["pformat_stats_file"]
+
+    def sync(self, opts):
+        """Follow the settings in opts, rebuilding only what they change."""
+        options = format_options(opts)
+        if options != self.formatter.options:
+            self.formatter = PromptFormatter(options)
+        workers = int(value(opts, "pformat_segment_workers"))
+        if options != self.segmenter.options or workers != self.segmenter.workers:
+            self.segmenter.close()
+            self.segmenter = SegmentedFormatter(
+                options, cache=self.cache, workers=workers
+            )
+        files = [value(opts, key) for key in FILE_KEYS]
+        if files != self.files:
+            # Prompts formatted with other tags or tokens are stale
+            configure_files(opts)
+            self.files = files
+            self.cache.clear()
+
+        self.segments = value(opts, "pformat_segments")
+        self.budget = value(opts, "pformat_time_budget_ms") / 1000
+        self.segmenter.budget = self.budget
+        self.cache.resize(int(value(opts, "pformat_cache_mb") * MB))
+        self.stats_file = value(opts, "pformat_stats_file")
+        if value(opts, "pformat_stats"):
+            stats.enable()
+        else:
+            stats.disable()
+
+    def format(self, prompt: str):
+        """Format prompt within the time budget, through the cache."""
+        if self.segments:
+            fn, args = self.segmenter.format, (prompt,)
+        else:
+            fn, args = self.cache.format_with, (prompt, self.formatter, self.budget)
+
+        if stats.recorder is not None:
+            return stats.recorder.stage("format_prompt", fn, *args)
+        return fn(*args)
+
+    def report(self):
+        """Log the timings recorded so far, and write them to the stats file."""
+        if stats.recorder is not None:
+            stats.recorder.log()
+            if self.stats_file:
+                stats.recorder.dump(self.stats_file)
@@ -0,0 +1,170 @@
+"""Optional per-stage timings and counters of the formatter.
+
+Nothing is recorded until enable() is called. While disabled, recorder is
+None and the formatter only pays for checking that.
+
+e.g.
+stats.enable()
+engine.format_prompt(prompt)
+stats.recorder.dump("pformat_stats.json")
+"""
+
+import json
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in seconds, 1 2 5 steps from 1 us to
+# 10 s, anything slower falls in a last overflow bucket
+BOUNDS = [float(f"{m}e{e}") for e in range(-6, 1) for m in (1, 2, 5)] + [10.0]
+
+
+class Histogram:
+    """Count of values per bucket of BOUNDS, with their count, sum and range."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        self.buckets[bisect_left(BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float):
+        """Upper bound of the bucket holding the q-th percentile, 0 <= q <= 100.
+
+        The overflow bucket reports the largest value seen.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return BOUNDS[i] if i < len(BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.mean,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "buckets": {
+                (f"<={bound:g}" if i < len(BOUNDS) else f">{BOUNDS[-1]:g}"): n
+                for i, (bound, n) in enumerate(zip([*BOUNDS, None], self.buckets))
+                if n
+            },
+        }
+
+
+class Stage:
+    def __init__(self):
+        self.seconds = Histogram()
+        self.length_in = 0
+        self.length_out = 0
+
+    def to_dict(self):
+        return {
+            "seconds": self.seconds.to_dict(),
+            "length_in": self.length_in,
+            "length_out": self.length_out,
+        }
+
+
+class Recorder:
+    """Wall time, input and output length of every stage, and counters.
+
+    Lengths are characters for strings, tokens for token lists and
+    positions for the rewrites of weight_replacements.
+    """
+
+    def __init__(self):
+        self.stages = defaultdict(Stage)
+        self.counters = defaultdict(int)
+
+    def stage(self, name: str, fn, value, *args, **kwargs):
+        """Return fn(value, *args, **kwargs), recording it as stage name."""
+        start = time.perf_counter()
+        ret = fn(value, *args, **kwargs)
+        seconds = time.perf_counter() - start
+
+        stage = self.stages[name]
+        stage.seconds.add(seconds)
+        stage.length_in += len(value)
+        stage.length_out += len(ret)
+        return ret
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def reset(self):
+        self.stages.clear()
+        self.counters.clear()
+
+    def to_dict(self):
+        return {
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+    def dump(self, path: str | Path):
+        with Path(path).open("w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def log(self, level: int = logging.INFO):
+        for name, stage in self.stages.items():
+            seconds = stage.seconds
+            logger.log(
+                level,
+                "%s: %d calls, mean %.1f us, p99 <= %.1f us, max %.1f us, "
+                "%d -> %d in/out",
+                name,
+                seconds.count,
+                seconds.mean * 1e6,
+                seconds.percentile(99) * 1e6,
+                (seconds.max or 0) * 1e6,
+                stage.length_in,
+                stage.length_out,
+            )
+        for name, n in self.counters.items():
+            logger.log(level, "%s: %d", name, n)
+
+
+recorder = None
+
+
+def enable():
+    """Start recording, keeping what was recorded so far."""
+    global recorder  # noqa: PLW0603
+    if recorder is None:
+        recorder = Recorder()
+    return recorder
+
+
+def disable():
+    """Stop recording and drop everything recorded."""
+    global recorder  # noqa: PLW0603
+    recorder = None
@@ -0,0 +1,155 @@
+"""Format every style of a webui styles.csv.
+
+The file is streamed row by row into a copy next to it, the prompt and
+negative_prompt columns formatted, and the copy moved over the original only
+if some style changed. Other columns, the encoding and line endings are kept.
+
+Styles share many fragments, so every piece of a prompt formatted is
+remembered for all the styles after it, see MemoFormatter. The {prompt}
+placeholder of a style is kept where it is: chunks are never packed, and a
+style whose placeholders formatting would move or drop is left as is.
+
+e.g.
+python -m scripts.prompt_formatting_styles styles.csv
+python -m scripts.prompt_formatting_styles styles.csv -o formatted.csv --spacing Ignore
+"""
+
+import argparse
+import codecs
+import csv
+import os
+import sys
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from scripts import prompt_formatting_cli as cli
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_incremental import IncrementalFormatter
+
+
+COLUMNS = ("prompt", "negative_prompt")
+PLACEHOLDER = "{prompt}"
+
+
+class MemoFormatter(IncrementalFormatter):
+    """IncrementalFormatter remembering the pieces of every prompt it formats.
+
+    A piece already formatted for any earlier prompt is not formatted again.
+    """
+
+    def __init__(self, options: FormatOptions = FormatOptions()):
+        super().__init__(options)
+        self.pieces = {}
+
+    def format_piece(self, text: str, flags: tuple):
+        ret = self.pieces.get((text, flags))
+        if ret is None:
+            ret = super().format_piece(text, flags)
+            self.pieces[(text, flags)] = ret
+        return ret
+
+
+class Report(NamedTuple):
+    styles: int
+    changed: int  # styles with a column formatted differently
+    skipped: int  # styles left as is for their placeholders
+    pieces: int  # pieces formatted, the rest came from memory
+    seconds: float
+
+    def summary(self):
+        return (
+            f"formatted {self.styles} styles in {self.seconds:.2f} s: "
+            f"{self.changed} changed, {self.skipped} left for their "
+            f"{PLACEHOLDER} placeholders, {self.pieces} pieces formatted"
+        )
+
+
+def format_style(text: str, formatter: MemoFormatter):
+    """Text formatted, or None if its placeholders would not survive."""
+    ret = formatter.format(text)
+    if ret.count(PLACEHOLDER) != text.count(PLACEHOLDER):
+        return None
+    return ret
+
+
+def line_ending(path: Path, encoding: str):
+    with path.open(encoding=encoding, newline="") as f:
+        line = f.readline()
+    return "\r\n" if line.endswith("\r\n") else "\n"
+
+
+def format_styles(
+    path: str,
+    options: FormatOptions = FormatOptions(),
+    output: str | None = None,
+):
+    """Format the styles of path into output, path itself by default.
+
+    Return a Report. Nothing is written if no style changed.
+    """
+    start = time.perf_counter()
+    path = Path(path)
+    output = Path(output) if output else path
+    with path.open("rb") as f:
+        encoding = "utf-8-sig" if f.read(3) == codecs.BOM_UTF8 else "utf-8"
+    terminator = line_ending(path, encoding)
+    formatter = MemoFormatter(options._replace(pack_chunks=False))
+
+    styles = changed = skipped = 0
+    temporary = output.with_name(f"{output.name}.{os.getpid()}.tmp")
+    try:
+        with path.open(encoding=encoding, newline="") as source, temporary.open(
+            "w", encoding=encoding, newline=""
+        ) as target:
+            reader = csv.DictReader(source)
+            writer = csv.DictWriter(
+                target, fieldnames=reader.fieldnames or [], lineterminator=terminator
+            )
+            if reader.fieldnames:
+                writer.writeheader()
+            for row in reader:
+                styles += 1
+                formatted = {}
+                for column in COLUMNS:
+                    text = row.get(column)
+                    if text:
+                        formatted[column] = format_style(text, formatter)
+                if None in formatted.values():
+                    skipped += 1
+                elif any(row[k] != v for k, v in formatted.items()):
+                    changed += 1
+                    row.update(formatted)
+                writer.writerow(row)
+
+        if changed or output != path:
+            temporary.replace(output)
+    finally:
+        temporary.unlink(missing_ok=True)
+
+    return Report(
+        styles, changed, skipped, formatter.misses, time.perf_counter() - start
+    )
+
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.prompt_formatting_styles",
+        description="Format the prompts of every style of a styles.csv.",
+    )
+    parser.add_argument("path", help="styles.csv of webui")
+    parser.add_argument("-o", "--output", help="output file, path itself if omitted")
+    cli.add_options(parser)
+    parser.add_argument("-q", "--quiet", action="store_true", help="no summary")
+    return parser.parse_args(argv)
+
+
+def main(argv: list | None = None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    report = format_styles(args.path, cli.options(args), args.output)
+    if not args.quiet:
+        print(report.summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+r"""Index of known tags, to write every tag with its own spacing.
+
+UnderSpaceEnum.TAGS looks up every tag of a prompt that has a space or an
+underscore in a tag list, such as the danbooru.csv of tag autocompletion,
+and writes it with the spaces and underscores of the list. Case and escapes
+are kept as written. Tags not in the list are left alone, so neither '^_^'
+nor a phrase such as 'standing in a field' is converted blindly.
+
+The list is a CSV whose first column is the tag, or a text file of one tag
+per line, where the first of two tags differing only in spacing or case
+wins. It is built once into an index file next to it, an open addressing
+hash table of offsets into the tags, and memory mapped on first use. Every
+process mapping the file shares its pages read-only, and a lookup hashes the
+tag once, so it takes O(tag length) whatever the size of the list.
+
+e.g.
+configure("danbooru.csv")
+to_tags("Long hair, ^_^, ganyu \(genshin impact\), standing in a field")
+# 'Long_hair, ^_^, ganyu_\(genshin_impact\), standing in a field'
+"""
+
+import csv
+import logging
+import mmap
+import os
+import threading
+import zlib
+from array import array
+from pathlib import Path
+
+import regex as re
+
+from scripts import prompt_formatting_patterns as patterns
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PFTAGS1\n"
+SUFFIX = ".pfindex"
+
+# Words joined by spaces, networks are matched first so they are skipped
+re_tag = patterns.compile(
+    r"<[^<>]*>|((?:\\.|[^\s,|:()\[\]{}<>\\])+(?: (?:\\.|[^\s,|:()\[\]{}<>\\])+)*)"
+)
+# AND splits words wherever it is, like in pipeline.space_and
+re_keyword = patterns.compile(r"( ?AND ?| ?\bBREAK\b ?)")
+re_escape = patterns.compile(r"\\(.)")
+
+path = ""
+index = None
+lock = threading.Lock()
+
+
+def key(tag: str):
+    """Return what tags differing only in spacing, case or escapes share."""
+    return re_escape.sub(r"\1", tag).lower().replace("_", " ")
+
+
+class TagIndex:
+    r"""Read-only hash table of tags over an index file's bytes.
+
+    The bytes are MAGIC, the number of slots as a uint32, the slots, then
+    one 'key\ttag\n' entry per tag. A slot holds one past the offset of an
+    entry, or 0 when empty.
+    """
+
+    def __init__(self, buffer):
+        if buffer[: len(MAGIC)] != MAGIC:
+            msg = "Not a tag index"
+            raise ValueError(msg)
+
+        header = len(MAGIC) + 4
+        self.buffer = buffer
+        self.size = array("I", buffer[len(MAGIC) : header])[0]
+        self.entries = header + 4 * self.size
+        self.slots = memoryview(buffer)[header : self.entries].cast("I")
+
+    def get(self, tag: str):
+        """Return the tag as written in the list, or None if it is not there."""
+        data = key(tag).encode() + b"\t"
+        i = zlib.crc32(data) % self.size
+        while slot := self.slots[i]:
+            start = self.entries + slot - 1
+            if self.buffer[start : start + len(data)] == data:
+                end = self.buffer.find(b"\n", start)
+                return self.buffer[start + len(data) : end].decode()
+            i = (i + 1) % self.size
+        return None
+
+    @staticmethod
+    def build(tags):
+        """Index bytes of tags, the first of each key kept."""
+        entries = {}
+        for tag in tags:
+            entries.setdefault(key(tag).encode(), tag.encode())
+
+        size = 2 * len(entries) + 1
+        slots = array("I", bytes(4 * size))
+        blob = bytearray()
+        for k, tag in entries.items():
+            data = k + b"\t"
+            i = zlib.crc32(data) % size
+            while slots[i]:
+                i = (i + 1) % size
+            slots[i] = len(blob) + 1
+            blob += data + tag + b"\n"
+
+        return MAGIC + array("I", [size]).tobytes() + slots.tobytes() + bytes(blob)
+
+
+def read_tags(source: Path):
+    """Tags of a CSV's first column or of every line of a text file."""
+    with source.open(encoding="utf-8", newline="") as f:
+        if source.suffix.lower() == ".csv":
+            rows = (row[0] for row in csv.reader(f) if row)
+        else:
+            rows = f
+        for row in rows:
+            tag = row.strip()
+            if tag and "\t" not in tag and "\n" not in tag:
+                yield tag
+
+
+def load(source: str):
+    """Index of the tag list at source, built into a file next to it if stale.
+
+    If the index file cannot be written, the index is built in memory.
+    """
+    source = Path(source)
+    target = source.with_name(source.name + SUFFIX)
+    try:
+        fresh = target.stat().st_mtime >= source.stat().st_mtime
+    except FileNotFoundError:
+        fresh = False
+
+    if not fresh:
+        data = TagIndex.build(read_tags(source))
+        temporary = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        try:
+            temporary.write_bytes(data)
+            temporary.replace(target)
+        except OSError as e:
+            logger.warning("Could not write tag index %s: %s", target, e)
+            return TagIndex(data)
+
+    with target.open("rb") as f:
+        return TagIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def configure(source: str):
+    """Use the tag list at source, or none if empty. Loaded on first use."""
+    global path, index  # noqa: PLW0603
+    with lock:
+        if source != path:
+            path = source
+            index = None
+
+
+def get_index():
+    """Index of the configured tag list, or None without one."""
+    global path, index  # noqa: PLW0603
+    if index is None and path:
+        with lock:
+            if index is None and path:
+                try:
+                    index = load(path)
+                except OSError as e:
+                    logger.warning("Could not load tag list %s: %s", path, e)
+                    path = ""
+    return index
+
+
+def respell(run: str, tag: str):
+    """Respell run with the spaces and underscores of tag, of the same key."""
+    ret = []
+    i = 0
+    escaped = False
+    for c in run:
+        if c == "\\" and not escaped:
+            escaped = True
+            ret.append(c)
+            continue
+
+        escaped = False
+        ret.append(tag[i] if c in " _" else c)
+        i += 1
+    return "".join(ret)
+
+
+def lookup(run: str, tags: TagIndex):
+    if " " not in run and "_" not in run:
+        return run
+
+    tag = tags.get(run)
+    if tag is None or len(tag) != len(re_escape.sub(r"\1", run)):
+        return run
+    return respell(run, tag)
+
+
+def to_tags(prompt: str):
+    """Write every tag of prompt found in the tag list as the list does.
+
+    Tags are the words between separators, brackets, AND and BREAK. Prompts
+    are left as is without a tag list.
+    """
+    tags = get_index()
+    if tags is None:
+        return prompt
+
+    def helper(match: re.Match):
+        run = match.group(1)
+        if run is None:
+            return match.group()
+        if "AND" in run or "BREAK" in run:
+            return "".join(lookup(part, tags) for part in re_keyword.split(run))
+        return lookup(run, tags)
+
+    return re_tag.sub(helper, prompt)
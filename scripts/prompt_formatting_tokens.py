@@ -0,0 +1,375 @@
+"""CLIP token counts of a formatted prompt and where its 75 token chunks fall.
+
+webui encodes a prompt in chunks of 75 CLIP tokens, one text encoder pass
+each. A chunk that would overflow is cut at its last comma if that is at
+most 20 tokens back, BREAK starts a new chunk and every section of AND is
+encoded on its own. analyze mirrors this on token counts alone.
+
+Tags are counted with CLIP's byte pair encoding from a local merges file,
+such as the bpe_simple_vocab_16e6.txt.gz open_clip ships with, or the
+merges.txt of a Hugging Face CLIP tokenizer. Only the merges are needed to
+count. The file is found on first use and every tag's count is cached.
+Without one, every word and run of punctuation counts as one token, which
+underestimates rare words. Weights, brackets and networks are not tokens.
+Prompt editing and alternation count all of their options.
+
+pack drops repeated tags and reorders tags so the prompt takes fewer
+chunks, keeping BREAK and AND where they are.
+
+e.g.
+analyze("a, (b:1.2) BREAK c")
+# Analysis(sections=[[Chunk(start=0, tokens=3), Chunk(start=17, tokens=1)]])
+"""
+
+import importlib.util
+import logging
+import threading
+from functools import lru_cache
+from itertools import pairwise
+from pathlib import Path
+from typing import NamedTuple
+
+import regex as re
+
+from scripts import prompt_formatting_nodes as nodes
+from scripts import prompt_formatting_patterns as patterns
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_LENGTH = 75
+BACKTRACK = 20  # webui's comma_padding_backtrack
+MERGES = 49152 - 256 - 2  # merges CLIP uses, after the version line
+CACHE_SIZE = 16384
+
+re_clip = patterns.compile(
+    r"""<\|startoftext\|>|<\|endoftext\|>|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""",
+    re.IGNORECASE,
+)
+re_whitespace = patterns.compile(r"\s+")
+# Everything that is not text to webui, besides BREAK and commas
+re_syntax = patterns.compile(
+    r"\\(.)|<[^<>]*>|:\s*[+-]?[.\d]+\s*\)|[()\[\]]|(,)|\b(BREAK)\b", re.DOTALL
+)
+re_and = patterns.compile(r"\bAND\b")
+re_section_weight = patterns.compile(r"\s*:\s*[-+]?(?:\d+\.?|\d*\.\d+)\s*$")
+re_only_networks = patterns.compile(r"(?:<[^<>]*>\s*)+")
+
+path = ""
+encoder = None
+lock = threading.Lock()
+
+
+def bytes_to_unicode():
+    """CLIP's map of every byte to a printable character."""
+    bs = [
+        *range(ord("!"), ord("~") + 1),
+        *range(ord("¡"), ord("¬") + 1),
+        *range(ord("®"), ord("ÿ") + 1),
+    ]
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+def clean(text: str):
+    # Imported here, only counting tokens with a merges file needs it
+    from html import unescape  # noqa: PLC0415
+
+    return re_whitespace.sub(" ", unescape(unescape(text))).strip().lower()
+
+
+class Encoder:
+    """Count CLIP tokens of text from byte pair merges."""
+
+    def __init__(self, merges: list):
+        self.ranks = {tuple(merge): i for i, merge in enumerate(merges)}
+        self.byte_encoder = bytes_to_unicode()
+        self.count = lru_cache(maxsize=CACHE_SIZE)(self.count)
+        self.bpe = lru_cache(maxsize=CACHE_SIZE)(self.bpe)
+
+    def bpe(self, token: str):
+        """Count the pieces token is encoded into."""
+        word = (*token[:-1], token[-1] + "</w>")
+        while len(word) > 1:
+            pairs = set(pairwise(word))
+            pair = min(pairs, key=lambda p: self.ranks.get(p, float("inf")))
+            if pair not in self.ranks:
+                break
+
+            first, second = pair
+            merged = []
+            i = 0
+            while i < len(word):
+                if i < len(word) - 1 and word[i] == first and word[i + 1] == second:
+                    merged.append(first + second)
+                    i += 2
+                else:
+                    merged.append(word[i])
+                    i += 1
+            word = tuple(merged)
+        return len(word)
+
+    def count(self, text: str):
+        """Tokens of text, without the start and end tokens."""
+        return sum(
+            self.bpe("".join(self.byte_encoder[b] for b in token.encode()))
+            for token in re_clip.findall(clean(text))
+        )
+
+    @classmethod
+    def load(cls, source: str):
+        """Load the merges file at source, gzipped or not, with a version line."""
+        import gzip  # noqa: PLC0415
+
+        opener = gzip.open if source.endswith(".gz") else open
+        with opener(source, "rt", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        if lines and lines[0].startswith("#version"):
+            lines = lines[1:]
+        return cls([line.split() for line in lines[:MERGES] if line.strip()])
+
+
+class Estimate:
+    """One token per word or run of punctuation, when no merges are found."""
+
+    @staticmethod
+    @lru_cache(maxsize=CACHE_SIZE)
+    def count(text: str):
+        return len(re_clip.findall(clean(text)))
+
+
+def find_merges():
+    """Find the merges file shipped with open_clip or OpenAI's clip, if installed."""
+    for package in ("open_clip", "clip"):
+        try:
+            spec = importlib.util.find_spec(package)
+        except (ImportError, ValueError):
+            continue
+        if spec is not None and spec.origin:
+            candidate = Path(spec.origin).parent / "bpe_simple_vocab_16e6.txt.gz"
+            if candidate.is_file():
+                return str(candidate)
+    return ""
+
+
+def configure(source: str):
+    """Use the merges file at source, or look for one if empty."""
+    global path, encoder  # noqa: PLW0603
+    with lock:
+        if source != path:
+            path = source
+            encoder = None
+
+
+def get_encoder():
+    """Return the encoder of the configured merges file, or an Estimate."""
+    global encoder  # noqa: PLW0603
+    if encoder is None:
+        with lock:
+            if encoder is None:
+                source = path or find_merges()
+                try:
+                    encoder = Encoder.load(source) if source else Estimate()
+                except OSError as e:
+                    logger.warning("Could not load CLIP merges %s: %s", source, e)
+                    encoder = Estimate()
+    return encoder
+
+
+class Chunk(NamedTuple):
+    start: int  # position in the prompt of the chunk's first token
+    tokens: int  # tokens in the chunk, at most CHUNK_LENGTH
+
+
+class Analysis(NamedTuple):
+    sections: list  # the chunks of every section of AND
+
+    @property
+    def passes(self):
+        """Text encoder passes, one per chunk of every section."""
+        return sum(len(chunks) for chunks in self.sections)
+
+    @property
+    def tokens(self):
+        """Tokens as webui's counter shows them, the most of any section."""
+        return max(
+            CHUNK_LENGTH * (len(chunks) - 1) + chunks[-1].tokens
+            for chunks in self.sections
+        )
+
+
+def events(section: str, offset: int, counter):
+    """Yield (position, tokens) of every tag, comma and BREAK of a section.
+
+    A comma is one token, given as 0, and BREAK is None.
+    """
+    text = []
+    start = 0
+
+    def add(s: str, at: int):
+        nonlocal start
+        if not text:
+            if not s.strip():
+                return
+            start = at + len(s) - len(s.lstrip())
+        text.append(s)
+
+    def flush():
+        n = counter.count("".join(text)) if text else 0
+        text.clear()
+        return n
+
+    last = 0
+    for match in re_syntax.finditer(section):
+        add(section[last : match.start()], last)
+        last = match.end()
+
+        escaped, comma, keyword = match.groups()
+        if escaped:
+            add(escaped, match.start())
+        elif comma or keyword:
+            at = start
+            if n := flush():
+                yield offset + at, n
+            yield offset + match.start(), 0 if comma else None
+
+    add(section[last:], last)
+    at = start
+    if n := flush():
+        yield offset + at, n
+
+
+def chunk(events, position: int):
+    """Chunks of a section, as webui fills them token by token."""
+    chunks = []
+    tokens = []  # position of every token of the current chunk
+    last_comma = -1
+
+    def next_chunk(at: int):
+        nonlocal tokens, last_comma
+        chunks.append(Chunk(tokens[0] if tokens else at, len(tokens)))
+        tokens = []
+        last_comma = -1
+
+    for at, n in events:
+        if n is None:
+            next_chunk(at)
+            continue
+
+        for _ in range(n or 1):
+            if n == 0:
+                last_comma = len(tokens)
+            elif (
+                len(tokens) == CHUNK_LENGTH
+                and last_comma != -1
+                and len(tokens) - last_comma <= BACKTRACK
+            ):
+                moved = tokens[last_comma + 1 :]
+                del tokens[last_comma + 1 :]
+                next_chunk(at)
+                tokens = moved
+            if len(tokens) == CHUNK_LENGTH:
+                next_chunk(at)
+            tokens.append(at)
+
+    if tokens or not chunks:
+        next_chunk(position)
+    return chunks
+
+
+def analyze(prompt: str, counter=None):
+    """Chunks of every section of a formatted prompt, see Analysis."""
+    counter = counter or get_encoder()
+    sections = []
+    last = 0
+    for match in [*re_and.finditer(prompt), None]:
+        end = match.start() if match else len(prompt)
+        section = prompt[last:end]
+        weight = re_section_weight.search(section)
+        if weight:
+            section = section[: weight.start()]
+        sections.append(chunk(events(section, last, counter), last))
+        last = match.end() if match else end
+    return Analysis(sections)
+
+
+def pack(prompt: str, counter=None, *, space_commas: bool = True):
+    """Pack prompt in fewer chunks if possible, else return it unchanged.
+
+    Tags are the pieces between commas outside of brackets. A tag repeating
+    an earlier one is dropped, then tags are placed in order into the first
+    chunk they fit in. Tags with BREAK or AND, and networks, stay in place
+    and tags are never moved across them.
+    """
+    counter = counter or get_encoder()
+    before = analyze(prompt, counter)
+    if before.passes == len(before.sections):
+        return prompt
+
+    separator = ", " if space_commas else ","
+    pairs = nodes.pair_brackets(prompt)
+    spans = nodes.split(prompt, 0, len(prompt), pairs, ",")
+    tags = [prompt[a:b].strip() for a, b in spans]
+    tags = [tag for tag in tags if tag]
+
+    deduplicated = []
+    packed = []
+    segment = []
+    seen = set()
+    start = 0  # where the last chunk of the packed tags starts
+    for tag in [*tags, None]:
+        if tag is not None and not (
+            "BREAK" in tag or re_and.search(tag) or re_only_networks.fullmatch(tag)
+        ):
+            if tag not in seen:
+                seen.add(tag)
+                segment.append(tag)
+            continue
+
+        # A barrier, pack the tags since the last one
+        deduplicated += segment
+        # Only the last chunk is analyzed again, tags before it never change
+        fill = 0
+        if packed:
+            tail = separator.join(packed)[start:] + ","
+            last = analyze(tail, counter).sections[-1][-1]
+            start += last.start
+            fill = last.tokens
+        packed += first_fit(segment, fill, counter)
+        if tag is not None:
+            deduplicated.append(tag)
+            packed.append(tag)
+            seen.clear()
+        segment = []
+
+    best = prompt, before.passes
+    for candidate in (separator.join(deduplicated), separator.join(packed)):
+        passes = analyze(candidate, counter).passes
+        if passes < best[1]:
+            best = candidate, passes
+    return best[0]
+
+
+def first_fit(tags: list, fill: int, counter):
+    """Order tags by the chunk they fit in first, each with its comma.
+
+    The first chunk already holds fill tokens. Tags larger than a chunk take
+    a chunk of their own.
+    """
+    chunks = [[CHUNK_LENGTH - fill, []]]
+    for tag in tags:
+        cost = counter.count(tag) + 1
+        for room in chunks:
+            if room[0] >= cost:
+                room[0] -= cost
+                room[1].append(tag)
+                break
+        else:
+            chunks.append([max(CHUNK_LENGTH - cost, 0), [tag]])
+    return [tag for _, chunk in chunks for tag in chunk]
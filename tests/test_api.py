@@ -0,0 +1,99 @@
+"""Unit testing for the HTTP API, against a stub of webui's modules."""
+
+import sys
+from http import HTTPStatus
+from types import ModuleType, SimpleNamespace
+
+import pytest
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import UnderSpaceEnum
+
+
+fastapi = pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+TestClient = pytest.importorskip("fastapi.testclient").TestClient
+
+
+@pytest.fixture(scope="module")
+def client():
+    callbacks, changes = [], {}
+    modules = ModuleType("modules")
+    modules.script_callbacks = SimpleNamespace(on_app_started=callbacks.append)
+    modules.shared = SimpleNamespace(
+        opts=SimpleNamespace(
+            pformat_space_commas=True,
+            pfromat_bracket2weight=True,
+            pformat_preferspacing="Ignore",
+            onchange=lambda key, func, call=True: changes.setdefault(key, func),
+        )
+    )
+    names = ("modules", "scripts.prompt_formatting_api")
+    saved = {name: sys.modules.get(name) for name in names}
+    sys.modules["modules"] = modules
+    sys.modules.pop("scripts.prompt_formatting_api", None)
+    try:
+        # imported once the stub is in place, registering the routes
+        from scripts import prompt_formatting_api  # noqa: F401, PLC0415
+
+        app = fastapi.FastAPI()
+        for callback in callbacks:
+            callback(None, app)
+        assert set(changes) == {"pformat_tags_file", "pformat_clip_merges"}
+        with TestClient(app) as client:
+            yield client
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+def test_format(client):
+    response = client.post("/pformat/v1/format", json={"prompt": "((a_b)),c"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"prompt": "(a_b:1.21), c"}
+    assert response.headers["Server-Timing"].startswith("format;dur=")
+    assert response.headers["X-Pformat-Prompts"] == "1"
+
+    response = client.post(
+        "/pformat/v1/format",
+        json={"prompt": "((a_b)),c", "options": {"prefer_spacing": "Space"}},
+    )
+    assert response.json() == {"prompt": "(a b:1.21), c"}
+
+def test_format_batch(client):
+    prompts = ["((a)),  b", "", "[c|d] AND  e"]
+    response = client.post(
+        "/pformat/v1/format-batch",
+        json={"prompts": prompts, "options": {"space_commas": False}},
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {
+        "prompts": [
+            engine.format_prompt(
+                p, space_commas=False, prefer_spacing=UnderSpaceEnum.IGNORE
+            )
+            for p in prompts
+        ]
+    }
+    assert response.headers["X-Pformat-Prompts"] == "3"
+
+def test_invalid_options(client):
+    response = client.post(
+        "/pformat/v1/format", json={"prompt": "a", "options": {"prefer_spacing": "x"}}
+    )
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+def test_tokens(client):
+    prompt = "a, (b:1.2) BREAK c AND d"
+    response = client.post("/pformat/v1/tokens", json={"prompt": prompt})
+    assert response.status_code == HTTPStatus.OK
+    analysis = tokens.analyze(prompt)
+    assert response.json() == {
+        "tokens": analysis.tokens,
+        "passes": analysis.passes,
+        "sections": [[list(chunk) for chunk in s] for s in analysis.sections],
+    }
+    assert response.headers["Server-Timing"].startswith("tokens;dur=")
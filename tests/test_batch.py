@@ -0,0 +1,23 @@
+"""Unit testing for batch formatting."""
+
+from scripts import prompt_formatting_engine as engine
+from scripts.prompt_formatting_batch import chunked, format_prompts
+from scripts.prompt_formatting_definitions import FormatOptions, UnderSpaceEnum
+
+
+prompts = [f"((tag_{i})),  other   tag , [a|b]" for i in range(50)] + ["", "a AND b"]
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+def test_format_prompts():
+    options = FormatOptions(prefer_spacing=UnderSpaceEnum.IGNORE)
+    expected = [
+        engine.format_prompt(p, prefer_spacing=UnderSpaceEnum.IGNORE) for p in prompts
+    ]
+
+    assert format_prompts(prompts, options) == expected
+    assert format_prompts(iter(prompts), options, chunk_size=7) == expected
+    assert format_prompts(prompts, options, workers=2, chunk_size=5) == expected
@@ -0,0 +1,34 @@
+"""Unit testing for the benchmark generator and baseline comparison."""
+
+import random
+
+from benchmarks import generator, suite
+from scripts import prompt_formatting_pipeline as pipeline
+
+
+def test_corpus_seeded():
+    assert generator.corpus(1, 2) == generator.corpus(1, 2)
+    assert generator.corpus(1, 2) != generator.corpus(2, 2)
+    assert set(generator.corpus(0, 1)) == set(generator.kinds)
+
+def test_nested_depth():
+    depth = 50
+    prompt = generator.nested(random.Random(0), depth)
+    assert prompt.count("(") + prompt.count("[") == depth
+    assert not pipeline.mismatched_brackets(prompt).count(1)
+
+def test_fullwidth():
+    assert generator.fullwidth("(a, b:1.2)") == "（ａ，　ｂ：１．２）"  # noqa: RUF001
+    assert pipeline.normalize_characters(generator.fullwidth("(a, b)")) == "(a, b)"
+
+def test_stage_inputs():
+    inputs = suite.stage_inputs("((a)),  b_c")
+    assert inputs["normalize_characters"] == "((a)),  b_c"
+    assert inputs["bracket_to_weights"] == "((a)), b c"
+    assert inputs["bracket_to_weights_indexed"] == "((a)), b c"
+
+def test_compare():
+    baseline = {"a": 1.0, "b": 1.0, "c": 1.0, "d": None, "e": 1e-8}
+    results = {"a": 1.1, "b": 2.0, "c": None, "d": 5.0, "e": 1e-7}
+    regressions = suite.compare(results, baseline, threshold=0.25)
+    assert [r[0] for r in regressions] == ["b", "c"]
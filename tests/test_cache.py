@@ -0,0 +1,66 @@
+"""Unit testing for the formatted prompt cache."""
+
+from scripts import prompt_formatting_engine as engine
+from scripts.prompt_formatting_cache import PromptCache, entry_size
+from scripts.prompt_formatting_definitions import UnderSpaceEnum
+from scripts.prompt_formatting_formatter import PromptFormatter
+
+
+def test_format_hits():
+    cache = PromptCache()
+    assert cache.format("((a)),  b") == engine.format_prompt("((a)),  b")
+    assert cache.misses == 1
+    assert cache.format("((a)),  b") == "(a:1.21), b"
+    assert cache.hits == 1
+
+    # The formatted output is a key of its own
+    assert cache.format("(a:1.21), b") == "(a:1.21), b"
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_format_settings_are_part_of_key():
+    cache = PromptCache()
+    assert cache.format("a_b") == "a b"
+    assert cache.format("a_b", prefer_spacing=UnderSpaceEnum.IGNORE) == "a_b"
+    assert cache.hits == 0
+
+def test_eviction():
+    cache = PromptCache()
+    cache.resize(3 * entry_size(("aaaa",), "aaaa"))
+    for prompt in ("aaaa", "bbbb", "cccc"):
+        cache.put((prompt,), prompt)
+    cache.get(("aaaa",))
+    cache.put(("dddd",), "dddd")
+
+    assert cache.evictions == 1
+    assert cache.get(("bbbb",)) is None
+    assert cache.get(("aaaa",)) == "aaaa"
+    assert sorted(cache.entries) == [("aaaa",), ("cccc",), ("dddd",)]
+
+    cache.resize(0)
+    assert (len(cache), cache.size, cache.evictions) == (0, 0, 4)
+
+def test_format_with_budget():
+    cache = PromptCache()
+    formatter = PromptFormatter()
+    assert cache.format_with("((a)),  b_c", formatter, 1) == "(a:1.21), b c"
+    stored = [prompt for prompt, _ in cache.entries]
+    assert stored == ["((a)),  b_c", "(a:1.21), b c"]
+
+    cache.format_with("a, " + "b_" * 200000, formatter, 0.01)
+    assert [prompt for prompt, _ in cache.entries] == stored
+
+def test_format_with_disabled():
+    class Recording(PromptFormatter):
+        def __init__(self):
+            super().__init__()
+            self.prompts = []
+
+        def format(self, prompt):
+            self.prompts.append(prompt)
+            return super().format(prompt)
+
+    formatter = Recording()
+    PromptCache(0).format_with("((a)),  b", formatter)
+    assert formatter.prompts == ["((a)),  b"]
+    PromptCache().format_with("((a)),  b", formatter)
+    assert formatter.prompts == ["((a)),  b", "((a)),  b", "(a:1.21), b"]
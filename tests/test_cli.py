@@ -0,0 +1,62 @@
+"""Unit testing for the command line formatter."""
+
+import io
+import json
+
+from scripts import prompt_formatting_cli as cli
+
+
+def test_text(tmp_path, capsys):
+    source = tmp_path / "prompts.txt"
+    source.write_text("((a)),  b\nc_d\n", encoding="utf-8")
+
+    cli.main([str(source), "--workers", "2", "--chunk-size", "1"])
+    out, err = capsys.readouterr()
+    assert out == "(a:1.21), b\nc d\n"
+    assert "formatted 2 prompts" in err
+
+def test_text_stdin(monkeypatch, capsys):
+    monkeypatch.setattr("sys.stdin", io.StringIO("a   AND b\n"))
+    cli.main(["-q", "--spacing", "Ignore"])
+    assert capsys.readouterr() == ("a AND b\n", "")
+
+def test_jsonl(tmp_path):
+    source = tmp_path / "prompts.jsonl"
+    target = tmp_path / "out.jsonl"
+    source.write_text(
+        '{"id": 1, "text": "((a))"}\n\n{"id": 2}\n', encoding="utf-8"
+    )
+
+    cli.main([str(source), "--field", "text", "-o", str(target), "-q"])
+    lines = target.read_text(encoding="utf-8").splitlines()
+    assert lines[1] == ""
+    assert [json.loads(lines[i]) for i in (0, 2)] == [
+        {"id": 1, "text": "(a:1.21)"},
+        {"id": 2},
+    ]
+
+def test_jsonl_invalid(tmp_path, caplog):
+    source = tmp_path / "prompts.jsonl"
+    target = tmp_path / "out.jsonl"
+    source.write_text(
+        '{"text": "((a))"}\n[1]\n{"text": 2}\n{"text"\n{"text": "b"}\n',
+        encoding="utf-8",
+    )
+
+    cli.main([str(source), "--field", "text", "-o", str(target), "-q"])
+    lines = target.read_text(encoding="utf-8").splitlines()
+    expected = source.read_text(encoding="utf-8").splitlines()
+    expected[0] = '{"text": "(a:1.21)"}'
+    assert lines == expected
+    kept = [r.getMessage() for r in caplog.records]
+    assert [message.split(": ")[0] for message in kept] == [
+        f"Keeping {source}:{number} unchanged" for number in (2, 3, 4)
+    ]
+
+def test_csv(tmp_path):
+    source = tmp_path / "prompts.csv"
+    target = tmp_path / "out.csv"
+    source.write_text('name,prompt\nx,"a ,b,  ((c))"\ny\n', encoding="utf-8")
+
+    cli.main([str(source), "-o", str(target), "-q"])
+    assert target.read_text(encoding="utf-8") == 'name,prompt\nx,"a, b, (c:1.21)"\ny\n'
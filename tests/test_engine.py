@@ -0,0 +1,98 @@
+"""Unit testing for the single-pass formatting engine."""
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts.prompt_formatting_definitions import UnderSpaceEnum
+from scripts.prompt_formatting_engine import TokenKind
+
+
+prompts = [
+    "(   [   {   <   content   >   }   ]   )",
+    "a   ANDb",
+    "aANDbANDc",
+    "name: John AND age: 30",
+    "  foo ,   bar ,   baz  ",
+    " , a , b , c , ",
+    "a{b[c}d]",
+    "][}{",
+    ")a[b]{c}",
+    "foo |bar |baz",
+    "((a), ((b)))",
+    "<lora:chicken butt>, multiple subjects",
+    "one_two_three",
+    "one two three",
+    (
+        "photorealistic   photo of a handsome male (wizard  :1.2）， "  # noqa: RUF001
+        "<lora:LuisapHotlineStyle:0.5> <lora:ElegantHanfuRuqunStyle:0.2>    "
+        "short beard, "
+        "white wizard  shirt, (with golden    trim:0.8), (((bald))"
+    ),
+    "a, [[b, [c, [A:B], [A|B], [A :1.2 AND B :1.2]], e]]",
+    "a_b BREAK\nc_d,\n, e",
+]
+
+
+def test_lex():
+    kinds = [kind for kind, _ in engine.lex("(a:1.2), <lora:x> AND {b|c}")]
+    assert kinds == [
+        TokenKind.OPEN,
+        TokenKind.TEXT,
+        TokenKind.COLON,
+        TokenKind.WEIGHT,
+        TokenKind.CLOSE,
+        TokenKind.COMMA,
+        TokenKind.SPACE,
+        TokenKind.NETWORK_OPEN,
+        TokenKind.TEXT,
+        TokenKind.COLON,
+        TokenKind.TEXT,
+        TokenKind.NETWORK_CLOSE,
+        TokenKind.SPACE,
+        TokenKind.AND,
+        TokenKind.SPACE,
+        TokenKind.WILDCARD_OPEN,
+        TokenKind.TEXT,
+        TokenKind.PIPE,
+        TokenKind.TEXT,
+        TokenKind.WILDCARD_CLOSE,
+    ]
+
+    assert [text for _, text in engine.lex("a (b")] == ["a", " ", "b"]
+    assert [text for _, text in engine.lex(r"\(a\) (b)")] == [
+        r"\(a\)", " ", "(", "b", ")"
+    ]
+
+
+def test_format_prompt_matches_reference():
+    for prompt in prompts:
+        for mode in UnderSpaceEnum:
+            for space_commas in (True, False):
+                options = {"space_commas": space_commas, "prefer_spacing": mode}
+                assert engine.format_prompt(prompt, **options) == (
+                    pipeline.format_prompt(prompt, **options)
+                ), prompt
+
+
+def test_format_prompt():
+    assert engine.format_prompt(
+        "a, [[b, [c, [A:B], [A|B], [A :1.2 AND B :1.2]], e]]"
+    ) == "a, (b, (c, [A:B], [A|B], [A:1.2 AND B:1.2]:0.91), e:0.83)"
+
+def test_normalize_spacing_matches_reference():
+    def chain(prompt, space_commas):
+        prompt = pipeline.remove_whitespace_excessive(prompt)
+        prompt = pipeline.align_brackets(prompt)
+        prompt = pipeline.space_and(prompt)
+        prompt = pipeline.space_bracekts(prompt)
+        prompt = pipeline.align_colons(prompt)
+        prompt = pipeline.align_commas(prompt, do_it=space_commas)
+        return pipeline.align_alternating(prompt)
+
+    for prompt in [*prompts, "a\n,", "  a  ,\t", "BRANDY,,(  x )"]:
+        for space_commas in (True, False):
+            assert engine.normalize_spacing(prompt, space_commas=space_commas) == (
+                chain(prompt, space_commas)
+            ), prompt
+
+    assert engine.normalize_spacing(r"a \( b \\( c") == r"a \( b \\(c"
+    assert engine.normalize_spacing(r"a\AND b") == "a\\ AND b"
@@ -0,0 +1,38 @@
+"""Unit testing for the feature scan that skips stages."""
+
+import logging
+from itertools import product
+
+from scripts import prompt_formatting_features as features
+from scripts.prompt_formatting_definitions import FormatOptions, UnderSpaceEnum
+from scripts.prompt_formatting_features import Feature
+from scripts.prompt_formatting_formatter import PromptFormatter
+from tests.test_engine import prompts
+
+
+def test_features():
+    assert features.features("a, b c") == 0
+    assert Feature(features.features("((a_b)), c:1 AND d|e")) == Feature.PARENS
+    assert Feature(features.features("a) <b>}")) == (
+        Feature.PARENS | Feature.ANGLE | Feature.CURLY
+    )
+    found = features.features("[（a）")  # noqa: RUF001
+    assert Feature(found) == Feature.NON_ASCII | Feature.SQUARE
+    assert not features.applies("normalize_characters", features.features("a"))
+    assert features.applies("strip", 0)
+
+def test_skipping_matches_every_stage():
+    for values in product((True, False), (True, False), UnderSpaceEnum):
+        formatter = PromptFormatter(FormatOptions(*values))
+        for prompt in [*prompts, "（a）", "a)", "ａ，b"]:  # noqa: RUF001
+            expected = prompt
+            for stage in formatter.stages:
+                expected = stage(expected)
+            assert formatter.format(prompt) == expected, prompt
+
+def test_trace(caplog):
+    formatter = PromptFormatter(FormatOptions(prefer_spacing=UnderSpaceEnum.IGNORE))
+    with caplog.at_level(logging.DEBUG, logger=features.logger.name):
+        assert formatter.format("a ,b") == "a, b"
+    assert "skipped=[normalize_characters, remove_mismatched_brackets, " in caplog.text
+    assert "bracket_to_weights]" in caplog.text
@@ -0,0 +1,98 @@
+"""Unit testing for the configured prompt formatter."""
+
+from itertools import product
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_stats as stats
+from scripts.prompt_formatting_definitions import (
+    FormatOptions,
+    MergeEnum,
+    NetworkEnum,
+    UnderSpaceEnum,
+)
+from scripts.prompt_formatting_formatter import Outcome, PromptFormatter, get_formatter
+from tests.test_engine import prompts
+
+
+def test_plan():
+    def names(**options):
+        return [name for name, _ in PromptFormatter(FormatOptions(**options)).plan]
+
+    assert names() == [
+        "normalize_characters",
+        "remove_mismatched_brackets",
+        "to_spaces",
+        "bracket_to_weights",
+        "strip",
+    ]
+    assert names(prefer_spacing=UnderSpaceEnum.IGNORE, bracket2weight=False) == [
+        "normalize_characters",
+        "remove_mismatched_brackets",
+        "normalize_spacing",
+        "strip",
+    ]
+    assert "to_underscores" in names(prefer_spacing=UnderSpaceEnum.UNDERSCORE)
+    assert names(networks=NetworkEnum.END)[-2:] == ["partition_networks", "strip"]
+    assert names(merge_networks=MergeEnum.MAX)[-2] == "partition_networks"
+    assert names(flatten_weights=True)[-3:] == [
+        "bracket_to_weights",
+        "fold_weights",
+        "strip",
+    ]
+
+def test_format_matches_engine():
+    for values in product((True, False), (True, False), UnderSpaceEnum):
+        options = FormatOptions(*values)
+        formatter = PromptFormatter(options)
+        expected = [engine.format_prompt(p, **options._asdict()) for p in prompts]
+        assert [formatter.format(p) for p in prompts] == expected, options
+        assert formatter.format_many(iter(prompts)) == expected
+
+    for values in product(NetworkEnum, MergeEnum, (True, False), (True, False)):
+        options = FormatOptions(
+            networks=values[0],
+            merge_networks=values[1],
+            flatten_weights=values[2],
+            split_weights=values[3],
+        )
+        formatter = PromptFormatter(options)
+        for p in prompts:
+            assert formatter.format(p) == engine.format_prompt(p, **options._asdict())
+
+def test_get_formatter():
+    options = FormatOptions(prefer_spacing=UnderSpaceEnum.IGNORE)
+    assert get_formatter(options) is get_formatter(options)
+    assert get_formatter(options).format("((a)),  b_c") == "(a:1.21), b_c"
+
+def test_format_within():
+    formatter = PromptFormatter()
+    assert formatter.format_within("((a)),  b_c", 1) == Outcome("(a:1.21), b c", None)
+
+    prompt, failed = formatter.format_within("((a)), " + "b_" * 200000, 0.01)
+    assert failed is not None
+    assert prompt.startswith("((a)), b_")
+
+    def broken(prompt):
+        raise ValueError(prompt)
+
+    formatter.plan = [
+        (name, broken if name == "bracket_to_weights" else stage)
+        for name, stage in formatter.plan
+    ]
+    outcome = formatter.format_within("((a)),  b_c", 1)
+    assert outcome == Outcome("((a)), b c", "bracket_to_weights")
+
+def test_format_within_stats():
+    formatter = PromptFormatter()
+    try:
+        recorder = stats.enable()
+        formatter.format_within("((a)),  b_c", 1)
+    finally:
+        stats.disable()
+    assert set(recorder.stages) == {
+        "remove_mismatched_brackets",
+        "to_spaces",
+        "bracket_to_weights",
+        "strip",
+    }
+    assert recorder.counters == {"prompts": 1, "skipped.normalize_characters": 1}
@@ -0,0 +1,92 @@
+"""Unit testing for the differential fuzz harness."""
+
+import random
+
+from fuzz import differential, grammar
+from scripts.prompt_formatting_definitions import FormatOptions
+
+
+options = FormatOptions()
+
+
+def test_grammar_is_seeded():
+    assert list(grammar.prompts(3, 20)) == list(grammar.prompts(3, 20))
+    assert list(grammar.prompts(3, 20)) != list(grammar.prompts(4, 20))
+
+def test_random_options_vary_every_field():
+    rng = random.Random(0)
+    drawn = [differential.random_options(rng) for _ in range(100)]
+    assert all(len(set(values)) > 1 for values in zip(*drawn))
+
+def test_shrink():
+    assert differential.shrink("abc(de[f]gh)ij", lambda p: "[" in p) == "["
+    assert differential.shrink("xyz((q))", lambda p: "((" in p) == "(("
+
+def test_check():
+    target = differential.Target(
+        lambda p, _: p.upper(), lambda p, _: p.upper().replace("B", "b")
+    )
+    assert differential.check("upper", target, "aa", options) is None
+
+    finding = differential.check("upper", target, "a b", options)
+    assert finding.kind == "mismatch"
+    assert finding.detail == "expected 'A B', got 'A b'"
+
+    differential.targets["upper"] = target
+    try:
+        finding = differential.shrink_finding(finding._replace(prompt="xyzbxyz"))
+        assert finding.prompt == "b"
+    finally:
+        del differential.targets["upper"]
+
+    target = differential.Target(lambda p, _: p, lambda p, _: 1 / 0)
+    assert differential.check("x", target, "a", options).kind == "candidate raises"
+
+def test_reference_raises():
+    target = differential.targets["bracket_to_weights"]
+    finding = differential.check("bracket_to_weights", target, "(((a)) b)", options)
+    assert finding.kind == "get_weight raises"
+    deep = "(" * 12 + "a" + ")" * 12
+    assert differential.check("bracket_to_weights", target, deep, options) is None
+
+def test_known_divergence():
+    target = differential.targets["format_prompt"]
+    assert differential.check("format_prompt", target, "((a)), b", options) is None
+    finding = differential.check("format_prompt", target, r"a \(b\) c", options)
+    assert finding.kind == "known: escapes"
+
+    expected, got = "((:1.10)a:1.10)", "((:1.10)a:1.10),"
+    kind = differential.known_divergence("(()a),", expected, got)
+    assert kind == "known: reference drops text"
+    for got in ("x((:1.10)a:1.10),", "(x(:1.10)a:1.10),", "((:1.10)a,:1.10)"):
+        assert differential.known_divergence("(()a),", expected, got) is None
+
+    expected, got = "(a([|b]:0.91)0.91)", "(a([|b]:0.91):0.91)"
+    kind = differential.known_divergence("[a[[|b]]]", expected, got)
+    assert kind == "known: reference drops colons"
+
+    expected, got = "[(:0.83)r]:", "((:0.83)r:0.91):"
+    assert differential.known_divergence("[[[]]r]:", expected, got) is None
+    kind = differential.known_divergence("[[[]]r]:", expected, got, weights_only=True)
+    assert kind == "known: same weights"
+
+def test_char_weights():
+    weights = differential.char_weights("((a)), [b] (c:0.5)")
+    assert [c for c, _ in weights] == ["a", ",", "b", "c"]
+    same = differential.char_weights("(a:1.21), (b:0.91) (c:0.5)")
+    assert differential.same_weights(weights, same)
+    other = differential.char_weights("(a:1.21), b (c:0.5)")
+    assert not differential.same_weights(weights, other)
+    assert differential.char_weights("(a") is None
+
+def test_check_growth():
+    def quadratic(prompt, _):
+        for _ in range(len(prompt) // 10):
+            prompt.count("a")
+        return prompt
+
+    target = differential.Target(lambda p, _: p, quadratic)
+    found = list(
+        differential.check_growth("quadratic", target, "a" * 50, options, max_slope=1.5)
+    )
+    assert {finding.kind for finding in found} == {"superlinear"}
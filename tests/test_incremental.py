@@ -0,0 +1,59 @@
+"""Unit testing for incremental formatting."""
+
+import random
+from itertools import product
+
+from scripts.prompt_formatting_definitions import FormatOptions, UnderSpaceEnum
+from scripts.prompt_formatting_formatter import PromptFormatter
+from scripts.prompt_formatting_incremental import (
+    IncrementalFormatter,
+    join_chunks,
+    segments,
+)
+from tests.test_engine import prompts
+
+
+def test_segments():
+    def texts(prompt):
+        return [[prompt[a:b] for a, b in chunk] for chunk in segments(prompt)]
+
+    assert texts("a, (b, c), d") == [["a"], [" (b, c)"], [" d"]]
+    assert texts("a BREAK b, [c BREAK]") == [["a ", "BREAK b"], [" [c BREAK]"]]
+    assert texts("aBREAK \\(, b") == [["aBREAK \\("], [" b"]]
+    assert texts("") == [[""]]
+
+def test_join_chunks():
+    assert join_chunks(["a", "", "b", "|c"]) == "a, b,|c"
+
+def test_matches_formatter():
+    alphabet = [*"ab_ ,|:()[]\\\n", "BREAK", "AND", "1.2", "（"]  # noqa: RUF001
+    rng = random.Random(0)
+    for values in product((True, False), (True, False), UnderSpaceEnum):
+        options = FormatOptions(*values)
+        formatter = PromptFormatter(options)
+        incremental = IncrementalFormatter(options)
+        for prompt in prompts:
+            assert incremental.format(prompt) == formatter.format(prompt), options
+
+        prompt = ""
+        for _ in range(300):
+            i = rng.randint(0, len(prompt))
+            j = min(len(prompt), i + rng.randint(0, 2))
+            edit = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 2)))
+            prompt = (prompt[:i] + edit + prompt[j:])[:60]
+            assert incremental.format(prompt) == formatter.format(prompt), prompt
+
+def test_reuse():
+    incremental = IncrementalFormatter()
+    assert incremental.format("((a)), b BREAK c, d") == "(a:1.21), b BREAK c, d"
+    assert (incremental.reused, incremental.misses) == (0, 4)
+
+    # Only the piece of the edit is formatted again
+    assert incremental.format("((a)), bb BREAK c, d") == "(a:1.21), bb BREAK c, d"
+    assert (incremental.reused, incremental.misses) == (3, 5)
+
+    # A new comma cuts the prompt again, reusing unchanged pieces
+    assert incremental.format("((a)), bb BREAK c, d, e") == (
+        "(a:1.21), bb BREAK c, d, e"
+    )
+    assert (incremental.reused, incremental.misses) == (7, 6)
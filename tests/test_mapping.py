@@ -0,0 +1,32 @@
+"""Unit testing for array backed bracket maps."""
+
+import numpy as np
+
+from scripts import prompt_formatting_mapping as mapping
+
+
+def test_get_mappings():
+    depth, gradient, brackets = mapping.get_mappings("c, ((a), ((b)))")
+    assert depth.tolist() == [0, 0, 0, 1, 2, 2, 1, 1, 1, 2, 3, 3, 2, 1, 0]
+    assert gradient.tolist() == [0, 0, 0, 1, 1, 0, -1, 0, 0, 1, 1, 0, -1, -1, -1]
+    assert np.array_equal(brackets, gradient != 0)
+
+def test_get_mappings_deep():
+    prompt = "(" * 12 + "a" + ")" * 12
+    depth, _, _ = mapping.get_mappings(prompt)
+    assert depth.tolist() == [*range(1, 13), 12, *range(11, -1, -1)]
+
+def test_get_mappings_batch():
+    prompts = ["((a), b)", "", "[c", "d]]", "(e)"]
+    batch = mapping.get_mappings_batch(prompts)
+
+    assert len(batch) == len(prompts)
+    for i, prompt in enumerate(prompts):
+        single = mapping.get_mappings(prompt)
+        for a, b in zip(batch[i], single):
+            assert np.array_equal(a, b)
+
+    padded = mapping.pad(batch)
+    assert padded.depth.shape == (len(prompts), len(prompts[0]))
+    assert padded.depth[2].tolist() == [1, 1, 0, 0, 0, 0, 0, 0]
+    assert padded.depth[3].tolist() == [0, -1, -2, 0, 0, 0, 0, 0]
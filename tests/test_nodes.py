@@ -0,0 +1,78 @@
+"""Unit testing for the compact prompt tree."""
+
+import gc
+
+import pytest
+
+from fuzz import grammar
+from scripts import prompt_formatting_nodes as nodes
+from scripts.prompt_formatting_nodes import (
+    Alternation,
+    Editing,
+    Group,
+    Network,
+    Weight,
+    parse,
+    text,
+)
+from tests.test_engine import prompts
+
+
+def test_parse():
+    assert parse("a, (b:1.2), [c|d]").children == (
+        text("a"),
+        text(", "),
+        Weight((text("b"),), "1.2"),
+        text(", "),
+        Alternation(((text("c"),), (text("d"),))),
+    )
+    assert parse("[a:(b):0.5] <lora:x:1> {c|d}").children == (
+        Editing(((text("a"),), (Group("(", (text("b"),)),), (text("0.5"),))),
+        text(" "),
+        Network("lora:x:1"),
+        text(" "),
+        Group("{", (text("c|d"),)),
+    )
+    # Unmatched and escaped brackets are text
+    assert parse(r"\(a) ((b:x)").children == (
+        text(r"\(a) ("),
+        Group("(", (text("b:x"),)),
+    )
+
+def test_shared():
+    a = parse("long hair, (smile:1.2)")
+    b = parse("(smile:1.2), long hair")
+    assert a.children[0] is b.children[2]
+    assert a.children[2] is b.children[0]
+    assert a.children[0].text is b.children[2].text
+
+    nodes.clear()
+    assert parse("long hair").children[0] == a.children[0]
+
+def test_shared_released():
+    nodes.clear()
+    prompt = parse("released, (tags:1.2)")
+    assert set(nodes.texts) == {"released", ", ", "tags"}
+    assert list(nodes.shared.values()) == [prompt.children[2]]
+
+    del prompt
+    gc.collect()
+    assert not nodes.texts
+    assert not nodes.shared
+
+def test_round_trip():
+    for prompt in [*prompts, *grammar.prompts(0, 500)]:
+        assert parse(prompt).to_string() == prompt
+
+def test_slots():
+    for node in parse("a, (b:1.2), [c|d], [e:f:1], <g>, {h}").children:
+        assert not hasattr(node, "__dict__")
+
+def test_hash():
+    a = Weight((Group("(", (text("b"),)),), "1.2")
+    b = Weight((Group("(", (text("b"),)),), "1.2")
+    assert a is not b
+    assert a == b
+    assert hash(a) == hash(b)
+    with pytest.raises(TypeError):
+        nodes.Node()
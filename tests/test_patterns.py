@@ -0,0 +1,53 @@
+"""Unit testing for lazily compiled patterns and the import of the formatter."""
+
+import subprocess
+import sys
+
+import pytest
+import regex as re
+
+from benchmarks import bench_import
+from scripts import prompt_formatting_patterns as patterns
+
+
+def test_lazy_pattern():
+    pattern = patterns.compile(r"\s*(,)\s*", re.DOTALL)
+    assert not pattern.compiled
+    assert pattern.sub(r"\1 ", "a ,b") == "a, b"
+    assert pattern.compiled
+    assert pattern.split("a,b") == ["a", ",", "b"]
+    assert pattern.groups == 1
+    assert [m.span() for m in pattern.finditer("a , b")] == [(1, 4)]
+
+def test_deadline():
+    pattern = patterns.compile(r"(a|aa)+$")
+    assert patterns.remaining() is None
+    seconds = 0.05
+    assert pattern.match("aaaa")
+    assert pattern.match is pattern.plain["match"]
+    with patterns.deadline(seconds):
+        assert pattern.match is pattern.timed["match"]
+        assert pattern.match("aaaa")
+        with patterns.deadline(10):
+            assert patterns.remaining() <= seconds
+        with pytest.raises(TimeoutError):
+            pattern.match("a" * 64 + "b")
+    assert patterns.remaining() is None
+    assert pattern.match is pattern.plain["match"]
+
+def test_import():
+    code = (
+        "import sys, scripts.prompt_formatting_cli\n"
+        "import scripts.prompt_formatting_segments\n"
+        "from scripts import prompt_formatting_pipeline as pipeline\n"
+        "compiled = [k for k, v in vars(pipeline).items()\n"
+        "            if k.startswith('re_') and v.compiled]\n"
+        "print(compiled, 'multiprocessing' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[] False"
+
+    for module in bench_import.MODULES:
+        assert bench_import.measure(module, 1)[2] == []
@@ -7,7 +7,7 @@ from typing import TYPE_CHECKING
 import pytest
 
 from scripts import prompt_formatting_pipeline as pipeline
-from scripts.prompt_formatting_definitions import UnderSpaceEnum
+from scripts.prompt_formatting_definitions import MergeEnum, NetworkEnum, UnderSpaceEnum
 
 
 def test_get_bracket_closing():
@@ -76,6 +76,7 @@ def test_space_and():
     assert pipeline.space_and('test ANDexample') == 'test AND example'
     assert pipeline.space_and('a AND  b AND  c') == 'a AND b AND c'
     assert pipeline.space_and('aANDbANDc') == 'a AND b AND c'
+    assert pipeline.space_and('aANDb,c  AND d') == 'a AND b,c AND d'
 
 def test_align_colons():
     assert pipeline.align_colons('key: value') == 'key:value'
@@ -97,6 +98,14 @@ def test_remove_mismatched_brackets():
     assert pipeline.remove_mismatched_brackets('a(b]c') == 'abc'
     assert pipeline.remove_mismatched_brackets('[(a+b)]') == '[(a+b)]'
     assert pipeline.remove_mismatched_brackets('a{b[c}d]') == 'abcd'
+    assert pipeline.remove_mismatched_brackets('<a>{b}(c]') == '<a>{b}c'
+    assert pipeline.remove_mismatched_brackets('))a((') == 'a'
+    assert pipeline.remove_mismatched_brackets(r'\(a\) (b') == r'\(a\) b'
+    assert pipeline.remove_mismatched_brackets(r'\\(a\[') == r'\\a\['
+
+def test_mismatched_brackets():
+    assert pipeline.mismatched_brackets('a(b]c') == bytearray([0, 1, 0, 1, 0])
+    assert pipeline.mismatched_brackets('(a[b]c)') == bytearray(7)
 
 def test_space_bracekts():
     assert pipeline.space_bracekts(')(') == ') ('
@@ -119,6 +128,10 @@ def test_bracket_to_weights():
     assert pipeline.bracket_to_weights('(a, (b))') == '(a, (b:1.10):1.10)'
     assert pipeline.bracket_to_weights('((a), b)') == '((a:1.10), b:1.10)'
     assert pipeline.bracket_to_weights('((a), ((b)))') == '((a:1.10), (b:1.21):1.10)'
+    # Depth is not limited to one digit
+    assert pipeline.bracket_to_weights('(' * 12 + 'a' + ')' * 12) == '(a:3.14)'
+    deep = '[[' + '(' * 10 + 'a' + ')' * 10 + ']]'
+    assert pipeline.bracket_to_weights(deep) == '((a:2.59):0.83)'
 
 def test_space_to_underscore():
     assert pipeline.space_to_underscore('<lora:chicken butt>, multiple subjects') == '<lora:chicken butt>, multiple subjects'
@@ -128,3 +141,100 @@ def test_space_to_underscore():
 
     assert pipeline.space_to_underscore('one two three', UnderSpaceEnum.UNDERSCORE) == 'one_two_three'
 
+def test_index_brackets():
+    openings, pairs, separated = pipeline.index_brackets('([a:b], <x(y)>)')
+    assert openings == [0, 1]
+    assert pairs == {0: 14, 14: 0, 1: 5, 5: 1, 10: 12, 12: 10}
+    assert separated == {1}
+
+def test_bracket_to_weights_indexed():
+    convert = pipeline.bracket_to_weights_indexed
+    assert convert('(a)') == '(a:1.10)'
+    assert convert('((a))') == '(a:1.21)'
+    assert convert('((a, b))') == '(a, b:1.21)'
+    assert convert('(a, (b))') == '(a, (b:1.10):1.10)'
+    assert convert('((a), b)') == '((a:1.10), b:1.10)'
+    assert convert('((a), ((b)))') == '((a:1.10), (b:1.21):1.10)'
+    assert convert('[[a]], c') == '(a:0.83), c'
+    assert convert('[a:b:0.5], [a|b]') == '[a:b:0.5], [a|b]'
+    assert convert('[[a|b]]') == '([a|b]:0.91)'
+    assert convert('((a:1.2))') == '(a:1.2)'
+    assert convert('[(a)]') == '((a:1.10):0.91)'
+    assert convert('<lora:(a)>, (b)') == '<lora:(a)>, (b:1.10)'
+    assert convert(r'(\(a\))') == r'(\(a\):1.10)'
+
+    # bracket_to_weights drops the comma or raises on these
+    assert convert('((a), b), c') == '((a:1.10), b:1.10), c'
+    assert convert('(((a)), b)') == '((a:1.21), b:1.10)'
+    assert convert('(' * 12 + 'a' + ')' * 12) == '(a:3.14)'
+
+def test_partition_networks():
+    prompt = (
+        '<lora:a:0.5> photo, <lora:b:1> <hypernet:c>, man <lora:a:0.25> wizard, '
+        '(x <lora:d:1>), a AND <lora:e:1> b'
+    )
+    assert pipeline.partition_networks(prompt) == (
+        'photo, man wizard, (x <lora:d:1>), a AND <lora:e:1> b, '
+        '<lora:a:0.5> <lora:b:1> <hypernet:c> <lora:a:0.25>'
+    )
+
+    front = pipeline.partition_networks(
+        prompt, networks=NetworkEnum.FRONT, space_commas=False
+    )
+    assert front == (
+        '<lora:a:0.5> <lora:b:1> <hypernet:c> <lora:a:0.25>,'
+        'photo, man wizard, (x <lora:d:1>), a AND <lora:e:1> b'
+    )
+
+    merged = pipeline.partition_networks(
+        prompt, networks=NetworkEnum.KEEP, merge=MergeEnum.SUM
+    )
+    assert merged == (
+        '<lora:a:0.75> photo, <lora:b:1> <hypernet:c>, man wizard, '
+        '(x <lora:d:1>), a AND <lora:e:1> b'
+    )
+
+    only_networks = pipeline.partition_networks('<lora:a:1>, <lora:b:1>')
+    assert only_networks == '<lora:a:1> <lora:b:1>'
+    assert pipeline.partition_networks('a, b') == 'a, b'
+
+def test_merge_networks():
+    networks = [
+        'lora:a:0.5', 'lora:b', 'lora:a:1', 'lora:b:0.5', 'lora:c:te=1', 'lora:c:te=1'
+    ]
+    assert pipeline.merge_networks(networks, MergeEnum.SUM) == [
+        'lora:a:1.5', 'lora:b:1.5', None, None, 'lora:c:te=1', None
+    ]
+    assert pipeline.merge_networks(networks, MergeEnum.MAX) == [
+        'lora:a:1', 'lora:b', None, None, 'lora:c:te=1', None
+    ]
+
+def test_fold_weights():
+    assert pipeline.fold_weights('((a:0.91):0.91)') == '(a:0.83)'
+    assert pipeline.fold_weights('((a))') == '(a:1.21)'
+    assert pipeline.fold_weights('((a:0.91):0.91)', precision=3) == '(a:0.828)'
+    assert pipeline.fold_weights('((a:1.1):1)') == '(a:1.1)'
+    assert pipeline.fold_weights('((a:1.1):0.9090909), b') == 'a, b'
+    # Groups holding more than a group keep their weight
+    assert pipeline.fold_weights('((a:1.2), b:1.10)') == '((a:1.2), b:1.10)'
+    assert pipeline.fold_weights('(x, ((a:0.91):0.91):1.1)') == '(x, (a:0.83):1.1)'
+    scheduled = '[a|b], [(a):b:0.5], ([a|b]:1.2)'
+    assert pipeline.fold_weights(scheduled) == scheduled
+    assert pipeline.fold_weights(r'\((a)\)') == r'\((a)\)'
+    # Deeper than the recursion limit
+    assert pipeline.fold_weights('([' * 1000 + 'a' + '])' * 1000) == 'a'
+
+def test_fold_weights_split():
+    assert pipeline.fold_weights('(A, B:1.2)', split=True) == '(A:1.20), (B:1.20)'
+    nested = pipeline.fold_weights('(a, (b, c:1.2):1.1)', split=True)
+    assert nested == '(a:1.10), (b:1.32), (c:1.32)'
+    mixed = pipeline.fold_weights('(a, <lora:x:1>, [b|c]:1.2)', split=True)
+    assert mixed == '(a:1.20), <lora:x:1>, ([b|c]:1.20)'
+    assert pipeline.fold_weights('(a:1.2), b', split=True) == '(a:1.2), b'
+
+def test_outside_networks():
+    pattern = pipeline.re_underscore_to_space
+    outside = pipeline.outside_networks(pattern, ' ', 'a_b, <lora:a_b:1>, c_d')
+    assert outside == 'a b, <lora:a_b:1>, c d'
+    assert pipeline.outside_networks(pattern, ' ', 'a_b> c_d') == 'a_b> c d'
+    assert pipeline.outside_networks(pattern, ' ', '<a_b') == '<a b'
@@ -0,0 +1,134 @@
+"""Unit testing for formatting the parameters of PNG images."""
+
+import json
+import os
+import sqlite3
+import struct
+import zlib
+from pathlib import Path
+
+from scripts import prompt_formatting_png as png
+from scripts.prompt_formatting_png import Infotext
+
+
+parameters = (
+    "((masterpiece)),  1girl\nlong_hair\n"
+    "Negative prompt: (worst quality:1.4),lowres\n"
+    "Steps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1"
+)
+
+
+def chunk(kind: bytes, data: bytes):
+    crc = zlib.crc32(kind + data)
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def image(text_chunk: bytes = b""):
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    return (
+        png.SIGNATURE
+        + chunk(b"IHDR", header)
+        + text_chunk
+        + chunk(b"IDAT", zlib.compress(b"\0\0"))
+        + chunk(b"IEND", b"")
+    )
+
+
+def names(index: Path):
+    lines = index.read_text(encoding="utf-8").splitlines()
+    return sorted(Path(json.loads(line)["path"]).name for line in lines)
+
+
+def test_infotext():
+    infotext = Infotext.parse(parameters)
+    assert infotext == Infotext(
+        "((masterpiece)),  1girl\nlong_hair",
+        "(worst quality:1.4),lowres",
+        "Steps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1",
+    )
+    assert Infotext.parse(infotext.to_text()) == infotext
+    # Without enough parameters, the last line is prompt
+    assert Infotext.parse("a\nb: c") == Infotext("a\nb: c", "", "")
+
+def test_find_parameters():
+    for text_chunk in (
+        chunk(b"tEXt", b"parameters\0" + parameters.encode("latin-1")),
+        chunk(b"zTXt", b"parameters\0\0" + zlib.compress(parameters.encode())),
+        chunk(b"iTXt", b"parameters\0\1\0\0\0" + zlib.compress(parameters.encode())),
+        png.encode(parameters),
+    ):
+        found = png.find_parameters(image(chunk(b"tEXt", b"other\0x") + text_chunk))
+        assert found.text == parameters
+    assert png.find_parameters(image()) is None
+
+def test_in_place(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(image(png.encode(parameters)))
+    os.utime(path, ns=(10**18, 10**18))
+
+    record = png.format_file(str(path), png.FormatOptions(), in_place=True)
+    assert record["prompt"] == "(masterpiece:1.21), 1girl\nlong hair"
+    assert record["negative_prompt"] == "(worst quality:1.4), lowres"
+    assert record["changed"]
+    assert path.stat().st_mtime_ns == 10**18
+
+    data = path.read_bytes()
+    assert data.endswith(chunk(b"IDAT", zlib.compress(b"\0\0")) + chunk(b"IEND", b""))
+    text = png.find_parameters(data).text
+    assert text.endswith("\nSteps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1")
+    assert not png.format_file(str(path), png.FormatOptions(), in_place=True)["changed"]
+
+def test_index_resume(tmp_path, capsys):
+    folder = tmp_path / "outputs"
+    (folder / "sub").mkdir(parents=True)
+    (folder / "a.png").write_bytes(image(png.encode(parameters)))
+    (folder / "sub" / "b.png").write_bytes(image(png.encode("a_b, 少女")))
+    (folder / "c.png").write_bytes(image())
+    (folder / "broken.png").write_bytes(b"not a png")
+
+    index = tmp_path / "index.jsonl"
+    png.main(
+        [str(folder), "--index", str(index), "--workers", "2", "--chunk-size", "1"]
+    )
+    assert names(index) == ["a.png", "b.png", "c.png"]
+    records = {
+        Path(r["path"]).name: r
+        for r in map(json.loads, index.read_text(encoding="utf-8").splitlines())
+    }
+    assert records["b.png"]["prompt"] == "a b, 少女"
+    assert records["c.png"]["prompt"] is None
+    assert "read 3 images, 2 with prompts to format" in capsys.readouterr().err
+
+    (folder / "d.png").write_bytes(image(png.encode("d")))
+    with index.open("a", encoding="utf-8") as f:
+        f.write('{"path": "cut sh')
+    png.main([str(folder), "--index", str(index), "--resume", "-q"])
+    assert names(index) == ["a.png", "b.png", "c.png", "d.png"]
+
+    database = tmp_path / "index.db"
+    png.main([str(folder), "--index", str(database), "--in-place", "-q"])
+    png.main([str(folder), "--index", str(database), "--resume", "-q"])
+    with sqlite3.connect(database) as connection:
+        rows = connection.execute("SELECT path FROM images").fetchall()
+    assert sorted(Path(path).name for (path,) in rows) == names(index)
+    text = png.find_parameters((folder / "sub" / "b.png").read_bytes()).text
+    assert text == "a b, 少女"
+
+def test_index_latest(tmp_path, monkeypatch):
+    folder = tmp_path / "outputs"
+    folder.mkdir()
+    (folder / "a.png").write_bytes(image(png.encode("((a))")))
+    (folder / "b.png").write_bytes(image(png.encode("b")))
+
+    index = tmp_path / "index.jsonl"
+    png.main([str(folder), "--index", str(index), "-q"])
+    (folder / "a.png").write_bytes(image(png.encode("[c]")))
+    png.main([str(folder / "a.png"), "--index", str(index), "-q"])
+    records = [json.loads(line) for line in index.read_text("utf-8").splitlines()]
+    assert sorted(r["prompt"] for r in records) == ["(c:0.91)", "b"]
+
+    # Paths given relative to another folder are the same images
+    monkeypatch.chdir(folder)
+    (folder / "d.png").write_bytes(image(png.encode("d")))
+    png.main([".", "--index", str(index), "--resume", "-q"])
+    assert names(index) == ["a.png", "b.png", "d.png"]
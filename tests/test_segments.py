@@ -0,0 +1,64 @@
+"""Unit testing for formatting a prompt one BREAK or line at a time."""
+
+from scripts import prompt_formatting_segments as segments
+from scripts.prompt_formatting_cache import PromptCache
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_formatter import PromptFormatter
+from scripts.prompt_formatting_segments import SegmentedFormatter, split
+from tests.test_engine import prompts
+
+
+def test_split():
+    assert split("a,\nb BREAK c") == (["a", "b", "c"], [",\n", " BREAK "])
+    assert split("\nBREAK a") == (["", "a"], ["\nBREAK "])
+    # Only top level separators cut, BREAK is a word of its own
+    assert split("(a\nb), c BREAK\n\nd") == (["(a\nb), c", "d"], [" BREAK\n\n"])
+    assert split("xBREAK y, <a\nb>") == (["xBREAK y, <a\nb>"], [])
+    assert split("(a \n b") == (["(a \n b"], [])
+    assert split("a) \n(b") == (["a)", "(b"], [" \n"])
+    assert split("\\(a\nb") == (["\\(a", "b"], ["\n"])
+
+def test_format():
+    formatter = SegmentedFormatter()
+    assert formatter.format("((a)),b ,\nBREAK\n c_d") == "(a:1.21), b ,\nBREAK\n c d"
+    assert formatter.format("a,\nb") == "a,\nb"
+    assert formatter.format("(a\nb), c\n\nd") == "(a\nb:1.10), c\n\nd"
+
+    # Without separators, a prompt formats as a whole
+    whole = PromptFormatter(formatter.options)
+    for prompt in prompts:
+        if not segments.split(prompt)[1]:
+            assert formatter.format(prompt) == whole.format(prompt)
+
+def test_cache():
+    cache = PromptCache()
+    formatter = SegmentedFormatter(FormatOptions(), cache=cache)
+    lines = [f"((tag {i})), other_tag" for i in range(100)]
+    formatter.format("\n".join(lines))
+    assert cache.misses == len(lines)
+
+    lines[50] = "((edited))"
+    assert formatter.format("\n".join(lines)).split("\n")[50] == "(edited:1.21)"
+    assert cache.misses == len(lines) + 1
+
+def test_workers():
+    lines = [f"((tag {i})),  other_tag" for i in range(2 * segments.PARALLEL_SEGMENTS)]
+    prompt = " BREAK ".join(lines)
+    formatter = SegmentedFormatter(workers=2)
+    try:
+        assert formatter.format(prompt) == SegmentedFormatter().format(prompt)
+        assert formatter.executor is not None
+    finally:
+        formatter.close()
+
+def test_budget():
+    cache = PromptCache()
+    formatter = SegmentedFormatter(cache=cache, budget=1)
+    assert formatter.format("((a)),b\nc_d") == "(a:1.21), b\nc d"
+    stored = [segment for segment, _ in cache.entries]
+    assert stored == ["((a)),b", "c_d"]
+
+    slow = "((a)), " + "b_" * 200000
+    formatter.budget = 0.01
+    assert formatter.format(f"c_d\n{slow}").startswith("c d\n((a)), b_")
+    assert [segment for segment, _ in cache.entries] == stored
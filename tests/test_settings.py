@@ -0,0 +1,62 @@
+"""Unit testing for the extension's settings and the session they configure."""
+
+from types import SimpleNamespace
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_settings as settings
+from scripts import prompt_formatting_tags as tags
+from scripts.prompt_formatting_definitions import (
+    FormatOptions,
+    NetworkEnum,
+    UnderSpaceEnum,
+)
+
+
+def test_format_options():
+    assert settings.format_options(SimpleNamespace()) == FormatOptions()
+    opts = SimpleNamespace(
+        pformat_preferspacing="Ignore",
+        pformat_networks="End",
+        pformat_weight_precision=3.0,
+    )
+    assert settings.format_options(opts) == FormatOptions(
+        prefer_spacing=UnderSpaceEnum.IGNORE,
+        networks=NetworkEnum.END,
+        weight_precision=3,
+    )
+
+def test_every_option_has_a_setting():
+    assert set(settings.OPTION_KEYS) == set(FormatOptions._fields)
+    assert set(settings.OPTION_KEYS.values()) <= set(settings.defaults)
+    assert set(settings.FILE_KEYS) <= set(settings.defaults)
+
+def test_session_follows_settings():
+    session = settings.Session()
+    session.sync(SimpleNamespace())
+    formatter = session.formatter
+    assert session.format("((a_b)),c") == engine.format_prompt("((a_b)),c")
+
+    opts = SimpleNamespace(pformat_preferspacing="Ignore", pformat_cache_mb=0)
+    session.sync(opts)
+    assert session.formatter is not formatter
+    assert session.segmenter.options == session.formatter.options
+    assert session.format("((a_b)),c") == "(a_b:1.21), c"
+    assert session.cache.max_bytes == 0
+
+    formatter = session.formatter
+    session.sync(opts)
+    assert session.formatter is formatter
+
+def test_session_clears_cache_on_new_files():
+    session = settings.Session()
+    session.sync(SimpleNamespace())
+    session.format("a ,b")
+    assert len(session.cache)
+
+    session.sync(SimpleNamespace(pformat_tags_file="missing.csv"))
+    try:
+        assert len(session.cache) == 0
+        assert tags.path == "missing.csv"
+    finally:
+        session.sync(SimpleNamespace())
+    assert tags.path == ""
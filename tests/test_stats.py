@@ -0,0 +1,64 @@
+"""Unit testing for per-stage timings and counters."""
+
+import json
+from itertools import product
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_stats as stats
+from scripts.prompt_formatting_definitions import UnderSpaceEnum
+
+
+def test_histogram():
+    histogram = stats.Histogram()
+    assert histogram.percentile(50) == 0.0
+
+    for value in (3e-6, 4e-6, 1.5e-3, 20.0):
+        histogram.add(value)
+    assert (histogram.count, histogram.min, histogram.max) == (4, 3e-6, 20.0)
+    assert [histogram.percentile(p) for p in (50, 75, 100)] == [5e-6, 2e-3, 20.0]
+    assert histogram.to_dict()["buckets"] == {"<=5e-06": 2, "<=0.002": 1, ">10": 1}
+
+def test_recorded_format():
+    prompts = ["((a)), [[b]]  ,  c_d", "a_b AND (c:1.2)", "((x:1.1))", " , a b,"]
+    for mode in UnderSpaceEnum:
+        for prompt in prompts:
+            for bracket2weight, pack_chunks in product((True, False), repeat=2):
+                options = {
+                    "prefer_spacing": mode,
+                    "bracket2weight": bracket2weight,
+                    "pack_chunks": pack_chunks,
+                }
+                plain = engine.format_prompt(prompt, **options)
+                recorded = engine.format_prompt_recorded(
+                    prompt, stats.Recorder(), **options
+                )
+                assert recorded == plain
+
+def test_recorder(tmp_path):
+    try:
+        recorder = stats.enable()
+        assert stats.enable() is recorder
+        engine.format_prompt("((a)), [[b]]  ,  c_d")
+        engine.format_prompt("((x:1.1))", bracket2weight=False)
+    finally:
+        stats.disable()
+    assert stats.recorder is None
+
+    assert recorder.counters == {
+        "prompts": 2,
+        "skipped.normalize_characters": 2,
+        "bracket_to_weights.rewrites": 2,
+    }
+    assert "normalize_characters" not in recorder.stages
+    length = len("((a)), [[b]]  ,  c_d") + len("((x:1.1))")
+    assert recorder.stages["remove_mismatched_brackets"].length_in == length
+    assert recorder.stages["emit"].seconds.count == 1
+    assert recorder.stages["normalize_spacing"].seconds.count == 1
+    assert recorder.stages["splice"].seconds.count == 1
+    assert "to_underscores" not in recorder.stages
+
+    path = tmp_path / "stats.json"
+    recorder.dump(path)
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data["stages"]["emit"]["seconds"]["count"] == 1
+    assert data["counters"] == recorder.counters
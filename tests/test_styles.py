@@ -0,0 +1,62 @@
+"""Unit testing for formatting a styles.csv."""
+
+import codecs
+
+from scripts import prompt_formatting_styles as styles
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_formatter import PromptFormatter
+from scripts.prompt_formatting_styles import MemoFormatter, format_styles
+from tests.test_engine import prompts
+
+
+csv = (
+    "name,prompt,negative_prompt\r\n"
+    'quality,"{prompt}, ((masterpiece)),best_quality","((worst quality)),  lowres"\r\n'
+    'multi,"((masterpiece)),\r\nline two",\r\n'
+    "plain,a b,\r\n"
+    "moved,{prompt} (a,\r\n"
+)
+
+
+def test_memo_formatter():
+    formatter = MemoFormatter()
+    reference = PromptFormatter()
+    for prompt in prompts:
+        assert formatter.format(prompt) == reference.format(prompt)
+    misses = formatter.misses
+    for prompt in prompts:
+        assert formatter.format(prompt + ", x") == reference.format(prompt + ", x")
+    assert formatter.misses - misses <= 1
+
+def test_format_styles(tmp_path):
+    path = tmp_path / "styles.csv"
+    path.write_bytes(codecs.BOM_UTF8 + csv.encode())
+
+    report = format_styles(str(path))
+    assert (report.styles, report.changed, report.skipped) == (4, 3, 0)
+    assert path.read_bytes() == codecs.BOM_UTF8 + (
+        b"name,prompt,negative_prompt\r\n"
+        b'quality,"{prompt}, (masterpiece:1.21), best quality",'
+        b'"(worst quality:1.21), lowres"\r\n'
+        b'multi,"(masterpiece:1.21), \r\nline two",\r\n'
+        b"plain,a b,\r\n"
+        b"moved,{prompt} a,\r\n"
+    )
+    assert "4 styles" in report.summary()
+
+    # Unchanged styles are not written again
+    modified = path.stat().st_mtime_ns
+    assert format_styles(str(path)).changed == 0
+    assert path.stat().st_mtime_ns == modified
+    assert [p.name for p in tmp_path.iterdir()] == ["styles.csv"]
+
+def test_placeholder(tmp_path, capsys):
+    path = tmp_path / "styles.csv"
+    path.write_text("name,prompt\nx,\"{prompt}, a, a\"\n", encoding="utf-8")
+    target = tmp_path / "out.csv"
+    styles.main([str(path), "-o", str(target), "--spacing", "Ignore"])
+    assert target.read_text(encoding="utf-8") == "name,prompt\nx,\"{prompt}, a, a\"\n"
+    assert "1 styles" in capsys.readouterr().err
+
+    formatter = MemoFormatter(FormatOptions())
+    assert styles.format_style("{prompt}, ((a))", formatter) == "{prompt}, (a:1.21)"
@@ -0,0 +1,89 @@
+"""Unit testing for the tag index and the Tags spacing."""
+
+import os
+
+import pytest
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts import prompt_formatting_tags as tags
+from scripts.prompt_formatting_batch import format_prompts
+from scripts.prompt_formatting_definitions import FormatOptions, UnderSpaceEnum
+from scripts.prompt_formatting_formatter import PromptFormatter
+from scripts.prompt_formatting_tags import TagIndex
+from tests.test_engine import prompts
+
+
+csv = """1girl,0,4114588,
+long_hair,0,2870845,
+ganyu_(genshin_impact),4,10373,
+^_^,0,30254,
+blue_eyes,0,1644549,
+Long Hair,0,1,
+"""
+
+
+@pytest.fixture
+def tag_list(tmp_path):
+    path = tmp_path / "danbooru.csv"
+    path.write_text(csv, encoding="utf-8")
+    tags.configure(str(path))
+    yield path
+    tags.configure("")
+
+
+def test_index():
+    index = TagIndex(TagIndex.build(["long_hair", "a b", "Long Hair", "少女 x"]))
+    assert index.get("long hair") == "long_hair"
+    assert index.get("LONG_HAIR") == "long_hair"
+    assert index.get("a_b") == "a b"
+    assert index.get("少女_x") == "少女 x"
+    assert index.get("long") is None
+    with pytest.raises(ValueError):
+        TagIndex(b"not an index")
+
+def test_to_tags(tag_list):
+    assert tags.to_tags(
+        "Long hair, ^_^, ganyu \\(genshin impact\\), standing in a field"
+    ) == "Long_hair, ^_^, ganyu_\\(genshin_impact\\), standing in a field"
+    assert tags.to_tags("(blue eyes:1.2) AND long hair BREAK blue eyes") == (
+        "(blue_eyes:1.2) AND long_hair BREAK blue_eyes"
+    )
+    # Networks are never looked up
+    assert tags.to_tags("<lora:long hair:1>") == "<lora:long hair:1>"
+
+    tags.configure("")
+    assert tags.to_tags("long hair") == "long hair"
+
+def test_index_file(tag_list):
+    index = tags.get_index()
+    assert isinstance(index.buffer, tags.mmap.mmap)
+    indexed = tag_list.with_name(tag_list.name + tags.SUFFIX)
+    built = indexed.stat().st_mtime_ns
+
+    tags.configure("")
+    tags.configure(str(tag_list))
+    assert tags.get_index() is not index
+    assert indexed.stat().st_mtime_ns == built
+
+    # A changed list is indexed again
+    tag_list.write_text("long hair\n", encoding="utf-8")
+    os.utime(tag_list, ns=(built + 10**9, built + 10**9))
+    tags.configure("")
+    tags.configure(str(tag_list))
+    assert tags.get_index().get("long_hair") == "long hair"
+
+def test_tags_spacing(tag_list):
+    options = FormatOptions(prefer_spacing=UnderSpaceEnum.TAGS)
+    formatter = PromptFormatter(options)
+    for prompt in [*prompts, "((long hair)),ganyu (genshin impact)  ,  1girl"]:
+        expected = engine.format_prompt(prompt, **options._asdict())
+        assert formatter.format(prompt) == expected
+        if "\\" not in prompt:
+            assert pipeline.format_prompt(prompt, **options._asdict()) == expected
+
+    expected = "(long_hair:1.21), blue_eyes"
+    assert formatter.format("((long hair)),  blue eyes") == expected
+    assert format_prompts(["long hair"] * 4, options, workers=2, chunk_size=1) == [
+        "long_hair"
+    ] * 4
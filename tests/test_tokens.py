@@ -0,0 +1,62 @@
+"""Unit testing for CLIP token counts, chunks and packing."""
+
+import pytest
+
+from scripts import prompt_formatting_engine as engine
+from scripts import prompt_formatting_pipeline as pipeline
+from scripts import prompt_formatting_tokens as tokens
+from scripts.prompt_formatting_definitions import FormatOptions
+from scripts.prompt_formatting_formatter import PromptFormatter
+from scripts.prompt_formatting_tokens import Chunk, Encoder, Estimate, analyze, pack
+
+
+@pytest.fixture
+def estimate():
+    tokens.configure("")
+    tokens.encoder = Estimate()
+    yield tokens.encoder
+    tokens.configure("")
+
+
+def test_encoder(tmp_path):
+    merges = tmp_path / "merges.txt"
+    merges.write_text("#version: 0.2\nh e\nl l\nhe ll\nhell o</w>\n", encoding="utf-8")
+    encoder = Encoder.load(str(merges))
+    counts = [encoder.count(text) for text in ("hello", "Hello  hello", "help", "")]
+    assert counts == [1, 2, 3, 0]
+
+def test_analyze(estimate):
+    assert analyze("a, (b:1.2) BREAK c").sections == [[Chunk(0, 3), Chunk(17, 1)]]
+    assert analyze("").sections == [[Chunk(0, 0)]]
+    # Networks and weights are not tokens, AND sections are counted apart
+    analysis = analyze("a b <lora:x:1> AND c:0.5")
+    assert analysis.sections == [[Chunk(0, 2)], [Chunk(19, 1)]]
+    assert (analysis.passes, analysis.tokens) == (2, 2)
+
+def test_comma_backtrack(estimate):
+    # 70 tokens, a comma, then 10 more tags: the last ones move to chunk two
+    prompt = " ".join(["a"] * 70) + ", " + " ".join(["b"] * 10)
+    assert analyze(prompt).sections[0] == [Chunk(0, 71), Chunk(prompt.index("b"), 10)]
+    # Without a comma close enough, the chunk is cut at 75
+    prompt = "a, " + " ".join(["b"] * 80)
+    assert [c.tokens for c in analyze(prompt).sections[0]] == [75, 7]
+
+def test_pack(estimate):
+    tags = [" ".join([c] * n) for c, n in (("a", 60), ("b", 60), ("c", 10), ("d", 10))]
+    prompt = ", ".join(tags)
+    packed = pack(prompt)
+    assert packed == ", ".join([tags[0], tags[2], tags[1], tags[3]])
+    assert [analyze(p).passes for p in (prompt, packed)] == [3, 2]
+    # Repeated tags are dropped, and tags stay on their side of BREAK
+    long = " ".join(["x"] * 74)
+    assert pack(f"{long}, {long}, y BREAK z") == f"{long}, y BREAK z"
+    assert pack("a, a, b") == "a, a, b"
+
+def test_pack_chunks(estimate):
+    options = FormatOptions(pack_chunks=True)
+    formatter = PromptFormatter(options)
+    prompt = ", ".join(["a " * 60, "(" + "b " * 60 + ")", "c " * 10, "d " * 10])
+    expected = engine.format_prompt(prompt, **options._asdict())
+    assert [analyze(p).passes for p in (prompt, expected)] == [3, 2]
+    assert formatter.format(prompt) == expected
+    assert pipeline.format_prompt(prompt, **options._asdict()) == expected